@@ -0,0 +1,257 @@
+"""
+Offline library boundary check. The service area polygon is loaded once
+from a GeoJSON or Esri JSON export and point-in-polygon queries are
+answered locally; the town's MapServer is only used to refresh the export.
+
+usage:
+    python -m chplpatron.boundary
+        downloads the current polygon to BOUNDARY_POLYGON_PATH
+"""
+__author__ = "Jeremy Nelson, Mike Stabile"
+
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+import requests
+
+from instance import config
+
+# the layer queried by geosearch.BOUNDARY_CHECK_URL
+POLYGON_URL = getattr(config,
+                      "BOUNDARY_POLYGON_URL",
+                      "https://gisweb.townofchapelhill.org/arcgis/rest/"
+                      "services/MapServices/ToCH_OrangeCo_CombinedLimits/"
+                      "MapServer/0/query?where=1%3D1&returnGeometry=true"
+                      "&outSR=4326&f=json")
+POLYGON_PATH = getattr(config, "BOUNDARY_POLYGON_PATH", None)
+# seconds between checks of the polygon file for a newer export
+RELOAD_INTERVAL = getattr(config, "BOUNDARY_RELOAD_INTERVAL", 60)
+# seconds between the boundary_refresh jobs downloading the polygon
+REFRESH_INTERVAL = getattr(config, "BOUNDARY_REFRESH_INTERVAL", 24 * 3600)
+GRID_SIZE = 64
+
+MERCATOR_WKIDS = {102100, 102113, 3857, 900913}
+EARTH_RADIUS = 6378137.0
+
+log = logging.getLogger(__name__)
+
+
+def _from_mercator(x, y):
+    return (math.degrees(x / EARTH_RADIUS),
+            math.degrees(2 * math.atan(math.exp(y / EARTH_RADIUS))
+                         - math.pi / 2))
+
+
+def parse_shapes(data):
+    """
+    Reads the polygons of a GeoJSON or Esri JSON document. Web mercator Esri
+    geometries are converted to longitude/latitude.
+
+    :param data: the decoded json document
+    :return: list of shapes, each a list of rings of (x, y) tuples. A point
+             is within a shape if it is within an odd number of its rings.
+    """
+    shapes = []
+    convert = None
+    wkid = (data.get('spatialReference') or {}).get('wkid')
+    if wkid in MERCATOR_WKIDS:
+        convert = _from_mercator
+    if data.get('type') == 'FeatureCollection':
+        geometries = [feature.get('geometry') or {}
+                      for feature in data.get('features', [])]
+    elif data.get('type') == 'Feature':
+        geometries = [data.get('geometry') or {}]
+    elif 'features' in data:
+        geometries = [feature.get('geometry') or {}
+                      for feature in data['features']]
+    else:
+        geometries = [data]
+    for geometry in geometries:
+        if 'rings' in geometry:
+            polygons = [geometry['rings']]
+        elif geometry.get('type') == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif geometry.get('type') == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            continue
+        for rings in polygons:
+            shape = []
+            for ring in rings:
+                points = [tuple(point[:2]) for point in ring]
+                if convert:
+                    points = [convert(*point) for point in points]
+                if len(points) > 2:
+                    shape.append(points)
+            if shape:
+                shapes.append(shape)
+    return shapes
+
+
+class BoundaryIndex:
+    """
+    Point-in-polygon index over the shapes of a boundary. The bounding box
+    of the shapes is split into a grid; cells no edge passes through are
+    entirely inside or outside and answered from the grid. Other points are
+    ray cast against only the edges of their grid row.
+
+    :param shapes: list of shapes as returned by parse_shapes
+    :param grid_size: number of grid rows and columns
+
+    :example:
+        index = BoundaryIndex(parse_shapes(json.load(export)))
+        index.contains(-79.0356, 35.9323)
+            True
+    """
+
+    def __init__(self, shapes, grid_size=GRID_SIZE):
+        if not shapes:
+            raise ValueError("The boundary has no polygons")
+        self.shapes = shapes
+        self.grid_size = grid_size
+        points = [point for shape in shapes for ring in shape
+                  for point in ring]
+        self.min_x = min(point[0] for point in points)
+        self.min_y = min(point[1] for point in points)
+        self.max_x = max(point[0] for point in points)
+        self.max_y = max(point[1] for point in points)
+        self.cell_w = (self.max_x - self.min_x) / grid_size or 1.0
+        self.cell_h = (self.max_y - self.min_y) / grid_size or 1.0
+        self._rows = [[] for _ in range(grid_size)]
+        mixed = [[False] * grid_size for _ in range(grid_size)]
+        for shape_id, shape in enumerate(shapes):
+            for ring in shape:
+                for i in range(len(ring)):
+                    x1, y1 = ring[i - 1]
+                    x2, y2 = ring[i]
+                    if y1 == y2 and x1 == x2:
+                        continue
+                    row1, row2 = sorted((self._row(y1), self._row(y2)))
+                    col1, col2 = sorted((self._col(x1), self._col(x2)))
+                    edge = (shape_id, x1, y1, x2, y2)
+                    for row in range(row1, row2 + 1):
+                        self._rows[row].append(edge)
+                        for col in range(col1, col2 + 1):
+                            mixed[row][col] = True
+        self._cells = [[None if mixed[row][col] else
+                        self._ray_cast(self.min_x + (col + .5) * self.cell_w,
+                                       self.min_y + (row + .5) * self.cell_h,
+                                       row)
+                        for col in range(grid_size)]
+                       for row in range(grid_size)]
+
+    def contains(self, x, y):
+        """
+        :param x: longitude
+        :param y: latitude
+        :return: True if the point is within the boundary
+        """
+        if not (self.min_x <= x <= self.max_x
+                and self.min_y <= y <= self.max_y):
+            return False
+        row = self._row(y)
+        cell = self._cells[row][self._col(x)]
+        if cell is not None:
+            return cell
+        return self._ray_cast(x, y, row)
+
+    def _row(self, y):
+        return min(max(int((y - self.min_y) / self.cell_h), 0),
+                   self.grid_size - 1)
+
+    def _col(self, x):
+        return min(max(int((x - self.min_x) / self.cell_w), 0),
+                   self.grid_size - 1)
+
+    def _ray_cast(self, x, y, row):
+        inside = set()
+        for shape_id, x1, y1, x2, y2 in self._rows[row]:
+            if (y1 > y) != (y2 > y) \
+                    and x < x1 + (y - y1) * (x2 - x1) / (y2 - y1):
+                inside ^= {shape_id}
+        return bool(inside)
+
+
+_INDEX = None
+_MTIME = None
+_CHECKED = 0.0
+_LOCK = threading.Lock()
+
+
+def load(path):
+    """
+    :param path: path of a GeoJSON or Esri JSON boundary export
+    :return: BoundaryIndex of the export
+    """
+    with open(path, "r") as data:
+        return BoundaryIndex(parse_shapes(json.load(data)))
+
+
+def get_index():
+    """
+    Returns the boundary index of POLYGON_PATH, reloading it when the file
+    has been replaced by a refresh
+
+    :return: BoundaryIndex or None when no polygon export is available
+    """
+    global _INDEX, _MTIME, _CHECKED
+    if not POLYGON_PATH:
+        return None
+    now = time.time()
+    if _INDEX is not None and now - _CHECKED < RELOAD_INTERVAL:
+        return _INDEX
+    with _LOCK:
+        _CHECKED = now
+        try:
+            mtime = os.path.getmtime(POLYGON_PATH)
+        except OSError:
+            return _INDEX
+        if mtime != _MTIME:
+            try:
+                _INDEX = load(POLYGON_PATH)
+                _MTIME = mtime
+            except (OSError, ValueError) as err:
+                log.error("Unable to load boundary %s: %s",
+                          POLYGON_PATH, err)
+    return _INDEX
+
+
+def contains(x, y):
+    """
+    :param x: longitude
+    :param y: latitude
+    :return: True or False, or None when no polygon export is available
+    """
+    index = get_index()
+    if index is None:
+        return None
+    return index.contains(float(x), float(y))
+
+
+def refresh(url=None, path=None):
+    """
+    Downloads the boundary polygon and replaces the export once it has been
+    parsed successfully. Workers load the new export within RELOAD_INTERVAL.
+
+    :param url: MapServer query url, defaults to POLYGON_URL
+    :param path: export path, defaults to POLYGON_PATH
+    :return: number of shapes in the boundary
+    """
+    path = path or POLYGON_PATH
+    response = requests.get(url or POLYGON_URL, timeout=(3.05, 60))
+    response.raise_for_status()
+    data = response.json()
+    index = BoundaryIndex(parse_shapes(data))
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w") as out:
+        json.dump(data, out)
+    os.replace(tmp_path, path)
+    return len(index.shapes)
+
+
+if __name__ == '__main__':
+    print("Saved {} shapes to {}".format(refresh(), POLYGON_PATH))
@@ -15,7 +15,7 @@ def get_text(response):
     """
     try:
         return pprint.pformat(response.json())
-    except JSONDecodeError:
+    except (JSONDecodeError, ValueError):
         return pprint.pformat(response.text)
 
 
@@ -46,12 +46,12 @@ class TokenError(Exception):
         self.key = key
         self.secret = secret
         self.response = response
-        super().__init__("{}\n\tkey: '{}'{}"
-                         .format(message,
-                                 key,
-                                 RESPONSE_TEMPLATE.format(response.url,
-                                                          response.status_code,
-                                                          get_text(response))))
+        details = ""
+        if response is not None:
+            details = RESPONSE_TEMPLATE.format(response.url,
+                                               response.status_code,
+                                               get_text(response))
+        super().__init__("{}\n\tkey: '{}'{}".format(message, key, details))
 
 
 class RemoteApiError(Exception):
@@ -62,6 +62,14 @@ class RemoteApiError(Exception):
                                                   get_text(response)))
 
 
+class CircuitOpenError(Exception):
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__("'{}' is unavailable, retrying in {:.0f} seconds"
+                         .format(name, retry_after))
+
+
 class PasswordError(Exception):
     def __init__(self, response):
         self.response = response
@@ -2,13 +2,22 @@
 Module for validating address information for a patron
 """
 
+import os
 import re
 import requests
 import urllib
 import json
 
 from chplpatron.exceptions import *
-from chplpatron.utilities import urlencode_dict
+from chplpatron import boundary
+from chplpatron import postaldb
+from chplpatron.utilities import urlencode_dict, PooledSession
+from chplpatron.utilities.endpoints import Endpoint
+from chplpatron.postaldb import states
+from chplpatron.utilities.caching import (TTLCache,
+                                          SqliteCacheStore,
+                                          cached)
+from chplpatron.utilities.singleflight import SingleFlight, coalesce
 
 from instance import config
 
@@ -36,6 +45,70 @@ BOUNDARY_CHECK_URL_NEW = ("https://gisweb.townofchapelhill.org/arcgis/rest/"
                           "SingleLine={street}, {city}, {state}, {postal_code}"
                           "&magicKey={api_key}&f=pjson&matchOutofRange=false")
 
+# every remote geo service has its own timeout and circuit breaker, a slow
+# or failing service is given up on quickly and the local postal database
+# or boundary export is used instead
+GEO_SESSION = PooledSession(pool_size=getattr(config, "GEO_POOL_SIZE", 10),
+                            retries=getattr(config, "GEO_RETRIES", 1))
+GEO_TIMEOUTS = {"postal_code": (3.05, 5),
+                "geocode": (3.05, 10),
+                "boundary": (3.05, 10)}
+GEO_TIMEOUTS.update(getattr(config, "GEO_TIMEOUTS", {}))
+ENDPOINTS = {name: Endpoint(
+                 name,
+                 GEO_SESSION,
+                 timeout=timeout,
+                 failure_threshold=getattr(config,
+                                           "GEO_BREAKER_THRESHOLD", 5),
+                 reset_timeout=getattr(config, "GEO_BREAKER_RESET", 30),
+                 hedge=getattr(config, "GEO_HEDGE_REQUESTS", False))
+             for name, timeout in GEO_TIMEOUTS.items()}
+
+# postal code -> city/state rarely changes so the lookups are cached for a
+# week, invalid codes for a day. The caches are shared between the gunicorn
+# workers through the GEO_CACHE_DB sqlite file, set it to None to keep them
+# in memory only.
+GEO_CACHE_DB = getattr(config,
+                       "GEO_CACHE_DB",
+                       os.path.join(os.path.dirname(__file__),
+                                    "geo-cache.sqlite"))
+POSTAL_CACHE = TTLCache(
+    maxsize=getattr(config, "POSTAL_CACHE_SIZE", 4096),
+    ttl=getattr(config, "POSTAL_CACHE_TTL", 7 * 24 * 3600),
+    negative_ttl=getattr(config, "POSTAL_CACHE_NEGATIVE_TTL", 24 * 3600),
+    store=SqliteCacheStore(GEO_CACHE_DB, "postal_code")
+    if GEO_CACHE_DB else None)
+
+# coordinates and boundary verdicts of normalized addresses
+GEOCODE_CACHE = TTLCache(
+    maxsize=getattr(config, "GEOCODE_CACHE_SIZE", 4096),
+    ttl=getattr(config, "GEOCODE_CACHE_TTL", 30 * 24 * 3600),
+    store=SqliteCacheStore(GEO_CACHE_DB, "geocode")
+    if GEO_CACHE_DB else None)
+# seconds between the geo_cache_purge jobs removing expired cache entries
+GEO_CACHE_PURGE_INTERVAL = getattr(config,
+                                   "GEO_CACHE_PURGE_INTERVAL",
+                                   24 * 3600)
+
+# concurrent identical lookups, i.e. overlapping postal_code and
+# boundary_check requests fired while a patron tabs through the form, share
+# one outbound request
+GEO_FLIGHT = SingleFlight()
+
+STREET_ABBREVIATIONS = {
+    "AVENUE": "AVE", "BOULEVARD": "BLVD", "CIRCLE": "CIR", "COURT": "CT",
+    "DRIVE": "DR", "EXTENSION": "EXT", "HIGHWAY": "HWY", "LANE": "LN",
+    "PARKWAY": "PKWY", "PLACE": "PL", "ROAD": "RD", "SQUARE": "SQ",
+    "STREET": "ST", "TERRACE": "TER", "TRAIL": "TRL", "NORTH": "N",
+    "SOUTH": "S", "EAST": "E", "WEST": "W", "NORTHEAST": "NE",
+    "NORTHWEST": "NW", "SOUTHEAST": "SE", "SOUTHWEST": "SW"
+}
+# apartment and unit designators do not change the location of a building:
+# a trailing designator followed by its number, i.e. 'APT 3' or 'STE B', but
+# not the street names in '100 LOT RD' or '12 STEM'
+UNIT_RE = re.compile(r'(\s(APT|APARTMENT|UNIT|STE|SUITE|BLDG|LOT|RM)'
+                     r'(\s+|\s*#\s*)([\w-]*\d[\w-]*|[A-Z]))+$')
+
 #BOUNDARY_CHECK_URL_NEW = ("https://gisweb.townofchapelhill.org/arcgis/rest/"
 #                          "services/Locators/CH_Points_Address_Locator/"
 #                          "GeocodeServer/findAddressCandidates?"
@@ -45,21 +118,20 @@ BOUNDARY_CHECK_URL_NEW = ("https://gisweb.townofchapelhill.org/arcgis/rest/"
 #                          "ZIP={postal_code}&"
 #                          "magicKey={api_key}&f=pjson&matchOutofRange=false")
 
+@cached(POSTAL_CACHE, negative=InvalidPostalCode)
+@coalesce(GEO_FLIGHT, key=lambda postal_code: ("postal_code",
+                                               str(postal_code)))
 def get_postal_code(postal_code):
     """
-    Queries the ARCGIS server for locale information of a zipcode
+    Queries the ARCGIS server for locale information of a zipcode. Results,
+    including invalid postal codes, are cached in POSTAL_CACHE.
 
     :param postal_code: 5 digit postal code to search
     :return: response json
     """
     url = POSTAL_CODE_CHECK_URL.format(postal_code)
 
-    try:
-        response = requests.get(url)
-    except requests.exceptions.ConnectionError:
-        raise RemoteApiError("Not able to connect to ARCGIS api")
-    # except Exception as e:
-    #     pass
+    response = ENDPOINTS['postal_code'].get(url)
     if response.status_code < 399:
         locs = [dict(zip(POSTAL_KEYS,
                          [part.strip()
@@ -69,11 +141,49 @@ def get_postal_code(postal_code):
             return locs
         raise InvalidPostalCode(postal_code)
 
-    raise RemoteApiError(url, response)
+    raise RemoteApiError(response)
+
+
+def cache_stats():
+    """
+    :return: dict of the postal code cache hit and miss statistics
+    """
+    return POSTAL_CACHE.stats()
+
+
+def purge_cache():
+    """
+    Removes the expired entries of the postal code and geocode caches, run
+    by the geo_cache_purge job
+
+    :return: number of entries removed from the shared store
+    """
+    return POSTAL_CACHE.purge() + GEOCODE_CACHE.purge()
+
+
+def endpoint_metrics():
+    """
+    :return: dict of the call, latency and circuit breaker metrics of each
+             remote geo service
+    """
+    return {name: endpoint.metrics() for name, endpoint in ENDPOINTS.items()}
+
+
+def flight_stats():
+    """
+    :return: dict of the number of remote lookups and of the lookups that
+             shared an identical lookup in flight
+    """
+    return GEO_FLIGHT.stats()
 
 
 def update_city(postal_code, city="",  **kwargs):
-    locations = get_postal_code(postal_code)
+    try:
+        locations = get_postal_code(postal_code)
+    except (requests.RequestException, RemoteApiError, CircuitOpenError):
+        # the local postal database answers while the remote service is
+        # failing or its circuit is open
+        locations = postaldb.get_postal_code(str(postal_code))
     for loc in locations:
         if city.strip().lower() == loc['city'].lower() or city == "":
             kwargs['city'] = loc['city']
@@ -93,9 +203,48 @@ def clean_street(street):
     return re.sub(r'#.*', "", street).strip()
 
 
+def normalize_address(address):
+    """
+    Builds the canonical form of an address used as geocode cache key, i.e.
+    '100 Library Drive, chapel hill' and '100  LIBRARY DR.' in the same
+    postal code have the same key.
+
+    :param address: dict with keys ['street', 'city', 'state', 'postal_code']
+    :return: string key
+    """
+    street = clean_street(str(address.get('street', ''))).upper()
+    street = re.sub(r'[.,]', ' ', street)
+    street = UNIT_RE.sub('', ' '.join(street.split()))
+    street = ' '.join(STREET_ABBREVIATIONS.get(word, word)
+                      for word in street.split())
+    state = str(address.get('state', '')).strip()
+    try:
+        state = states.get_abbreviation(state)
+    except (InvalidState, IndexError, KeyError):
+        pass
+    parts = urlencode_dict({
+        'street': street,
+        'city': ' '.join(str(address.get('city', '')).upper().split()),
+        'state': state.upper(),
+        'postal_code': str(address.get('postal_code', '')).strip()[:5]})
+    return "{street}|{city}|{state}|{postal_code}".format(**parts)
+
+
+def _cached_geocode(key):
+    entry = GEOCODE_CACHE.get(key, None)
+    return dict(entry) if entry else {}
+
+
+def _cache_geocode(key, **values):
+    entry = _cached_geocode(key)
+    entry.update(values)
+    GEOCODE_CACHE.set(key, entry)
+
+
 def get_geo_coords(address):
     """
-    Queries ARCGIS server to find lat long of the supplied address
+    Queries ARCGIS server to find lat long of the supplied address.
+    Coordinates are cached in GEOCODE_CACHE by normalized address.
 
     :param address: dict with keys ['street', 'city', 'state', 'postal_code']
     :return: dict with keys ['x', 'y']
@@ -105,16 +254,27 @@ def get_geo_coords(address):
     #                                   city=address['city'],
     #                                   state=address['state'],
     #                                   postal_code=address['postal_code'])
+    key = normalize_address(address)
+    entry = _cached_geocode(key)
+    if 'x' in entry:
+        address.update({'x': entry['x'], 'y': entry['y']})
+        return address
     url = GEO_FROM_ADDRESS_URL.format(**urlencode_dict(address))
+    address.update(_geocode(key, url))
+    return address
 
-    response = requests.get(url)
+
+@coalesce(GEO_FLIGHT, key=lambda key, url: ("geocode", key))
+def _geocode(key, url):
+    response = ENDPOINTS['geocode'].get(url)
     if response.status_code < 399:
-        address.update(response.json().get('locations', [{}])[0]
-                                      .get('feature', {})
-                                      .get('geometry', {'x': '', 'y': ''}))
-        return address
+        geometry = dict(response.json().get('locations', [{}])[0]
+                                       .get('feature', {})
+                                       .get('geometry', {'x': '', 'y': ''}))
+        _cache_geocode(key, x=geometry.get('x', ''), y=geometry.get('y', ''))
+        return geometry
 
-    raise RemoteApiError(url, response)
+    raise RemoteApiError(response)
 
 
 def check_boundary_coords(coords):
@@ -125,13 +285,16 @@ def check_boundary_coords(coords):
     :param coords: dict with keys ['x', 'y']
     :return: boolean 'true' = within boundary 'false' = not in boundary
     """
+    within = boundary.contains(coords['x'], coords['y'])
+    if within is not None:
+        return within
 
     url = BOUNDARY_CHECK_URL.format(**coords)
-    response = requests.get(url)
+    response = ENDPOINTS['boundary'].get(url)
     if response.status_code < 399:
         return bool(response.json().get('count', 0))
 
-    raise RemoteApiError(url, response)
+    raise RemoteApiError(response)
 
 def check_boundary_address(address):
     """
@@ -146,23 +309,45 @@ def check_boundary_address(address):
 #    if logger:
 #        logger.info(url)
 #        logger.info(address)
-    response = requests.get(url)
+    response = ENDPOINTS['boundary'].get(url)
     if response.status_code < 399:
 #        if logger:
 #            logger.info(json.dumps(response.json(), indent=2))
         return bool(response.json().get('candidates', []))
 
-    raise RemoteApiError(url, response)
+    raise RemoteApiError(response)
 
 def check_address(**address):
     """
     Queries an address to see if it is a valid postal code and if it is within
-    the boundary
+    the boundary. The verdict is cached in GEOCODE_CACHE by normalized
+    address.
 
     :param address: dict with keys ['street', 'city', 'state', 'postal_code']
     :return:
     """
     address = update_city(**address)
+    return _boundary_verdict(normalize_address(address), address)
+
+
+@coalesce(GEO_FLIGHT, key=lambda key, address: ("boundary", key))
+def _boundary_verdict(key, address):
+    entry = _cached_geocode(key)
+    if 'within' in entry:
+        return entry['within']
+    within = None
+    if boundary.get_index() is not None:
+        # with a local boundary export only the geocoding is remote
+        try:
+            coords = get_geo_coords(dict(address))
+        except (requests.RequestException, RemoteApiError, CircuitOpenError):
+            # the town's locator geocodes the address itself
+            coords = {}
+        if coords.get('x') not in (None, ''):
+            within = check_boundary_coords(coords)
     #address = get_geo_coords(address)
     #return check_boundary_coords(address)
-    return check_boundary_address(address)
+    if within is None:
+        within = check_boundary_address(address)
+    _cache_geocode(key, within=within)
+    return within
@@ -0,0 +1,13 @@
+from .jobqueue import (enqueue,
+                       enqueue_once,
+                       enqueue_many,
+                       claim,
+                       complete,
+                       fail,
+                       dead_jobs,
+                       requeue_dead,
+                       counts,
+                       handler,
+                       HANDLERS)
+from .worker import Worker
+from . import handlers
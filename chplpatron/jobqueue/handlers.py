@@ -0,0 +1,68 @@
+"""
+Handlers for the post-registration jobs. Imports happen inside the handlers
+so the job queue can be used without loading every dependency.
+"""
+__author__ = "Jeremy Nelson, Mike Stabile"
+
+from .jobqueue import handler, enqueue_once
+
+
+@handler("set_barcode")
+def set_barcode(barcode, patron_id):
+    from chplpatron import sierra
+    sierra.set_barcode(barcode, patron_id)
+
+
+@handler("add_registration")
+def add_registration(patron_id, email, location="unknown", boundary=-1):
+    from chplpatron import trackingdb
+    from chplpatron.exceptions import RegisteredEmailError
+    try:
+        trackingdb.add_registration(patron_id, email, location, boundary)
+    except RegisteredEmailError:
+        # the registration was already recorded by an earlier attempt
+        if not trackingdb.lookup_card_number(patron_id):
+            raise
+
+
+@handler("email_notification")
+def email_notification(form, from_fld, to_fld, boundary_status):
+    from chplpatron.registration.actions import email_notification
+    email_notification(form, from_fld, to_fld, boundary_status)
+
+
+@handler("es_index")
+def es_index(patron_id, es_index="patron"):
+    from chplpatron import sierra
+    from chplpatron.statistics import EsBase
+    patron = sierra.Patron(sierra.lookup_by_id(patron_id))
+    EsBase(es_index=es_index).save(patron.to_es(), id_value=patron_id)
+
+
+@handler("postal_reconcile")
+def postal_reconcile(postal_codes=None, prefix="275"):
+    from chplpatron import geosearch, postaldb
+    if postal_codes is None:
+        postal_codes = postaldb.postal_codes(prefix)
+    postaldb.reconcile(postal_codes, geosearch.get_postal_code)
+
+
+@handler("boundary_refresh")
+def boundary_refresh(url=None, interval=None):
+    from chplpatron import boundary
+    boundary.refresh(url)
+    if interval is None:
+        interval = boundary.REFRESH_INTERVAL
+    if interval:
+        enqueue_once("boundary_refresh", delay=interval)
+
+
+@handler("geo_cache_purge")
+def geo_cache_purge(interval=None):
+    from chplpatron import geosearch
+    geosearch.purge_cache()
+    if interval is None:
+        interval = geosearch.GEO_CACHE_PURGE_INTERVAL
+    if interval:
+        # the next purge, the job running now is no longer pending
+        enqueue_once("geo_cache_purge", delay=interval)
@@ -0,0 +1,316 @@
+"""
+Durable local job queue for work done after a registration response, i.e.
+setting the barcode, tracking inserts, notifications and statistics.
+Jobs are stored in sqlite so no external broker is needed and are run by
+the worker in chplpatron/jobqueue/worker.py.
+"""
+__author__ = "Jeremy Nelson, Mike Stabile"
+
+import json
+import os
+import sqlite3
+import time
+
+DB_NAME = "job-queue.sqlite"
+JOB_QUEUE_SETUP = None
+CURRENT_DIR = os.path.dirname(__file__)
+DB_PATH = ""
+JOB_TBL = "Job"
+DEAD_TBL = "DeadJob"
+# seconds a claimed job is reserved before another worker may take it over
+LEASE = 300
+MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled on each following attempt
+BACKOFF = 30
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """
+    decorator registering the function that runs jobs of the given kind.
+    The function is called with the job payload as keyword arguments.
+
+    :param kind: the job kind
+    """
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def connect():
+    con = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    return con
+
+
+def setup(func):
+    """
+    decorator ensuring that the database is setup prior to any calls
+    :param func:
+    :return: None
+    """
+    global JOB_QUEUE_SETUP
+    global DB_PATH
+    if JOB_QUEUE_SETUP:
+        return func
+    DB_PATH = str(os.path.join(CURRENT_DIR, DB_NAME))
+    con = connect()
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.executescript("CREATE TABLE IF NOT EXISTS {job} ("
+                      "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,"
+                      "kind VARCHAR NOT NULL,"
+                      "payload TEXT NOT NULL,"
+                      "status VARCHAR NOT NULL DEFAULT 'pending',"
+                      "attempts INTEGER NOT NULL DEFAULT 0,"
+                      "max_attempts INTEGER NOT NULL DEFAULT {max},"
+                      "run_after REAL NOT NULL,"
+                      "locked_until REAL,"
+                      "last_error TEXT,"
+                      "created DATETIME DEFAULT CURRENT_TIMESTAMP"
+                      ");"
+                      "CREATE INDEX IF NOT EXISTS {job}_ready "
+                      "ON {job} (status, run_after);"
+                      "CREATE TABLE IF NOT EXISTS {dead} ("
+                      "id INTEGER PRIMARY KEY NOT NULL,"
+                      "kind VARCHAR NOT NULL,"
+                      "payload TEXT NOT NULL,"
+                      "attempts INTEGER NOT NULL,"
+                      "last_error TEXT,"
+                      "created DATETIME,"
+                      "failed DATETIME DEFAULT CURRENT_TIMESTAMP"
+                      ");".format(job=JOB_TBL,
+                                  dead=DEAD_TBL,
+                                  max=MAX_ATTEMPTS))
+    con.close()
+    JOB_QUEUE_SETUP = True
+    return func
+
+
+@setup
+def enqueue(kind, payload=None, max_attempts=MAX_ATTEMPTS, delay=0):
+    """
+    Adds a job to the queue
+
+    :param kind: the job kind, see HANDLERS
+    :param payload: json serializable dict passed to the handler
+    :param max_attempts: attempts before the job is moved to the dead letters
+    :param delay: seconds to wait before the job may run
+    :return: the job id
+    """
+    return enqueue_many([(kind, payload)], max_attempts, delay)[0]
+
+
+@setup
+def enqueue_once(kind, payload=None, max_attempts=MAX_ATTEMPTS, delay=0):
+    """
+    Adds a job unless one of the same kind is already pending, i.e. for
+    periodic jobs that schedule their next run
+
+    :return: the job id or None when a job was already pending
+    """
+    con = connect()
+    try:
+        con.execute("BEGIN IMMEDIATE;")
+        pending = con.execute("SELECT id FROM {} "
+                              "WHERE kind=? AND status='pending' LIMIT 1;"
+                              .format(JOB_TBL), (kind,)).fetchone()
+        job_id = None
+        if pending is None:
+            job_id = con.execute("INSERT INTO {} "
+                                 "(kind, payload, max_attempts, run_after) "
+                                 "VALUES (?,?,?,?);".format(JOB_TBL),
+                                 (kind,
+                                  json.dumps(payload or {}),
+                                  max_attempts,
+                                  time.time() + delay)).lastrowid
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    finally:
+        con.close()
+    return job_id
+
+
+@setup
+def enqueue_many(jobs, max_attempts=MAX_ATTEMPTS, delay=0):
+    """
+    Adds several jobs to the queue in one transaction
+
+    :param jobs: list of (kind, payload) tuples
+    :return: list of job ids
+    """
+    con = connect()
+    ids = []
+    try:
+        con.execute("BEGIN IMMEDIATE;")
+        for kind, payload in jobs:
+            cur = con.execute("INSERT INTO {} "
+                              "(kind, payload, max_attempts, run_after) "
+                              "VALUES (?,?,?,?);".format(JOB_TBL),
+                              (kind,
+                               json.dumps(payload or {}),
+                               max_attempts,
+                               time.time() + delay))
+            ids.append(cur.lastrowid)
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    finally:
+        con.close()
+    return ids
+
+
+@setup
+def claim(lease=LEASE):
+    """
+    Reserves the next job that is ready to run. Jobs whose lease expired,
+    i.e. the worker running them died, are claimed again.
+
+    :param lease: seconds the job is reserved for
+    :return: dict of the job with a decoded 'payload' or None
+    """
+    now = time.time()
+    con = connect()
+    try:
+        con.execute("BEGIN IMMEDIATE;")
+        row = con.execute("SELECT * FROM {} "
+                          "WHERE (status='pending' AND run_after<=?) "
+                          "OR (status='running' AND locked_until<=?) "
+                          "ORDER BY run_after, id LIMIT 1;".format(JOB_TBL),
+                          (now, now)).fetchone()
+        if row is None:
+            con.execute("COMMIT;")
+            return None
+        con.execute("UPDATE {} "
+                    "SET status='running', attempts=attempts+1, "
+                    "locked_until=? "
+                    "WHERE id=?;".format(JOB_TBL),
+                    (now + lease, row['id']))
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    finally:
+        con.close()
+    job = dict(row)
+    job['attempts'] += 1
+    job['payload'] = json.loads(job['payload'])
+    return job
+
+
+@setup
+def complete(job_id):
+    """
+    Removes a finished job from the queue
+    """
+    con = connect()
+    con.execute("DELETE FROM {} WHERE id=?;".format(JOB_TBL), (job_id,))
+    con.close()
+
+
+@setup
+def fail(job_id, error, backoff=BACKOFF):
+    """
+    Records a failed attempt. The job is scheduled again with exponential
+    backoff or, when it has used all of its attempts, moved to the dead
+    letter table.
+
+    :param job_id: the job id
+    :param error: the error message
+    :param backoff: seconds before the first retry
+    :return: True if the job will be retried
+    """
+    con = connect()
+    try:
+        con.execute("BEGIN IMMEDIATE;")
+        row = con.execute("SELECT * FROM {} WHERE id=?;".format(JOB_TBL),
+                          (job_id,)).fetchone()
+        if row is None:
+            con.execute("COMMIT;")
+            return False
+        retry = row['attempts'] < row['max_attempts']
+        if retry:
+            con.execute("UPDATE {} "
+                        "SET status='pending', run_after=?, "
+                        "locked_until=NULL, last_error=? "
+                        "WHERE id=?;".format(JOB_TBL),
+                        (time.time() + backoff * 2 ** (row['attempts'] - 1),
+                         str(error),
+                         job_id))
+        else:
+            con.execute("INSERT INTO {} "
+                        "(id, kind, payload, attempts, last_error, created) "
+                        "VALUES (?,?,?,?,?,?);".format(DEAD_TBL),
+                        (row['id'], row['kind'], row['payload'],
+                         row['attempts'], str(error), row['created']))
+            con.execute("DELETE FROM {} WHERE id=?;".format(JOB_TBL),
+                        (job_id,))
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    finally:
+        con.close()
+    return retry
+
+
+@setup
+def dead_jobs():
+    """
+    :return: list of dicts of the jobs that used all of their attempts
+    """
+    con = connect()
+    rows = con.execute("SELECT * FROM {} ORDER BY id;"
+                       .format(DEAD_TBL)).fetchall()
+    con.close()
+    return [dict(row) for row in rows]
+
+
+@setup
+def requeue_dead(job_id):
+    """
+    Moves a dead letter back onto the queue with a fresh set of attempts
+
+    :return: the new job id or None if the dead letter does not exist
+    """
+    con = connect()
+    try:
+        con.execute("BEGIN IMMEDIATE;")
+        row = con.execute("SELECT * FROM {} WHERE id=?;".format(DEAD_TBL),
+                          (job_id,)).fetchone()
+        new_id = None
+        if row is not None:
+            new_id = con.execute("INSERT INTO {} "
+                                 "(kind, payload, run_after) "
+                                 "VALUES (?,?,?);".format(JOB_TBL),
+                                 (row['kind'], row['payload'], time.time())
+                                 ).lastrowid
+            con.execute("DELETE FROM {} WHERE id=?;".format(DEAD_TBL),
+                        (job_id,))
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    finally:
+        con.close()
+    return new_id
+
+
+@setup
+def counts():
+    """
+    :return: dict with the number of pending, running and dead jobs
+    """
+    con = connect()
+    rtn = {"pending": 0, "running": 0}
+    for status, count in con.execute("SELECT status, count(*) FROM {} "
+                                     "GROUP BY status;".format(JOB_TBL)):
+        rtn[status] = count
+    rtn["dead"] = con.execute("SELECT count(*) FROM {};"
+                              .format(DEAD_TBL)).fetchone()[0]
+    con.close()
+    return rtn
@@ -0,0 +1,98 @@
+"""
+Worker process running the jobs in the job queue
+
+usage:
+    python -m chplpatron.jobqueue.worker
+"""
+__author__ = "Jeremy Nelson, Mike Stabile"
+
+import logging
+import threading
+import time
+
+from . import jobqueue
+
+log = logging.getLogger(__name__)
+
+
+class Worker:
+    """
+    Claims jobs from the queue and runs the registered handler for each.
+    Failed jobs are retried with exponential backoff and moved to the dead
+    letter table once they have used all of their attempts.
+
+    :param handlers: dict of job kind to function, defaults to the
+                     handlers registered with jobqueue.handler
+    :param poll_interval: seconds to sleep when the queue is empty
+    :param backoff: seconds before the first retry of a failed job
+    """
+
+    def __init__(self,
+                 handlers=None,
+                 poll_interval=1.0,
+                 backoff=jobqueue.BACKOFF):
+        self.handlers = handlers if handlers is not None \
+            else jobqueue.HANDLERS
+        self.poll_interval = poll_interval
+        self.backoff = backoff
+        self.stop_event = threading.Event()
+
+    def run_once(self):
+        """
+        Runs the next ready job
+
+        :return: True if a job was run, False if the queue was empty
+        """
+        job = jobqueue.claim()
+        if job is None:
+            return False
+        try:
+            func = self.handlers[job['kind']]
+        except KeyError:
+            jobqueue.fail(job['id'],
+                          "No handler for '{}'".format(job['kind']),
+                          self.backoff)
+            return True
+        try:
+            func(**job['payload'])
+        except Exception as err:
+            retry = jobqueue.fail(job['id'], repr(err), self.backoff)
+            log.warning("Job %s '%s' attempt %s failed%s: %r",
+                        job['id'],
+                        job['kind'],
+                        job['attempts'],
+                        "" if retry else ", moved to dead letters",
+                        err)
+        else:
+            jobqueue.complete(job['id'])
+        return True
+
+    def run(self):
+        """
+        Runs jobs until stop() is called
+        """
+        log.info("Job worker started")
+        while not self.stop_event.is_set():
+            if not self.run_once():
+                self.stop_event.wait(self.poll_interval)
+        log.info("Job worker stopped")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+if __name__ == '__main__':
+    from . import handlers
+    from chplpatron import boundary
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)-12s %(levelname)-8s '
+                               '%(message)s')
+    # periodic jobs schedule their own next run once started
+    jobqueue.enqueue_once("geo_cache_purge")
+    if boundary.POLYGON_PATH:
+        jobqueue.enqueue_once("boundary_refresh")
+    worker = Worker()
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        worker.stop()
@@ -1 +1,7 @@
-from .postaldb import get_postal_code
\ No newline at end of file
+from .postaldb import (get_postal_code,
+                       find_city,
+                       load_index,
+                       postal_codes,
+                       reconcile,
+                       discrepancies)
+from .postalindex import PostalIndex
@@ -0,0 +1,18 @@
+"""
+Builds the postal code database, i.e. as a build step shipping a ready-made
+postal-db.sqlite
+
+usage:
+    python -m chplpatron.postaldb [db_path] [--csv US.txt]
+"""
+import argparse
+
+from .postaldb import build, DB_PATH, POSTAL_CSV
+
+parser = argparse.ArgumentParser(
+    description="Builds the postal code database from US.txt")
+parser.add_argument("db_path", nargs="?", default=DB_PATH)
+parser.add_argument("--csv", default=POSTAL_CSV)
+args = parser.parse_args()
+print("Loaded {} rows into {}".format(build(args.db_path, args.csv),
+                                      args.db_path))
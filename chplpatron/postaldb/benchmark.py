@@ -0,0 +1,86 @@
+"""
+Micro-benchmark of postal code lookups against the original, unindexed
+resources table and the current schema with its covering index
+
+usage:
+    python -m chplpatron.postaldb.benchmark [lookups]
+"""
+__author__ = "Jeremy Nelson, Mike Stabile"
+
+import csv
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+from .postaldb import POSTAL_CSV, migrate, query_postal_code
+
+
+def build_legacy(db_path):
+    """
+    Builds a version 1 postal database, the schema before migrations
+    """
+    con = sqlite3.connect(db_path)
+    con.execute("CREATE TABLE resources ("
+                "id integer PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                "postal_code text NOT NULL, "
+                "city text NOT NULL, "
+                "state_long text NOT NULL, "
+                "state_short text, "
+                "lat text, "
+                "long text) ;")
+    with open(POSTAL_CSV, "r") as data:
+        con.executemany("INSERT INTO resources (postal_code, city, "
+                        "state_long, state_short, lat, long) "
+                        "VALUES (?,?,?,?,?,?)",
+                        ((ln[1], ln[2], ln[3], ln[4], ln[9], ln[10])
+                         for ln in csv.reader(data, delimiter='\t')))
+    con.commit()
+    con.close()
+
+
+def time_lookups(db_path, postal_codes):
+    """
+    :return: mean lookup time in microseconds
+    """
+    con = sqlite3.connect(db_path)
+    start = time.perf_counter()
+    for postal in postal_codes:
+        query_postal_code(con, postal)
+    elapsed = time.perf_counter() - start
+    plan = con.execute("EXPLAIN QUERY PLAN SELECT state_long, postal_code, "
+                       "city FROM resources WHERE postal_code = ?",
+                       ('27514',)).fetchall()
+    con.close()
+    return elapsed * 1e6 / len(postal_codes), plan[0][-1]
+
+
+def main(lookups=2000):
+    tmp_dir = tempfile.mkdtemp()
+    db_path = os.path.join(tmp_dir, "postal-db.sqlite")
+    try:
+        build_legacy(db_path)
+        con = sqlite3.connect(db_path)
+        postal_codes = [row[0] for row in
+                        con.execute("SELECT DISTINCT postal_code "
+                                    "FROM resources;")]
+        con.close()
+        sample = [random.choice(postal_codes) for _ in range(lookups)]
+        before, before_plan = time_lookups(db_path, sample)
+        con = sqlite3.connect(db_path, isolation_level=None)
+        migrate(con)
+        con.close()
+        after, after_plan = time_lookups(db_path, sample)
+    finally:
+        for name in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, name))
+        os.rmdir(tmp_dir)
+    print("lookups: {}".format(lookups))
+    print("before:  {:8.1f} us/lookup  {}".format(before, before_plan))
+    print("after:   {:8.1f} us/lookup  {}".format(after, after_plan))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -4,102 +4,397 @@ Simple postal_code lookup implementation
 __author__ = "Jeremy Nelson, Mike Stabile"
 
 import csv
+import logging
 import os
 import sqlite3
+import threading
 
-from chplpatron.exceptions import InvalidPostalCode
+from chplpatron.exceptions import InvalidPostalCode, InvalidCity
+
+from .postalindex import PostalIndex
 
 POSTAL_DB_SETUP = None
 CURRENT_DIR = os.path.dirname(__file__)
 DB_PATH = os.path.join(CURRENT_DIR, "postal-db.sqlite")
 POSTAL_CSV = os.path.join(CURRENT_DIR, "resources", "US.txt")
+DISCREPANCY_TBL = "discrepancies"
+DISCREPANCY_SCHEMA = ("CREATE TABLE IF NOT EXISTS {} ("
+                      "postal_code text PRIMARY KEY NOT NULL, "
+                      "local text, "
+                      "remote text, "
+                      "checked DATETIME DEFAULT CURRENT_TIMESTAMP);"
+                      .format(DISCREPANCY_TBL))
+POSTAL_INDEX = None
+INDEX_LOCK = threading.Lock()
+
+log = logging.getLogger(__name__)
+
+
+# schema of the resources table, user_version records the version
+SCHEMA_VERSION = 2
+SCHEMA = ("CREATE TABLE IF NOT EXISTS resources ("
+          "id integer PRIMARY KEY AUTOINCREMENT NOT NULL, "
+          "postal_code text NOT NULL, "
+          "city text NOT NULL, "
+          "city_upper text NOT NULL, "
+          "state_long text NOT NULL, "
+          "state_short text, "
+          "lat REAL, "
+          "long REAL) ;")
+# covers the postal code lookups of query_postal_code
+INDEX_SCHEMA = ("CREATE INDEX IF NOT EXISTS resources_postal_city "
+                "ON resources (postal_code, city, state_long);")
+
+# statements upgrading a database to the version of the key. A database
+# without a user_version is version 1, the original schema with text
+# coordinates and no index.
+MIGRATIONS = {
+    2: ["CREATE TABLE resources_v2 ("
+        "id integer PRIMARY KEY AUTOINCREMENT NOT NULL, "
+        "postal_code text NOT NULL, "
+        "city text NOT NULL, "
+        "city_upper text NOT NULL, "
+        "state_long text NOT NULL, "
+        "state_short text, "
+        "lat REAL, "
+        "long REAL) ;",
+        "INSERT INTO resources_v2 (id, postal_code, city, city_upper, "
+        "state_long, state_short, lat, long) "
+        "SELECT id, postal_code, city, py_upper(city), state_long, "
+        "state_short, CAST(NULLIF(lat, '') AS REAL), "
+        "CAST(NULLIF(long, '') AS REAL) "
+        "FROM resources;",
+        "DROP TABLE resources;",
+        "ALTER TABLE resources_v2 RENAME TO resources;",
+        "CREATE INDEX resources_postal_city "
+        "ON resources (postal_code, city, state_long);"]
+}
+
+
+def _to_real(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _postal_rows(csv_path):
+    with open(csv_path, "r") as data:
+        for ln in csv.reader(data, delimiter='\t'):
+            yield (ln[1], ln[2], ln[2].upper(), ln[3], ln[4],
+                   _to_real(ln[9]), _to_real(ln[10]))
+
+
+def schema_version(con):
+    """
+    :param con: connection to a postal database
+    :return: the schema version of the database, 0 if it has no resources
+             table
+    """
+    version = con.execute("PRAGMA user_version;").fetchone()[0]
+    if version:
+        return version
+    exists = con.execute("SELECT name FROM sqlite_master "
+                         "WHERE type='table' AND name='resources';"
+                         ).fetchone()
+    return 1 if exists else 0
+
+
+def migrate(con):
+    """
+    Upgrades the postal database to SCHEMA_VERSION in a single transaction
+
+    :param con: connection to a postal database with isolation_level None
+    :return: the version the database was upgraded from
+    """
+    version = schema_version(con)
+    if version >= SCHEMA_VERSION:
+        return version
+    # python's upper() also handles the accented city names
+    con.create_function("py_upper", 1, str.upper)
+    con.execute("BEGIN IMMEDIATE;")
+    try:
+        for number in sorted(MIGRATIONS):
+            if number > version:
+                for stmt in MIGRATIONS[number]:
+                    con.execute(stmt)
+        con.execute("PRAGMA user_version={};".format(SCHEMA_VERSION))
+        con.execute("COMMIT;")
+    except Exception:
+        con.execute("ROLLBACK;")
+        raise
+    log.info("Migrated postal database from version %s to %s",
+             version, SCHEMA_VERSION)
+    return version
+
+
+def build(db_path=None, csv_path=None):
+    """
+    Loads the GeoNames postal code file into a new postal database. The file
+    is streamed into a temporary database in a single transaction which
+    then replaces db_path, so readers never see a partly loaded table. The
+    discrepancies recorded by reconcile are carried over from the database
+    replaced. Run it at build time to ship a ready-made postal-db.sqlite.
+
+    :param db_path: path of the database to create, defaults to DB_PATH
+    :param csv_path: path of the postal code file, defaults to POSTAL_CSV
+    :return: number of rows loaded
+    """
+    db_path = db_path or DB_PATH
+    tmp_path = "{}.{}.tmp".format(db_path, os.getpid())
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = sqlite3.connect(tmp_path, isolation_level=None)
+    try:
+        # nothing is lost if the load fails, the temporary file is dropped
+        con.execute("PRAGMA journal_mode=OFF;")
+        con.execute("PRAGMA synchronous=OFF;")
+        con.execute("PRAGMA cache_size=-65536;")
+        con.execute("BEGIN;")
+        con.execute(SCHEMA)
+        con.executemany("INSERT INTO resources ("
+                        "postal_code, "
+                        "city, "
+                        "city_upper, "
+                        "state_long, "
+                        "state_short, "
+                        "lat, "
+                        "long) "
+                        "VALUES (?,?,?,?,?,?,?)",
+                        _postal_rows(csv_path or POSTAL_CSV))
+        # one pass over the loaded table is faster than updating the index
+        # on every insert
+        con.execute(INDEX_SCHEMA)
+        con.execute("PRAGMA user_version={};".format(SCHEMA_VERSION))
+        con.execute("COMMIT;")
+        if os.path.exists(db_path):
+            _copy_discrepancies(con, db_path)
+        count = con.execute("SELECT count(*) FROM resources;").fetchone()[0]
+        con.close()
+    except Exception:
+        con.close()
+        os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, db_path)
+    return count
+
+
+def _copy_discrepancies(con, old_path):
+    """
+    Copies the discrepancies table of the database at old_path into the
+    database of con
+    """
+    try:
+        con.execute("ATTACH DATABASE ? AS old;", (old_path,))
+    except sqlite3.DatabaseError as err:
+        log.warning("Unable to copy the discrepancies of %s: %s",
+                    old_path, err)
+        return
+    try:
+        if con.execute("SELECT name FROM old.sqlite_master "
+                       "WHERE type='table' AND name=?;",
+                       (DISCREPANCY_TBL,)).fetchone():
+            con.execute("BEGIN;")
+            con.execute(DISCREPANCY_SCHEMA)
+            con.execute("INSERT INTO main.{tbl} "
+                        "(postal_code, local, remote, checked) "
+                        "SELECT postal_code, local, remote, checked "
+                        "FROM old.{tbl};".format(tbl=DISCREPANCY_TBL))
+            con.execute("COMMIT;")
+    except sqlite3.DatabaseError as err:
+        if con.in_transaction:
+            con.execute("ROLLBACK;")
+        log.warning("Unable to copy the discrepancies of %s: %s",
+                    old_path, err)
+    finally:
+        con.execute("DETACH DATABASE old;")
 
 
 def setup():
+    """
+    Ensures the postal database exists and has the current schema, building
+    it when it is missing. A database with too few rows is reported and
+    rebuilt.
+    """
     global POSTAL_DB_SETUP
     if POSTAL_DB_SETUP:
         return
+    count = 0
+    if os.path.exists(DB_PATH):
+        con = sqlite3.connect(DB_PATH, timeout=30, isolation_level=None)
+        try:
+            count = con.execute("SELECT count(*) FROM resources;"
+                                ).fetchone()[0]
+            if count > 1000:
+                migrate(con)
+        except sqlite3.OperationalError:
+            count = 0
+        finally:
+            con.close()
+        if count <= 1000:
+            log.warning("Postal database %s has %s rows, rebuilding it",
+                        DB_PATH, count)
+    if count <= 1000:
+        log.info("Loaded %s rows into %s", build(), DB_PATH)
+    POSTAL_DB_SETUP = True
 
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-
-    # --- test row count --------------------------------------------
-    qry = ("SELECT name "
-           "FROM sqlite_master "
-           "WHERE type='table' AND name='resources';")
-    count = [0]
-    if bool(len(cur.execute(qry).fetchall())):
-        count = cur.execute("SELECT count(*) FROM resources;").fetchone()
-    if count[0] > 1000:
-        POSTAL_DB_SETUP = True
-        return
 
-    # --- row count was too small --> reload ------------------------
-    # Drop table
-    cur.execute("DROP TABLE IF EXISTS resources")
-    con.commit()
-    # Create table
-    cur.execute("CREATE TABLE IF NOT EXISTS resources ("
-                "id integer PRIMARY KEY AUTOINCREMENT NOT NULL, "
-                "postal_code text NOT NULL, "
-                "city text NOT NULL, "
-                "state_long text NOT NULL, "
-                "state_short text, "
-                "lat text, "
-                "long text) ;")
-    con.commit()
-    # load data
-    ins_qry = ("INSERT INTO resources ("
-               "postal_code, "
-               "city, "
-               "state_long, "
-               "state_short, "
-               "lat, "
-               "long) "
-               "VALUES (?,?,?,?,?,?)")
-    with open(POSTAL_CSV,
-              "r") as data:
-        postal_data = list(csv.reader(data, delimiter='\t'))
-        for ln in postal_data:
-            cur.execute(ins_qry,
-                        (ln[1], ln[2], ln[3], ln[4], ln[9], ln[10]))
-    con.commit()
-    cur.close()
-    con.close()
-    POSTAL_DB_SETUP = True
+def query_postal_code(con, postal_value):
+    """
+    Looks up the postal code in the postal database. The covering index
+    answers the query without reading the table.
+
+    :param con: connection to the postal database
+    :param postal_value: 5 digit postal code
+    :return: list of dicts with keys ['state', 'postal_code', 'city']
+    """
+    rows = con.execute("SELECT state_long as state, "
+                       "postal_code, "
+                       "city "
+                       "FROM resources WHERE postal_code = ?",
+                       (postal_value[:5],)).fetchall()
+    if not rows:
+        raise InvalidPostalCode(postal_value)
+    return [dict(zip(('state', 'postal_code', 'city'), row))
+            for row in rows]
+
+
+def find_city(postal_value, city):
+    """
+    Case-insensitive match of a city within a postal code
+
+    :param postal_value: 5 digit postal code
+    :param city: city name in any case
+    :return: dict with keys ['state', 'postal_code', 'city']
+    """
+    setup()
+    con = sqlite3.connect(DB_PATH)
+    try:
+        row = con.execute("SELECT state_long as state, "
+                          "postal_code, "
+                          "city "
+                          "FROM resources "
+                          "WHERE postal_code = ? AND city_upper = ?",
+                          (postal_value[:5], city.strip().upper())
+                          ).fetchone()
+    finally:
+        con.close()
+    if row is None:
+        raise InvalidCity(city)
+    return dict(zip(('state', 'postal_code', 'city'), row))
 
 
 POSTAL_KEYS = ['postal_code', 'city', 'state']
 
 
+def load_index(source=None):
+    """
+    Builds the in-memory postal index once per process. Loading it before
+    gunicorn forks its workers lets them share the index.
+
+    :param source: path of US.txt or of a postal sqlite database, defaults
+                   to POSTAL_CSV
+    :return: the PostalIndex
+    """
+    global POSTAL_INDEX
+    if POSTAL_INDEX is not None and source is None:
+        return POSTAL_INDEX
+    with INDEX_LOCK:
+        if POSTAL_INDEX is None or source is not None:
+            source = source or POSTAL_CSV
+            if source.endswith(".sqlite"):
+                POSTAL_INDEX = PostalIndex.from_sqlite(source)
+            else:
+                POSTAL_INDEX = PostalIndex.from_csv(source)
+    return POSTAL_INDEX
+
+
 def get_postal_code(postal_value):
     """
-    looks up the postal_code in the database
+    looks up the postal_code in the in-memory postal index
 
     request args:
         postal_code: the postal code to look up
     """
+    if len(postal_value) < 5:
+        raise InvalidPostalCode(postal_value)
+    return load_index().get(postal_value)
+
+
+def _locale_set(locations):
+    return {(loc.get('city', '').strip().lower(),
+             loc.get('state', '').strip().lower())
+            for loc in locations}
+
+
+def reconcile(postal_codes, remote_lookup):
+    """
+    Compares the local locations of the postal codes with a remote lookup
+    and records the postal codes where they differ in the discrepancies
+    table. Postal codes the remote lookup cannot answer are skipped.
+
+    :param postal_codes: iterable of 5 digit postal codes
+    :param remote_lookup: function returning the list of locations for a
+                          postal code, i.e. geosearch.get_postal_code
+    :return: number of discrepancies found
+    """
+    setup()
+    found = 0
+    con = sqlite3.connect(DB_PATH)
+    con.execute(DISCREPANCY_SCHEMA)
+    for postal in postal_codes:
+        try:
+            local = get_postal_code(postal)
+        except InvalidPostalCode:
+            local = []
+        try:
+            remote = remote_lookup(postal)
+        except InvalidPostalCode:
+            remote = []
+        except Exception as err:
+            log.warning("Unable to reconcile postal code %s: %s", postal, err)
+            continue
+        if _locale_set(local) == _locale_set(remote):
+            con.execute("DELETE FROM {} WHERE postal_code=?;"
+                        .format(DISCREPANCY_TBL), (postal,))
+            continue
+        found += 1
+        con.execute("INSERT OR REPLACE INTO {} "
+                    "(postal_code, local, remote) VALUES (?,?,?);"
+                    .format(DISCREPANCY_TBL),
+                    (postal,
+                     "; ".join("{city}, {state}".format(**loc)
+                               for loc in local),
+                     "; ".join("{city}, {state}".format(**loc)
+                               for loc in remote)))
+    con.commit()
+    con.close()
+    return found
+
+
+def postal_codes(prefix=""):
+    """
+    :param prefix: leading digits of the postal codes to return
+    :return: sorted list of the distinct postal codes in the database
+    """
+    return load_index().prefix(prefix)
+
+
+def discrepancies():
+    """
+    :return: list of dicts of the recorded discrepancies
+    """
     setup()
-    postal = postal_value
-    if len(postal) > 5:
-        postal = postal[:5]
-    if len(postal) == 5:
-        con = sqlite3.connect(DB_PATH)
-        con.row_factory = sqlite3.Row
-        cur = con.cursor()
-        cities = cur.execute("SELECT state_long as state, "
-                             "postal_code, "
-                             "city "
-                             "FROM resources WHERE postal_code = ?",
-                             (postal_value,)).fetchall()
-        if len(cities) > 0:
-            locs = [dict(city) for city in cities]
-            if len(locs) > 0 and locs[0].get('city'):
-                return locs
-            return [dict(city) for city in cities]
-    raise InvalidPostalCode(postal_value)
+    con = sqlite3.connect(DB_PATH)
+    con.row_factory = sqlite3.Row
+    try:
+        rows = con.execute("SELECT * FROM {} ORDER BY postal_code;"
+                           .format(DISCREPANCY_TBL)).fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    con.close()
+    return [dict(row) for row in rows]
 
 
 if __name__ == '__main__':
     print(get_postal_code('81137'))
-
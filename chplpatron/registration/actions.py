@@ -1,12 +1,30 @@
 import requests
-import smtplib
 import datetime
+import logging
 
 from email.mime.text import MIMEText
 from .utilities import (Flds,
                         form_to_api)
+from .notifications import NotificationSender
+from . import validation
 from chplpatron import sierra
 from chplpatron import trackingdb
+from chplpatron import jobqueue
+from chplpatron.utilities.timing import StageTimer
+
+from instance import config
+
+log = logging.getLogger(__name__)
+
+# set the barcode, add the tracking record and send notifications from the
+# job queue worker (python -m chplpatron.jobqueue.worker) instead of within
+# the registration request
+USE_JOB_QUEUE = getattr(config, "USE_JOB_QUEUE", False)
+EMAIL_NOTIFICATION = getattr(config, "EMAIL_NOTIFICATION", False)
+ES_INDEX_REGISTRATIONS = getattr(config, "ES_INDEX_REGISTRATIONS", False)
+
+NOTIFICATIONS = NotificationSender(getattr(config, "SMTP_HOST", "localhost"),
+                                   getattr(config, "SMTP_PORT", 0))
 
 
 def pin_reset(temp_pin, url):
@@ -29,7 +47,8 @@ def pin_reset(temp_pin, url):
 def register_patron(form, location, boundary):
     """
     send the patron data to sierra and adds a hash of the registered email
-    to the local sqlite db
+    to the local sqlite db. With USE_JOB_QUEUE set only the patron record is
+    created here and the remaining steps are queued for the job worker.
     :param form: the form data
     :param location: 'internal' or 'external' registration source
     :param boundary: True or False whether address is within boundary
@@ -43,22 +62,75 @@ def register_patron(form, location, boundary):
     patron.expirationDate = (datetime.datetime.now() + datetime.timedelta(30))\
         .strftime("%Y-%m-%d")
     patron.pMessage = 'f'
-    result = sierra.create_patron(patron)
-
-    if result:
-        temp_card_number = result
-        if temp_card_number is not None:
-            trackingdb.add_registration(temp_card_number,
-                                        form.get(Flds.email.frm),
-                                        location,
-                                        boundary['valid'])
-            # if not pin_reset(temp_card_number):
-            #     return "Failed to reset {}".format(temp_card_number)
-            return temp_card_number
-        else:
-            return None
-    else:
-        None
+    timer = StageTimer("register_patron", log)
+    try:
+        if USE_JOB_QUEUE:
+            temp_card_number = sierra.create_patron(patron,
+                                                    barcode_mode="none",
+                                                    timer=timer)
+            if temp_card_number:
+                add_to_email_filter(form.get(Flds.email.frm))
+                with timer.stage("enqueue"):
+                    queue_post_registration(form,
+                                            temp_card_number,
+                                            location,
+                                            boundary)
+            return temp_card_number or None
+        temp_card_number = sierra.create_patron(patron, timer=timer)
+        if temp_card_number:
+            add_to_email_filter(form.get(Flds.email.frm))
+            with timer.stage("tracking_db"):
+                trackingdb.add_registration(temp_card_number,
+                                            form.get(Flds.email.frm),
+                                            location,
+                                            boundary['valid'])
+    finally:
+        timer.log()
+    # if not pin_reset(temp_card_number):
+    #     return "Failed to reset {}".format(temp_card_number)
+    return temp_card_number or None
+
+
+def add_to_email_filter(email):
+    """
+    Adds a newly registered email to the duplicate email filter at once, the
+    filter would otherwise only see it once its tracking record is written
+    and the filter refreshed
+    :param email: the registered email
+    """
+    if validation.EMAIL_FILTER is not None:
+        validation.EMAIL_FILTER.add(email)
+
+
+def queue_post_registration(form, temp_card_number, location, boundary):
+    """
+    Adds the jobs that complete a registration to the job queue
+
+    :param form: the form data
+    :param temp_card_number: the new patron id
+    :param location: 'internal' or 'external' registration source
+    :param boundary: the boundary_check result
+    :return: list of job ids
+    """
+    jobs = [("set_barcode", {"barcode": temp_card_number,
+                             "patron_id": temp_card_number}),
+            ("add_registration", {"patron_id": temp_card_number,
+                                  "email": form.get(Flds.email.frm),
+                                  "location": location,
+                                  "boundary": boundary['valid']})]
+    if EMAIL_NOTIFICATION:
+        notify_form = {key: value
+                       for key, value in form.items()
+                       if "password" not in key.lower()}
+        notify_form["temp_card_number"] = temp_card_number
+        jobs.append(("email_notification",
+                     {"form": notify_form,
+                      "from_fld": config.EMAIL_SENDER,
+                      "to_fld": config.EMAIL_RECIPIENTS,
+                      "boundary_status": boundary['message']}))
+    if ES_INDEX_REGISTRATIONS:
+        jobs.append(("es_index", {"patron_id": temp_card_number}))
+    return jobqueue.enqueue_many(jobs)
 
 
 def find_card_number(patron):
@@ -70,13 +142,13 @@ def find_card_number(patron):
     return patron.get("id")
 
 
-def email_notification(form, from_fld, to_fld, boundary_status):
+def build_notification(form, from_fld, to_fld, boundary_status):
     """
-    Sends an email notification of new card request
+    Builds the notification email of a new card request
     :param form: form date
     :param from_fld: from email address
     :param to_fld:  to email address
-    :return:
+    :return: MIMEText message
     """
     email = form.get(Flds.email.frm).lower().strip()
     body = ("New Library Card Request\n"
@@ -103,6 +175,24 @@ def email_notification(form, from_fld, to_fld, boundary_status):
     msg['From'] = from_fld
     msg['To'] = ','.join(to_fld)
     msg['To'] += ",{}".format(email)
-    mail_server = smtplib.SMTP('localhost')
-    mail_server.send_message(msg)
-    mail_server.quit()
+    return msg
+
+
+def email_notification(form, from_fld, to_fld, boundary_status, wait=True):
+    """
+    Sends an email notification of new card request over the shared
+    NOTIFICATIONS connection
+    :param form: form date
+    :param from_fld: from email address
+    :param to_fld:  to email address
+    :param wait: If true waits for the message to be sent and raises on
+                 failure
+    :return: Future of the send
+    """
+    future = NOTIFICATIONS.send(build_notification(form,
+                                                   from_fld,
+                                                   to_fld,
+                                                   boundary_status))
+    if wait:
+        future.result()
+    return future
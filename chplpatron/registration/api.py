@@ -1,6 +1,8 @@
 """Chapel Hill Public Library Patron Self-Registration"""
 __author__ = "Jeremy Nelson, Mike Stabile"
 
+import datetime
+import hmac
 import os
 import sys
 import logging
@@ -9,24 +11,34 @@ import pprint
 from logging.handlers import RotatingFileHandler
 
 from flask import (Flask,
+                   Response,
                    request,
-                   jsonify)
+                   jsonify,
+                   stream_with_context)
 
 print(os.path.abspath("../../"))
 sys.path.append(os.path.abspath("../../"))
 
-from chplpatron.registration.utilities import crossdomain, Flds
+from chplpatron.registration.utilities import crossdomain, conditional, Flds
 from chplpatron.registration.validation import (validate_form,
                                                 email_check,
                                                 postal_code,
                                                 boundary_check,
+                                                form_address,
+                                                start_boundary_check,
                                                 validate_password)
 from chplpatron.registration.actions import register_patron
 from chplpatron import trackingdb
+from chplpatron.trackingdb import export
 from chplpatron import exceptions
+from chplpatron import geosearch
+from chplpatron import postaldb
 
 from instance import config
 
+# built before gunicorn forks so the workers share the postal index
+postaldb.load_index()
+
 app = Flask(__name__)
 app.config.from_mapping()
 app.config.from_object(config)
@@ -84,9 +96,25 @@ CROSS_DOMAIN_SITE = "https://chapelhillpubliclibrary.org" \
 
 basestring = (str, bytes)
 
+# addresses of the proxies whose X-Forwarded-For header is trusted
+TRUSTED_PROXIES = getattr(config, "TRUSTED_PROXIES", ())
+# shared secret required in the X-Export-Token header of export requests
+EXPORT_TOKEN = getattr(config, "EXPORT_TOKEN", None)
+
+
 def get_calling_address(request):
-    if request.headers.getlist("X-Forwarded-For"):
-        return request.headers.getlist("X-Forwarded-For")[0]
+    """
+    The calling address, used for access checks and the internal/external
+    location of registrations. Clients can send any X-Forwarded-For header,
+    so it is only used when the request comes from one of the
+    TRUSTED_PROXIES, and then only the address the proxy appended last.
+    """
+    if request.remote_addr in TRUSTED_PROXIES:
+        forwarded = [address.strip()
+                     for header in request.headers.getlist("X-Forwarded-For")
+                     for address in header.split(",") if address.strip()]
+        if forwarded:
+            return forwarded[-1]
     return request.remote_addr
 
 @app.route("/register/boundary_check")
@@ -174,16 +202,20 @@ def index():
         form = request.form.to_dict()
         pprint.pprint(form)
         testing = testing_mode(form)
+        # the boundary check only needs the address, so it runs while the
+        # rest of the form is validated
+        speculative_address, speculative = start_boundary_check(form)
         valid_form = validate_form(form)
 
         if valid_form['valid']:
-            lookup = form
-            address = {'street': lookup.get(Flds.street.frm),
-                       'city': lookup.get(Flds.city.frm),
-                       'state': lookup.get(Flds.state.frm),
-                       'postal_code': lookup.get(Flds.postal_code.frm)}
-
-            boundary = boundary_check(**address)
+            address = form_address(form)
+            if speculative is not None and address == speculative_address:
+                boundary = speculative.result()
+            else:
+                # validation changed the address, i.e. normalized the city
+                if speculative is not None:
+                    speculative.cancel()
+                boundary = boundary_check(**address)
             calling_address = get_calling_address(request)
             location = "internal" if calling_address \
                        and calling_address.startswith(config.INTERNAL_IP) \
@@ -222,6 +254,8 @@ def index():
                                     config.ERROR_URI,
                                     "Failed to register Patron")})
         else:
+            if speculative is not None:
+                speculative.cancel()
             return jsonify(valid_form)
     except Exception as err:
         log.exception(err)
@@ -253,14 +287,27 @@ def testing_mode(form):
         return False
 
 
+STATISTICS_PATH = os.path.join(os.path.abspath("../../"),
+                               "wordpress",
+                               "statistics.html")
+
+
+def statistics_modified():
+    """
+    validator of the statistics page, changes when the file is replaced
+    """
+    stat = os.stat(STATISTICS_PATH)
+    return (stat.st_mtime_ns,
+            datetime.datetime.fromtimestamp(stat.st_mtime,
+                                            datetime.timezone.utc))
+
+
 @app.route("/register/statistics", methods=['GET', 'POST'])
 @crossdomain(origin=CROSS_DOMAIN_SITE)
+@conditional(statistics_modified)
 def statistics():
-    form_path = os.path.join(os.path.abspath("../../"),
-                             "wordpress",
-                             "statistics.html")
     # html = ""
-    with open(form_path, "r") as form_file:
+    with open(STATISTICS_PATH, "r") as form_file:
         html = form_file.read()
     return html.replace("104.131.189.93", "localhost")
 
@@ -293,19 +340,97 @@ def statistics():
 
 @app.route("/register/statistics/reg_by_month")
 @crossdomain(origin=CROSS_DOMAIN_SITE)
+@conditional(trackingdb.last_write)
 def reg_by_month():
     data = trackingdb.registration_by_month()
     data = {"labels": [item[0] for item in data],
             "values": [item[1] for item in data]}
     return jsonify(data)
 
+
+@app.route("/register/statistics/registrations")
+@crossdomain(origin=CROSS_DOMAIN_SITE)
+@conditional(trackingdb.last_write)
+def registration_counts():
+    """
+    request args:
+        granularity: day, month (default) or year
+        start: optional first day, YYYY-MM-DD
+        end: optional last day, YYYY-MM-DD
+        by: optional comma separated list of location and boundary
+    """
+    by = [item for item in request.args.get("by", "").split(",") if item]
+    try:
+        data = trackingdb.registration_counts(
+            granularity=request.args.get("granularity", "month"),
+            start=request.args.get("start"),
+            end=request.args.get("end"),
+            by=by)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    keys = ["period"] + by + ["count"]
+    return jsonify([dict(zip(keys, row)) for row in data])
+
+
+def query_date(name):
+    """
+    :param name: name of the request arg
+    :return: the date of the request arg as YYYY-MM-DD or None if not given
+    :raises ValueError: if the arg is not a YYYY-MM-DD date
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()\
+            .isoformat()
+    except ValueError:
+        raise ValueError("{} must be a date, YYYY-MM-DD".format(name))
+
+
+@app.route("/register/export")
+def export_registrations():
+    """
+    Streams the tracking data, only to in-house addresses and, when
+    EXPORT_TOKEN is set, to requests sending it in the X-Export-Token header
+
+    request args:
+        format: csv (default) or ndjson
+        start: optional first day, YYYY-MM-DD
+        end: optional last day, YYYY-MM-DD
+        after_id: resume after the registration with this id
+        limit: optional maximum number of registrations
+    """
+    calling_address = get_calling_address(request)
+    if not calling_address \
+            or not calling_address.startswith(config.INTERNAL_IP) \
+            or (EXPORT_TOKEN and not hmac.compare_digest(
+                request.headers.get("X-Export-Token", ""), EXPORT_TOKEN)):
+        return jsonify({"error": "forbidden"}), 403
+    fmt = request.args.get("format", "csv")
+    try:
+        limit = request.args.get("limit")
+        chunks = export.stream(fmt,
+                               start=query_date("start"),
+                               end=query_date("end"),
+                               after_id=int(request.args.get("after_id", 0)),
+                               limit=int(limit) if limit else None)
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+    return Response(stream_with_context(chunks),
+                    mimetype=export.FORMATS[fmt])
+
+
 @app.route("/register/status")
 @crossdomain(origin=CROSS_DOMAIN_SITE)
 def status():
     data = {"status": "up",
             "calling_address": get_calling_address(request),
             "remote_addr": request.remote_addr,
-            "in_house_address": config.INTERNAL_IP}
+            "in_house_address": config.INTERNAL_IP,
+            "postal_cache": geosearch.cache_stats(),
+            "geo_flight": geosearch.flight_stats(),
+            "geo_endpoints": geosearch.endpoint_metrics()}
     return jsonify(data)
 
 
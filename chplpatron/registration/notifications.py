@@ -0,0 +1,190 @@
+"""
+Notification email sender keeping a persistent SMTP connection
+"""
+__author__ = "Jeremy Nelson, Mike Stabile"
+
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+
+from concurrent.futures import Future
+
+log = logging.getLogger(__name__)
+
+
+class NotificationSender:
+    """
+    Sends email messages from a background thread over one SMTP connection
+    that is kept open between messages. Messages queued while the connection
+    is busy are sent together as a batch, a dropped connection is reopened
+    and the message retried.
+
+    :param host: SMTP server host
+    :param port: SMTP server port, 0 for the smtplib default
+    :param batch_size: maximum number of messages sent per batch
+    :param idle_timeout: seconds without messages before the connection is
+                         closed
+    :param max_attempts: attempts per message before it is reported failed
+    :param timeout: socket timeout for the SMTP connection
+
+    :example:
+        sender = NotificationSender("localhost")
+        sender.send(msg).result()
+        sender.metrics()
+            {'queue_depth': 0, 'sent': 1, 'failed': 0, 'reconnects': 0, ...}
+    """
+
+    def __init__(self,
+                 host="localhost",
+                 port=0,
+                 batch_size=20,
+                 idle_timeout=60,
+                 max_attempts=3,
+                 timeout=30):
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+        self.timeout = timeout
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._server = None
+        self.sent = 0
+        self.failed = 0
+        self.reconnects = 0
+        self.batches = 0
+        self.last_send = 0.0
+        self.total_send = 0.0
+
+    def send(self, msg):
+        """
+        Queues the message to be sent
+
+        :param msg: email.message.Message
+        :return: Future resolving to True once sent, or to the error
+        """
+        future = Future()
+        self._queue.put((msg, future))
+        self._start()
+        return future
+
+    def metrics(self):
+        """
+        :return: dict of send counters, latency in milliseconds and the
+                 number of queued messages
+        """
+        return {"queue_depth": self._queue.qsize(),
+                "sent": self.sent,
+                "failed": self.failed,
+                "reconnects": self.reconnects,
+                "batches": self.batches,
+                "last_send_ms": round(self.last_send * 1000, 1),
+                "avg_send_ms": round(self.total_send * 1000 / self.sent, 1)
+                if self.sent else 0.0}
+
+    def close(self):
+        """
+        Stops the sending thread after the queued messages are sent and
+        closes the connection
+        """
+        thread = self._thread
+        if thread is not None and thread.is_alive() \
+                and self._pid == os.getpid():
+            self._queue.put(None)
+            thread.join()
+        self._thread = None
+
+    def _start(self):
+        pid = os.getpid()
+        with self._lock:
+            if self._thread is not None and self._pid == pid \
+                    and self._thread.is_alive():
+                return
+            # a forked worker does not inherit the parent's connection
+            self._server = None
+            self._thread = threading.Thread(target=self._run,
+                                            name="notification-sender",
+                                            daemon=True)
+            self._pid = pid
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            self._send_batch([item for item in batch if item is not None])
+            if stop:
+                self._disconnect()
+                return
+
+    def _send_batch(self, batch):
+        if not batch:
+            return
+        self.batches += 1
+        for msg, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._send_one(msg)
+            except Exception as err:
+                self.failed += 1
+                log.error("Unable to send notification '%s' to %s: %s",
+                          msg['Subject'], msg['To'], err)
+                future.set_exception(err)
+            else:
+                future.set_result(True)
+
+    def _send_one(self, msg):
+        attempt = 1
+        while True:
+            try:
+                start = time.perf_counter()
+                self._connect().send_message(msg)
+                self.last_send = time.perf_counter() - start
+                self.total_send += self.last_send
+                self.sent += 1
+                return
+            except (smtplib.SMTPServerDisconnected,
+                    smtplib.SMTPConnectError,
+                    smtplib.SMTPHeloError,
+                    OSError) as err:
+                self._disconnect()
+                if attempt >= self.max_attempts:
+                    raise
+                log.warning("SMTP connection failed, reconnecting: %s", err)
+                self.reconnects += 1
+                attempt += 1
+                time.sleep(min(2 ** (attempt - 2), 10))
+
+    def _connect(self):
+        if self._server is None:
+            self._server = smtplib.SMTP(self.host,
+                                        self.port,
+                                        timeout=self.timeout)
+        return self._server
+
+    def _disconnect(self):
+        server = self._server
+        self._server = None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except (smtplib.SMTPException, OSError):
+            server.close()
@@ -3,6 +3,9 @@ Utility Methods and wrappers for registration app
 """
 __author__ = "Jeremy Nelson, Mike Stabile"
 
+import collections
+import threading
+
 from datetime import timedelta
 from functools import update_wrapper
 
@@ -73,6 +76,59 @@ def crossdomain(origin=None, methods=None, headers=None,
     return decorator
 
 
+def conditional(validator, maxsize=64):
+    """
+    Wrapper for read-only GET endpoints answering conditional requests. The
+    validator is called on every request and tells when the underlying data
+    last changed; responses carry it as ETag and Last-Modified, requests
+    whose If-None-Match or If-Modified-Since still match get a 304 and the
+    rendered responses are kept in memory until the data changes.
+
+    :param validator: function returning a tuple (version, last_modified)
+                      where version is a str or int that changes with the
+                      data and last_modified a datetime or None
+    :param maxsize: number of urls whose responses are kept
+    :return:
+    """
+    cache = collections.OrderedDict()
+    lock = threading.Lock()
+
+    def decorator(f):
+        def wrapped_function(*args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return f(*args, **kwargs)
+            version, last_modified = validator()
+            key = request.full_path
+            with lock:
+                entry = cache.get(key)
+                if entry is not None:
+                    cache.move_to_end(key)
+            if entry is None or entry[0] != version:
+                resp = make_response(f(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+                entry = (version,
+                         resp.get_data(),
+                         resp.mimetype,
+                         dict(resp.headers))
+                with lock:
+                    cache[key] = entry
+                    while len(cache) > maxsize:
+                        cache.popitem(last=False)
+            resp = current_app.response_class(entry[1],
+                                              mimetype=entry[2],
+                                              headers=entry[3])
+            resp.set_etag(str(version))
+            if last_modified is not None:
+                resp.last_modified = last_modified
+            # browsers revalidate before using their copy
+            resp.cache_control.no_cache = True
+            return resp.make_conditional(request)
+
+        return update_wrapper(wrapped_function, f)
+    return decorator
+
+
 class FldSpec:
     """
     Stores associative data for fields
@@ -3,19 +3,40 @@ import re
 from validate_email import validate_email
 from dateutil.parser import parse as date_parse
 
-from requests.exceptions import ConnectionError
+from requests.exceptions import RequestException
 from chplpatron import (geosearch,
                         sierra,
                         postaldb)
+from chplpatron.trackingdb import EmailFilter
 
 from chplpatron.exceptions import *
+from chplpatron.utilities.executors import shared_executor
 
 from .messages import InvalidMsgs
 from .utilities import Flds
 
+from instance import config
+
+# "remote_first" asks ArcGIS and falls back to the local postal database when
+# it is unreachable. "local_first" answers from the local postal database and
+# only asks ArcGIS for postal codes it does not contain.
+POSTAL_LOOKUP_MODE = getattr(config, "POSTAL_LOOKUP_MODE", "remote_first")
+# threads running the remote validation checks of a form concurrently
+VALIDATION_WORKERS = getattr(config, "VALIDATION_WORKERS", 8)
+# emails the filter has definitely not seen are not looked up in Sierra.
+# Only enable it with an export of the Sierra patron emails, patrons
+# registered at the desk are not in the tracking database.
+EMAIL_FILTER = EmailFilter(
+    export_path=getattr(config, "EMAIL_FILTER_EXPORT", None),
+    refresh_interval=getattr(config, "EMAIL_FILTER_REFRESH", 30)) \
+    if getattr(config, "EMAIL_BLOOM_FILTER", False) else None
+
 
 def validate_form(form):
-    """validates the form data before saving
+    """validates the form data before saving. The postal code and email
+    checks may call remote services and run concurrently on a shared thread
+    pool while the local checks run; errors are always reported in the
+    order postal code, birthday, password, email.
 
     Args:
         form: post form data
@@ -26,8 +47,27 @@ def validate_form(form):
     errors = []
 
     valid = True
-    valid_postal = postal_code(zipcode=form.get(Flds.postal_code.frm),
-                               debug=False)
+    executor = shared_executor("validation", VALIDATION_WORKERS)
+    postal_future = executor.submit(postal_code,
+                                    zipcode=form.get(Flds.postal_code.frm),
+                                    debug=False)
+    email_future = executor.submit(email_check,
+                                   email=form.get(Flds.email.frm))
+    birthday_errors = []
+    try:
+        py_date = date_parse(form.get(Flds.birthday.frm))
+        form[Flds.birthday.frm] = py_date.strftime('%m/%d/%Y')
+        if py_date.year < 1900:
+            birthday_errors.append({"field": Flds.birthday.frm,
+                                    "valid": False,
+                                    "message": "Birth year less than 1900 is not allowed."})
+    except:
+        birthday_errors.append({"field": Flds.birthday.frm,
+                                "valid": False,
+                                "message": "Invalid date format"})
+    val_password = validate_password(form.get(Flds.password.frm))
+
+    valid_postal = postal_future.result()
     if not valid_postal['valid']:
         valid_postal['field'] = Flds.postal_code.frm
         errors.append(valid_postal)
@@ -36,22 +76,11 @@ def validate_form(form):
             form[Flds.city.frm] = valid_postal['data']['city'][0]
         if form.get(Flds.state.frm) in [None, ""]:
             form[Flds.state.frm] = valid_postal['data']['state']
-    try:
-        py_date = date_parse(form.get(Flds.birthday.frm))
-        form[Flds.birthday.frm] = py_date.strftime('%m/%d/%Y')
-        if py_date.year < 1900:
-            errors.append({"field": Flds.birthday.frm,
-                           "valid": False,
-                           "message": "Birth year less than 1900 is not allowed."})
-    except:
-        errors.append({"field": Flds.birthday.frm,
-                       "valid": False,
-                       "message": "Invalid date format"})
-    val_password = validate_password(form.get(Flds.password.frm))
+    errors.extend(birthday_errors)
     if not val_password['valid']:
         val_password['field'] = Flds.password.frm
         errors.append(val_password)
-    val_email = email_check(email=form.get(Flds.email.frm))
+    val_email = email_future.result()
     if not val_email['valid']:
         val_email['field'] = Flds.email.frm
         errors.append(val_email)
@@ -79,7 +108,9 @@ def email_check(**kwargs):
         message = "Enter a valid email address"
     elif perform_email_check:
         try:
-            sierra.check_email(email_value)
+            if EMAIL_FILTER is None \
+                    or EMAIL_FILTER.might_be_registered(email_value):
+                sierra.check_email(email_value)
         except RegisteredEmailError:
             valid = False
             message = InvalidMsgs.email_reg.value
@@ -118,22 +149,14 @@ def postal_code(zipcode, **kwargs):
         postal_value = postal_value[:5]
     if len(postal_value) == 5:
         try:
-            locations = geosearch.get_postal_code(postal_value)
+            locations = lookup_postal_code(postal_value,
+                                           kwargs.get("mode"))
             valid = True
             data['city'] = [ix.get('city') for ix in locations]
             data['state'] = [ix.get("state") for ix in locations][0]
             message = ""
         except InvalidPostalCode:
             message = InvalidMsgs.invalid_postal_code.value
-        except (AttributeError, ConnectionError):
-            try:
-                locations = postaldb.get_postal_code(postal_value)
-                valid = True
-                data['city'] = [ix.get('city') for ix in locations]
-                data['state'] = [ix.get("state") for ix in locations][0]
-                message = ""
-            except InvalidPostalCode:
-                message = InvalidMsgs.invalid_postal_code.value
 
     rtn_msg = {"valid": valid,
                "message": message,
@@ -145,6 +168,35 @@ def postal_code(zipcode, **kwargs):
     return rtn_msg
 
 
+def lookup_postal_code(postal_value, mode=None):
+    """
+    Looks up the locations of a postal code in the order set by
+    POSTAL_LOOKUP_MODE
+
+    :param postal_value: 5 digit postal code
+    :param mode: optional "remote_first" or "local_first" overriding
+                 POSTAL_LOOKUP_MODE
+    :return: list of dicts with keys ['postal_code', 'city', 'state']
+    """
+    if (mode or POSTAL_LOOKUP_MODE) == "local_first":
+        try:
+            return postaldb.get_postal_code(postal_value)
+        except InvalidPostalCode:
+            pass
+        try:
+            return geosearch.get_postal_code(postal_value)
+        except (AttributeError, RequestException, RemoteApiError,
+                CircuitOpenError):
+            # the local database covers every US postal code, a miss that
+            # cannot be confirmed remotely is treated as invalid
+            raise InvalidPostalCode(postal_value)
+    try:
+        return geosearch.get_postal_code(postal_value)
+    except (AttributeError, RequestException, RemoteApiError,
+            CircuitOpenError):
+        return postaldb.get_postal_code(postal_value)
+
+
 REQ_BOUNDARY = {'street', 'city', 'state', 'postal_code'}
 
 
@@ -166,6 +218,34 @@ def boundary_check(**kwargs):
     return rtn_msg
 
 
+def form_address(form):
+    """
+    :param form: post form data
+    :return: dict of the address fields needed by boundary_check
+    """
+    return {'street': form.get(Flds.street.frm),
+            'city': form.get(Flds.city.frm),
+            'state': form.get(Flds.state.frm),
+            'postal_code': form.get(Flds.postal_code.frm)}
+
+
+def start_boundary_check(form):
+    """
+    Starts the boundary check of the submitted address in the background so
+    it runs while the form is validated. Nothing is started unless every
+    address field was submitted, as validation may still fill in the city
+    and state.
+
+    :param form: post form data
+    :return: tuple of the address checked and its Future, or (None, None)
+    """
+    address = form_address(form)
+    if not all(address.values()):
+        return None, None
+    executor = shared_executor("validation", VALIDATION_WORKERS)
+    return address, executor.submit(boundary_check, **address)
+
+
 def validate_password(password):
     """
     validates if a password is acceptable
@@ -13,4 +13,6 @@ from .functions import (check_email,
                         APIS)
 from .lookups import (PatronFlds,
                       Apis)
+from .tokens import (TokenManager,
+                     TokenStore)
 from .patron import *
@@ -0,0 +1,165 @@
+"""
+asyncio versions of the patron functions in functions.py for use from an
+ASGI worker. The token is shared with the blocking functions.
+
+:example:
+    patron_id = await aiofunctions.create_patron(patron)
+"""
+import asyncio
+import instance
+
+from chplpatron.exceptions import (RemoteApiError,
+                                   PasswordError)
+from .aiolookups import AsyncApis
+from .functions import (TOKENS,
+                        BARCODE_MODE,
+                        EMAIL_LOOKUP_WORKERS,
+                        defer_barcode,
+                        email_query,
+                        has_email)
+from .lookups import PatronFlds
+from .patron import Patron
+
+AIO_APIS = AsyncApis("production",  # "sandbox"
+                     pool_size=getattr(instance, "SIERRA_POOL_SIZE", 10),
+                     retries=getattr(instance, "SIERRA_RETRIES", 2))
+
+
+async def get_headers():
+    """
+    Gets the base headers for all api requests. A token refresh runs in the
+    default executor so that it does not block the event loop.
+
+    :return: header dictionary
+    """
+    token = TOKENS.cached()
+    if not token:
+        loop = asyncio.get_event_loop()
+        token = await loop.run_in_executor(None, TOKENS.get_token)
+    return {"Authorization": token,
+            "Content-Type": "application/json"}
+
+
+async def create_patron(patron, barcode=None, barcode_mode=None):
+    """
+    Creates a new patron record, see functions.create_patron for how the
+    barcode is set
+
+    :param patron: a Patron class instance
+    :param barcode: optional barcode to create the patron with
+    :param barcode_mode: 'inline', 'deferred' or 'none', defaults to
+                         BARCODE_MODE
+    :return: patron_id
+    """
+    if barcode:
+        patron.barcodes = barcode
+    headers = await get_headers()
+    result = await AIO_APIS.create_patron(headers=headers,
+                                          json=patron.to_dict())
+    if result.status_code > 299:
+        if "PIN " in result.text:
+            raise PasswordError(result)
+        raise RemoteApiError(result)
+    patron_id = result.json().get("link", "").split("/")[-1]
+    barcode_mode = barcode_mode or BARCODE_MODE
+    if patron_id and not patron.barcodes and barcode_mode != "none":
+        if barcode_mode == "deferred":
+            defer_barcode(patron_id, patron_id)
+        else:
+            await set_barcode(patron_id, patron_id, headers=headers)
+    return patron_id
+
+
+async def update_patron(patron, patron_id):
+    """
+    updates the specified patron
+    :param patron: a Patron class instance
+    :param patron_id:
+    :return: True if successful
+    :raises: PasswordError on fail
+    """
+    result = await AIO_APIS.patron_update(patron_id,
+                                          headers=await get_headers(),
+                                          json=patron.to_dict())
+    if result.status_code != 204:
+        raise PasswordError(result)
+    return True
+
+
+async def lookup_by_email(email_value=None, first_hit=False):
+    """
+    Lookup a Patron by their email address. At most EMAIL_LOOKUP_WORKERS
+    patron records are fetched at once.
+
+    :param email_value: the email address to search for
+    :param first_hit: If true returns as soon as one fetched patron has the
+                      email address, without waiting on the remaining records
+    :return: list of patron information dicts
+    """
+    if not email_value:
+        return {}
+
+    email_value = email_value.strip().lower()
+    headers = await get_headers()
+
+    result = await AIO_APIS.query(params=[0, 3],
+                                  headers=headers,
+                                  json=email_query(email_value))
+    if result.status_code != 200:
+        raise RemoteApiError(result)
+    semaphore = asyncio.Semaphore(EMAIL_LOOKUP_WORKERS)
+
+    async def fetch(link):
+        async with semaphore:
+            response = await AIO_APIS.get_link(
+                    "{0}?fields={1}".format(link, PatronFlds.list_all()),
+                    headers=headers)
+        return response.json()
+
+    tasks = [asyncio.ensure_future(fetch(entry['link']))
+             for entry in result.json().get('entries', [])]
+    if not first_hit:
+        return list(await asyncio.gather(*tasks))
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            patron = await next_done
+            if has_email(patron, email_value):
+                return [patron]
+        return []
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def lookup_by_id(patron_id):
+    """
+    Lookup a Patron by their patron_id
+
+    :param patron_id: the patron id
+    :return dict: patron information
+    """
+    result = await AIO_APIS.patron_get([patron_id, PatronFlds.list_all()],
+                                       headers=await get_headers())
+    if result.status_code != 200:
+        raise RemoteApiError(result)
+    return result.json()
+
+
+async def set_barcode(barcode, patron_id, headers=None):
+    """
+    sets the barcode for the specified patron
+    :param barcode:
+    :param patron_id:
+    :param headers: optional headers to reuse from a previous call
+    :return True: if successful
+    :raises RemoteApiError: on fail
+    """
+    patron = Patron()
+    patron.barcodes = barcode
+    result = await AIO_APIS.patron_update(patron_id,
+                                          headers=headers
+                                          or await get_headers(),
+                                          json=patron.to_dict())
+    if result.status_code != 204:
+        raise RemoteApiError(result)
+    return True
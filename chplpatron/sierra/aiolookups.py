@@ -0,0 +1,155 @@
+"""
+asyncio counterparts of Apis and ApiCaller. The urls and request arguments
+are formatted by the same BaseApiCaller used by the blocking client so both
+stay in step.
+"""
+import asyncio
+import weakref
+
+import httpx
+
+from chplpatron.utilities.sessions import DEFAULT_TIMEOUT
+from .lookups import (UrlMode,
+                      ApiUrls,
+                      BaseApiCaller)
+
+
+class AsyncApis:
+    """
+    asynchronously call the specified API with supplied paramaters
+
+    :param url_mode: ["production", "sandbox"] specifies which base url to use
+    :param pool_size: number of keep-alive connections kept open to the host
+    :param retries: number of retries for failed connections
+    :param timeout: default (connect, read) timeout for each request
+
+    :usage:
+        await apis.[ApiUrls name](parameters, **kwargs)
+
+    :example:
+        apis = AsyncApis("production")
+        response = await apis.find(params=["n", "DOE, JOHN"], headers=headers)
+        print(response.text)
+            "data of a httpx text attribute"
+    """
+    modes = UrlMode
+    base_url = modes.production
+    api_specs = ApiUrls
+
+    def __init__(self,
+                 url_mode="production",
+                 pool_size=10,
+                 retries=2,
+                 timeout=DEFAULT_TIMEOUT):
+        self.base_url = getattr(self.modes, url_mode)
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = timeout
+        # event loop -> (client, scope), see _scope
+        self._clients = weakref.WeakKeyDictionary()
+
+    def __getattr__(self, item):
+        try:
+            return self.__getattribute__(item)
+        except AttributeError:
+            spec = getattr(self.api_specs, item)
+            try:
+                return AsyncApiCaller(spec, self.base_url.value, self)
+            except AttributeError:
+                return AsyncApiCaller(spec, self.base_url, self)
+
+    def _new_client(self):
+        """
+        :return: a new httpx.AsyncClient
+        """
+        connect, read = self.timeout
+        # transport retries only cover failed connections, so a POST is
+        # never sent twice
+        transport = httpx.AsyncHTTPTransport(retries=self.retries)
+        return httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(read, connect=connect),
+            limits=httpx.Limits(max_connections=self.pool_size,
+                                max_keepalive_connections=self.pool_size))
+
+    @staticmethod
+    async def _scope(client):
+        """
+        Keeps client open for the life of its event loop. The loop closes
+        its async generators as it shuts down (asyncio.run does, or
+        loop.shutdown_asyncgens), which closes the client's connections on
+        the loop that owns them.
+        """
+        try:
+            yield
+        finally:
+            await client.aclose()
+
+    async def client(self):
+        """
+        :return: the httpx.AsyncClient for the running event loop, one per
+                 loop
+        """
+        loop = asyncio.get_event_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            for other in [other for other in self._clients
+                          if other.is_closed()]:
+                del self._clients[other]
+            client = self._new_client()
+            scope = self._scope(client)
+            # the first step registers the generator with the loop
+            await scope.__anext__()
+            entry = self._clients[loop] = (client, scope)
+        return entry[0]
+
+    async def request(self, method, url, **kwargs):
+        """
+        Sends a request over the shared client
+
+        :param method: http method name, i.e. 'get', 'post'
+        :param url: the full url
+        :param kwargs: keyword arguments as used with requests
+        :return: httpx.Response
+        """
+        if isinstance(kwargs.get('data'), (str, bytes)):
+            kwargs['content'] = kwargs.pop('data')
+        client = await self.client()
+        return await client.request(method.upper(), url, **kwargs)
+
+    async def get_link(self, url, **kwargs):
+        """
+        Calls a full url, i.e. a link returned by a query
+
+        :param url: the full url
+        :return: httpx.Response
+        """
+        return await self.request("get", url, **kwargs)
+
+    async def aclose(self):
+        """
+        Closes the pooled connections of the running event loop's client
+        """
+        entry = self._clients.pop(asyncio.get_event_loop(), None)
+        if entry is not None:
+            await entry[1].aclose()
+
+
+class AsyncApiCaller(BaseApiCaller):
+    """
+    asynchronously calls the API with the supplied parameters and data
+    """
+    def __init__(self, api_spec, base_url, apis):
+        super().__init__(api_spec, base_url)
+        self.apis = apis
+
+    async def __call__(self,
+                       params=None,
+                       data=None,
+                       json=None,
+                       headers=None,
+                       **kwargs):
+        url, req_kwargs = self.prepare(params, data, json, headers, **kwargs)
+        if kwargs.get("test"):
+            return url
+        return await self.apis.request(self.method, url, **req_kwargs)
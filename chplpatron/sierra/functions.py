@@ -1,21 +1,40 @@
-import base64
-import requests
 import instance
-import datetime
+import logging
 import pprint
+
+from concurrent.futures import as_completed
+
 from chplpatron.exceptions import (RemoteApiError,
                                    RegisteredEmailError,
                                    PasswordError,
                                    TokenError)
+from chplpatron.utilities.executors import shared_executor
+from chplpatron.utilities.timing import StageTimer
 from .lookups import (Apis,
                       PatronFlds)
 from .patron import Patron
-
-APIS = Apis("production")  # "sandbox"
-TOKEN = None
-# the time that the token expires
-TOKEN_TIME = datetime.datetime.now()
-REQ_TOKEN_ROLES = {'Patrons_Read', 'Patrons_Write'}
+from .tokens import (TokenManager,
+                     TokenStore,
+                     REQ_TOKEN_ROLES)
+
+APIS = Apis("production",  # "sandbox"
+            pool_size=getattr(instance, "SIERRA_POOL_SIZE", 10),
+            retries=getattr(instance, "SIERRA_RETRIES", 2))
+# maximum number of patron records fetched at once by lookup_by_email
+EMAIL_LOOKUP_WORKERS = getattr(instance, "SIERRA_EMAIL_LOOKUP_WORKERS", 3)
+# how the barcode of a new patron is set when it is not known beforehand,
+# 'inline', 'deferred' or 'none' (see create_patron)
+BARCODE_MODE = getattr(instance, "SIERRA_BARCODE_MODE", "inline")
+# set SIERRA_TOKEN_STORE to a file path to share the token between workers
+TOKEN_STORE_PATH = getattr(instance, "SIERRA_TOKEN_STORE", None)
+TOKENS = TokenManager(APIS,
+                      instance.API_KEY,
+                      instance.CLIENT_SECRET,
+                      REQ_TOKEN_ROLES,
+                      store=TokenStore(TOKEN_STORE_PATH)
+                      if TOKEN_STORE_PATH else None)
+
+log = logging.getLogger(__name__)
 
 
 def get_headers():
@@ -38,44 +57,7 @@ def get_token(error=False):
     :return: the token
     :raises TokenError: on fail
     """
-
-    global TOKEN
-    global TOKEN_TIME
-    if TOKEN and datetime.datetime.now() < TOKEN_TIME and not error:
-        return TOKEN
-    encoded_key = base64.b64encode("{}:{}".format(instance.API_KEY, 
-                                   instance.CLIENT_SECRET).encode())
-    headers = {
-       "Authorization": "Basic {}".format(encoded_key.decode()), 
-       "Content-Type": "application/x-www-form-urlencoded"
-    }
-    response = APIS.token(headers=headers,
-                          data="grant_type=client_credentials")
-    
-    if response.status_code < 399:
-        try:
-            TOKEN = "{token_type} {access_token}".format(**response.json())
-            expires = response.json().get("expires_in") - 10
-            TOKEN_TIME = datetime.datetime.now() \
-                + datetime.timedelta(seconds=expires)
-            # Test to see if the token has the required roles/permissions
-            token_info = get_token_info()
-            token_roles = set([role.get('name')
-                               for role in token_info.get('roles', [{}])
-                               if role.get('name')])
-            missing_roles = REQ_TOKEN_ROLES.difference(token_roles)
-            if missing_roles:
-                raise TokenError(instance.API_KEY,
-                                 instance.CLIENT_SECRET,
-                                 response,
-                                 "Missing Roles: {}".format(missing_roles))
-            return TOKEN
-        except Exception as err:
-            if isinstance(err, TokenError):
-                raise err
-    raise TokenError(instance.API_KEY,
-                     instance.CLIENT_SECRET,
-                     response)
+    return TOKENS.get_token(force=error)
 
 
 def get_token_info():
@@ -93,24 +75,66 @@ def delete_patron(patron_id):
     return result
 
 
-def create_patron(patron):
+def create_patron(patron, barcode=None, barcode_mode=None, timer=None):
     """
-    Creates a new patron record
+    Creates a new patron record.
+
+    When the barcode is known beforehand it is sent with the new record so
+    only one request is made. Otherwise the patron id becomes the barcode
+    once the record exists and is either set before returning ('inline'),
+    queued as a set_barcode job for the job queue worker ('deferred') or
+    left to the caller ('none').
+
     :param patron: a Patron class instance
-    :return: response
+    :param barcode: optional barcode to create the patron with
+    :param barcode_mode: 'inline', 'deferred' or 'none', defaults to
+                         BARCODE_MODE
+    :param timer: optional StageTimer to add the stage timings to, if not
+                  supplied the timings are logged
+    :return: patron_id
     """
-    result = APIS.create_patron(headers=get_headers(),
-                                json=patron.to_dict())
-    patron_id = result.json().get("link", "").split("/")[-1]
+    owns_timer = timer is None
+    if owns_timer:
+        timer = StageTimer("create_patron", log)
+    if barcode:
+        patron.barcodes = barcode
+    with timer.stage("headers"):
+        headers = get_headers()
+    with timer.stage("create"):
+        result = APIS.create_patron(headers=headers,
+                                    json=patron.to_dict())
     if result.status_code > 299:
         if "PIN " in result.text:
             raise PasswordError(result)
         raise RemoteApiError(result)
-    if patron_id:
-        set_barcode(patron_id, patron_id)
+    patron_id = result.json().get("link", "").split("/")[-1]
+    barcode_mode = barcode_mode or BARCODE_MODE
+    if patron_id and not patron.barcodes and barcode_mode != "none":
+        if barcode_mode == "deferred":
+            with timer.stage("barcode_queued"):
+                defer_barcode(patron_id, patron_id)
+        else:
+            with timer.stage("barcode"):
+                set_barcode(patron_id, patron_id, headers=headers)
+    if owns_timer:
+        timer.log()
     return patron_id
 
 
+def defer_barcode(barcode, patron_id):
+    """
+    Queues setting the barcode in the durable job queue, the job queue
+    worker sets it with retries and keeps it across restarts
+
+    :param barcode:
+    :param patron_id:
+    :return: the job id
+    """
+    from chplpatron import jobqueue
+    return jobqueue.enqueue("set_barcode", {"barcode": barcode,
+                                            "patron_id": patron_id})
+
+
 def update_patron(patron, patron_id):
     """
     sets the email for the specified patron
@@ -138,21 +162,14 @@ def get_all_patrons(modified=None):
     result = APIS.patron(headers=get_headers())
 
 
-def lookup_by_email(email_value=None):
+def email_query(email_value):
     """
-    Lookup a Patron by their email address
+    Builds the patrons/query json for an email search
 
-    :param email_value: the email address to search for
-    :return: dict: patron information
+    :param email_value: the normalized email address
+    :return: dict
     """
-
-    if not email_value:
-        return {}
-
-    email_value = email_value.strip().lower()
-    headers = get_headers()
-
-    json_qry = {
+    return {
         "target": {
             "record": {"type": "patron"},
             "field": {"tag": "z"}
@@ -163,16 +180,64 @@ def lookup_by_email(email_value=None):
         }
     }
 
-    result = APIS.query(params=[0, 3], headers=headers, json=json_qry)
+
+def has_email(patron, email_value):
+    """
+    Tests to see if the patron record contains the email address
+
+    :param patron: patron information dict
+    :param email_value: the normalized email address
+    :return: bool
+    """
+    return any(email.lower() == email_value
+               for email in patron.get("emails", []))
+
+
+def lookup_by_email(email_value=None, first_hit=False):
+    """
+    Lookup a Patron by their email address. The patron records returned by
+    the query are fetched concurrently on the shared 'sierra' thread pool.
+
+    :param email_value: the email address to search for
+    :param first_hit: If true returns as soon as one fetched patron has the
+                      email address, without waiting on the remaining records
+    :return: list: of patron information dicts
+    """
+
+    if not email_value:
+        return {}
+
+    email_value = email_value.strip().lower()
+    headers = get_headers()
+
+    result = APIS.query(params=[0, 3],
+                        headers=headers,
+                        json=email_query(email_value))
     if result.status_code != 200:
         raise RemoteApiError(result)
-    responses = []
-    for link in result.json().get('entries', []):
-        responses.append(requests.get("{0}?fields={1}".format(link['link'],
-                                      PatronFlds.list_all()),
-                                      headers=headers))
-    return [response.json() for response in responses]
-    # return []
+    links = ["{0}?fields={1}".format(entry['link'], PatronFlds.list_all())
+             for entry in result.json().get('entries', [])]
+    if len(links) < 2:
+        patrons = [APIS.get_link(link, headers=headers).json()
+                   for link in links]
+        if first_hit:
+            return [patron for patron in patrons
+                    if has_email(patron, email_value)]
+        return patrons
+    executor = shared_executor("sierra", EMAIL_LOOKUP_WORKERS)
+    futures = [executor.submit(APIS.get_link, link, headers=headers)
+               for link in links]
+    if not first_hit:
+        return [future.result().json() for future in futures]
+    try:
+        for future in as_completed(futures):
+            patron = future.result().json()
+            if has_email(patron, email_value):
+                return [patron]
+        return []
+    finally:
+        for future in futures:
+            future.cancel()
 
 
 def lookup_by_name(name=None):
@@ -210,11 +275,12 @@ def lookup_by_id(patron_id):
     return result.json()
 
 
-def set_barcode(barcode, patron_id):
+def set_barcode(barcode, patron_id, headers=None):
     """
     sets the barcode for the specified patron
     :param barcode:
     :param patron_id:
+    :param headers: optional headers to reuse from a previous call
     :return True: if successful
     :raises RemoteApiError: on fail
     """
@@ -222,7 +288,7 @@ def set_barcode(barcode, patron_id):
     patron.barcodes = barcode
     # data = {"barcodes": [str(barcode)]}
     result = APIS.patron_update(patron_id,
-                                headers=get_headers(),
+                                headers=headers or get_headers(),
                                 json=patron.to_dict())
     if result.status_code != 204:
         raise RemoteApiError(result)
@@ -258,11 +324,7 @@ def check_email(email_value=None):
     """
     if not email_value:
         return True
-    patron_list = lookup_by_email(email_value)
-    try:
-        emails = patron_list[0].get("emails", [])
-        for email in emails:
-            if email.lower() == email_value:
-                raise RegisteredEmailError(email_value)
-    except IndexError:
-        return True
+    email_value = email_value.strip().lower()
+    if lookup_by_email(email_value, first_hit=True):
+        raise RegisteredEmailError(email_value)
+    return True
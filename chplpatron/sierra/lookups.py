@@ -4,10 +4,12 @@ associated functions and classes
 """
 
 import urllib.parse
-import requests
 
 from enum import Enum
 
+from chplpatron.utilities.sessions import (PooledSession,
+                                           DEFAULT_TIMEOUT)
+
 PRODUCTION_URL = ("https://catalog.chapelhillpubliclibrary.org/"
                   "iii/sierra-api/v5/")
 SANDBOX_URL = "https://sandbox.iii.com:443/iii/sierra-api/v5/"
@@ -83,7 +85,7 @@ class ApiSpec:
     def __init__(self, url, method=methods.get, params=None):
         self.url = url
         self.params = params
-        self.method = getattr(requests, method.value)
+        self.method = method.value
 
 
 class ApiUrls(Enum):
@@ -126,6 +128,11 @@ class Apis:
     call the specified API with supplied paramaters
 
     :param url_mode: ["production", "sandbox"] specifies which base url to use
+    :param pool_size: number of keep-alive connections kept open to the host
+    :param retries: number of retries for failed connections
+    :param timeout: default (connect, read) timeout for each request
+
+    All ApiCallers created by an Apis instance share its pooled session.
 
     :usage:
         apis.[ApiUrls name](parameters, **kwargs)
@@ -140,8 +147,15 @@ class Apis:
     base_url = modes.production
     api_specs = ApiUrls
 
-    def __init__(self, url_mode="production"):
+    def __init__(self,
+                 url_mode="production",
+                 pool_size=10,
+                 retries=2,
+                 timeout=DEFAULT_TIMEOUT):
         self.base_url = getattr(self.modes, url_mode)
+        self.session = PooledSession(pool_size=pool_size,
+                                     retries=retries,
+                                     timeout=timeout)
 
     def __getattr__(self, item):
         try:
@@ -149,14 +163,36 @@ class Apis:
         except AttributeError:
             spec = getattr(self.api_specs, item)
             try:
-                return ApiCaller(spec, self.base_url.value)
+                return self.caller(spec, self.base_url.value, self.session)
             except AttributeError:
-                return ApiCaller(spec, self.base_url)
+                return self.caller(spec, self.base_url, self.session)
+
+    @staticmethod
+    def caller(api_spec, base_url, session):
+        return ApiCaller(api_spec, base_url, session)
+
+    def get_link(self, url, **kwargs):
+        """
+        Calls a full url, i.e. a link returned by a query, over the shared
+        session
+
+        :param url: the full url
+        :return: requests.Response
+        """
+        return self.session.request("get", url, **kwargs)
+
+    def stats(self):
+        """
+        :return: connection reuse counters for the shared session
+        """
+        return self.session.stats()
 
 
-class ApiCaller:
+class BaseApiCaller:
     """
-    calls the API with the supplied parameters and data
+    formats the url and request arguments for an API endpoint. Shared by the
+    blocking ApiCaller and the asyncio AsyncApiCaller so both send the same
+    requests.
     """
     def __init__(self, api_spec, base_url):
         self.api_spec = api_spec
@@ -168,21 +204,24 @@ class ApiCaller:
         if "{}" in self.api_spec.value.url:
             self.key = True
 
-    def __call__(self,
-                 params=None,
-                 data=None,
-                 json=None,
-                 headers=None,
-                 **kwargs):
+    def prepare(self,
+                params=None,
+                data=None,
+                json=None,
+                headers=None,
+                **kwargs):
+        """
+        Sets the call arguments and formats the request
+
+        :return: tuple (url, request kwargs)
+        """
         self.params = params
         self.data = data
         self.json = json
         self.headers = headers
         req_kwargs = self.make_req_kwargs(**kwargs)
         url = self.format_url()
-        if kwargs.get("test"):
-            return url
-        return self.method(url, **req_kwargs)
+        return url, req_kwargs
 
     def make_req_kwargs(self, **kwargs):
         if not isinstance(kwargs, dict):
@@ -251,6 +290,26 @@ class ApiCaller:
         return params
 
 
+class ApiCaller(BaseApiCaller):
+    """
+    calls the API with the supplied parameters and data
+    """
+    def __init__(self, api_spec, base_url, session=None):
+        super().__init__(api_spec, base_url)
+        self.session = session if session is not None else PooledSession()
+
+    def __call__(self,
+                 params=None,
+                 data=None,
+                 json=None,
+                 headers=None,
+                 **kwargs):
+        url, req_kwargs = self.prepare(params, data, json, headers, **kwargs)
+        if kwargs.get("test"):
+            return url
+        return self.session.request(self.method, url, **req_kwargs)
+
+
 class InvalidParameter(Exception):
     """
     Exception for a parameter violation
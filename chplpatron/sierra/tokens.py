@@ -0,0 +1,314 @@
+"""
+Module managing the Sierra API OAuth token, i.e. fetching, role
+verification, caching and sharing the token between worker processes
+"""
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+import base64
+import contextlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from chplpatron.exceptions import TokenError
+
+REQ_TOKEN_ROLES = {'Patrons_Read', 'Patrons_Write'}
+# seconds before the reported expiration that a token is treated as expired
+EXPIRE_MARGIN = 10
+# seconds before expiration that the background refresh fetches a new token
+REFRESH_MARGIN = 60
+
+log = logging.getLogger(__name__)
+
+
+class TokenStore:
+    """
+    Small SQLite backed store used to share a token between gunicorn workers.
+    The store is also used as the cross process lock so that only one worker
+    requests a new token from Sierra at a time.
+
+    :param db_path: file path of the sqlite database
+    :param timeout: seconds a worker waits for the lock held by another
+                    worker's refresh
+    """
+    tbl = "SierraToken"
+
+    def __init__(self, db_path, timeout=30):
+        self.db_path = db_path
+        self.timeout = timeout
+        con = self._connect()
+        con.execute("CREATE TABLE IF NOT EXISTS {} ("
+                    "api_key VARCHAR PRIMARY KEY NOT NULL, "
+                    "token VARCHAR NOT NULL, "
+                    "expires REAL NOT NULL, "
+                    "verified INTEGER NOT NULL DEFAULT 0"
+                    ");".format(self.tbl))
+        con.commit()
+        con.close()
+        # the token grants patron write access; keep it private
+        os.chmod(self.db_path, 0o600)
+
+    def _connect(self):
+        con = sqlite3.connect(self.db_path,
+                              timeout=self.timeout,
+                              isolation_level=None)
+        return con
+
+    @contextlib.contextmanager
+    def lock(self):
+        """
+        Holds a write lock on the store for the duration of the context
+
+        :return: connection to use for load/save calls within the lock
+        :raises sqlite3.OperationalError: if the lock is not acquired within
+                                          the timeout
+        """
+        con = self._connect()
+        try:
+            con.execute("BEGIN IMMEDIATE")
+        except Exception:
+            con.close()
+            raise
+        try:
+            yield con
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.close()
+
+    def load(self, api_key, con=None):
+        """
+        :param api_key: the api key the token was issued for
+        :param con: optional connection returned by lock()
+        :return: tuple (token, expires, verified) or None
+        """
+        owned = con is None
+        con = con or self._connect()
+        try:
+            return con.execute("SELECT token, expires, verified "
+                               "FROM {} WHERE api_key=?;".format(self.tbl),
+                               (api_key,)).fetchone()
+        finally:
+            if owned:
+                con.close()
+
+    def save(self, api_key, token, expires, verified, con=None):
+        """
+        Stores the token for the api key
+
+        :param api_key: the api key the token was issued for
+        :param token: the authorization header value
+        :param expires: epoch time the token expires
+        :param verified: True if the token roles have been verified
+        :param con: optional connection returned by lock()
+        """
+        owned = con is None
+        con = con or self._connect()
+        try:
+            con.execute("INSERT OR REPLACE INTO {} "
+                        "(api_key, token, expires, verified) "
+                        "VALUES (?,?,?,?);".format(self.tbl),
+                        (api_key, token, expires, int(verified)))
+        finally:
+            if owned:
+                con.close()
+
+
+class TokenManager:
+    """
+    Thread-safe holder of the Sierra API token.
+
+    Only one refresh is ever in flight: concurrent callers that find the
+    token expired wait for the refresh started by the first caller and then
+    share its result. A background timer fetches a new token shortly before
+    the current one expires so that requests do not wait on a refresh at
+    all, and the role check is only run once for each token. If a TokenStore
+    is supplied the token is shared with the other worker processes.
+
+    :param apis: Apis instance used to call the token endpoints
+    :param api_key: Sierra API key
+    :param secret: Sierra client secret
+    :param required_roles: set of roles the token must have
+    :param store: optional TokenStore shared between processes
+    :param background_refresh: refresh the token before it expires
+    :param refresh_margin: seconds before expiration to refresh
+
+    :example:
+        tokens = TokenManager(APIS, instance.API_KEY, instance.CLIENT_SECRET)
+        headers = {"Authorization": tokens.get_token()}
+    """
+
+    def __init__(self,
+                 apis,
+                 api_key,
+                 secret,
+                 required_roles=REQ_TOKEN_ROLES,
+                 store=None,
+                 background_refresh=True,
+                 refresh_margin=REFRESH_MARGIN):
+        self.apis = apis
+        self.api_key = api_key
+        self.secret = secret
+        self.required_roles = set(required_roles)
+        self.store = store
+        self.background_refresh = background_refresh
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires = 0
+        self._verified = None
+        self._timer = None
+        self._timer_pid = None
+
+    def cached(self):
+        """
+        :return: the current token if it has not expired else None
+        """
+        token = self._token
+        if token and time.time() < self._expires:
+            return token
+        return None
+
+    def get_token(self, force=False):
+        """
+        Returns a valid token, fetching a new one if needed
+
+        :param force: If true a new token is requested even if the current
+                      token has not expired, i.e. Sierra rejected the token
+        :return: the token
+        :raises TokenError: on fail
+        """
+        seen = self._token
+        if not force:
+            token = self.cached()
+            if token:
+                return token
+        with self._lock:
+            # another thread refreshed the token while this one was waiting
+            token = self.cached()
+            if token and (not force or token != seen):
+                return token
+            self._refresh(stale=seen if force else None)
+            return self._token
+
+    def _refresh(self, stale=None):
+        """
+        Sets a new token, called with self._lock held
+
+        :param stale: a token that must not be reused
+        """
+        if self.store is None:
+            self._set(*self._fetch())
+            return
+        try:
+            with self.store.lock() as con:
+                stored = self.store.load(self.api_key, con)
+                if stored \
+                        and stored[0] != stale \
+                        and time.time() < stored[1] \
+                        and stored[2]:
+                    self._set(stored[0], stored[1], stored[0])
+                    return
+                token, expires, verified = self._fetch()
+                self.store.save(self.api_key, token, expires, True, con)
+        except sqlite3.OperationalError as err:
+            # i.e. another worker's fetch held the lock past the timeout
+            raise TokenError(self.api_key,
+                             self.secret,
+                             None,
+                             "Token store unavailable: {}".format(err))
+        self._set(token, expires, verified)
+
+    def _set(self, token, expires, verified):
+        self._token = token
+        self._expires = expires
+        self._verified = verified
+        self._schedule()
+
+    def _fetch(self):
+        """
+        Requests a new token from Sierra and verifies its roles
+
+        :return: tuple (token, expires, verified token)
+        """
+        encoded_key = base64.b64encode("{}:{}".format(self.api_key,
+                                                      self.secret).encode())
+        headers = {
+            "Authorization": "Basic {}".format(encoded_key.decode()),
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        response = self.apis.token(headers=headers,
+                                   data="grant_type=client_credentials")
+        if response.status_code < 399:
+            try:
+                data = response.json()
+                token = "{token_type} {access_token}".format(**data)
+                expires_in = data.get("expires_in")
+                expires = time.time() + expires_in - EXPIRE_MARGIN
+            except Exception:
+                raise TokenError(self.api_key, self.secret, response)
+            self._check_roles(token, response)
+            return token, expires, token
+        raise TokenError(self.api_key, self.secret, response)
+
+    def _check_roles(self, token, response):
+        """
+        Tests to see if the token has the required roles/permissions. The
+        check is skipped if the token was already verified.
+
+        :raises TokenError: if any roles are missing
+        """
+        if token == self._verified:
+            return
+        headers = {"Authorization": token,
+                   "Content-Type": "application/json"}
+        try:
+            token_info = self.apis.token_info(headers=headers).json()
+        except Exception:
+            raise TokenError(self.api_key, self.secret, response)
+        token_roles = set([role.get('name')
+                           for role in token_info.get('roles', [{}])
+                           if role.get('name')])
+        missing_roles = self.required_roles.difference(token_roles)
+        if missing_roles:
+            raise TokenError(self.api_key,
+                             self.secret,
+                             response,
+                             "Missing Roles: {}".format(missing_roles))
+
+    def _schedule(self):
+        """
+        Starts the timer that refreshes the token before it expires
+        """
+        if not self.background_refresh:
+            return
+        if self._timer is not None and self._timer_pid == os.getpid():
+            self._timer.cancel()
+        delay = self._expires - time.time() - self.refresh_margin
+        delay = max(delay, (self._expires - time.time()) / 2, 1)
+        self._timer = threading.Timer(delay, self._background_refresh)
+        self._timer.daemon = True
+        self._timer_pid = os.getpid()
+        self._timer.start()
+
+    def _background_refresh(self):
+        stale = self._token
+        try:
+            with self._lock:
+                if self._token == stale:
+                    self._refresh(stale=stale)
+        except Exception as err:
+            # the next get_token call will retry and raise the error
+            log.warning("Background token refresh failed: %s", err)
+
+    def cancel(self):
+        """
+        Stops the background refresh timer
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = None
@@ -4,6 +4,11 @@ from .trackingdb import (add_registration,
                          check_email,
                          print_table,
                          hash_email,
+                         email_hashes,
                          columns,
                          get_data,
+                         registration_counts,
+                         last_write,
+                         iter_registrations,
                          registration_by_month)
+from .emailfilter import EmailFilter
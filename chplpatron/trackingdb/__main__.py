@@ -0,0 +1,24 @@
+"""
+Merges legacy tracking databases into the tracking database. Interrupted
+imports continue where they stopped when run again.
+
+usage:
+    python -m chplpatron.trackingdb old-db.sqlite [old-db.sqlite ...]
+"""
+import argparse
+
+from .trackingdb import import_legacy, IMPORT_CHUNK
+
+
+def report(state, max_id):
+    print("{source}: id {last_id} of {max_id}, {imported} imported, "
+          "{skipped} skipped".format(max_id=max_id, **state))
+
+
+parser = argparse.ArgumentParser(
+    description="Imports the registrations of legacy tracking databases")
+parser.add_argument("old_db_paths", nargs="+")
+parser.add_argument("--chunk", type=int, default=IMPORT_CHUNK)
+args = parser.parse_args()
+for old_db_path in args.old_db_paths:
+    import_legacy(old_db_path, chunk=args.chunk, progress=report)
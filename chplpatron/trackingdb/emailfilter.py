@@ -0,0 +1,146 @@
+"""
+Local filter of the registered emails answering 'definitely not registered'
+without asking Sierra
+"""
+__author__ = "Jeremy Nelson, Mike Stabile"
+
+import logging
+import re
+import threading
+import time
+
+from chplpatron.utilities.baseutilities import hash_email
+from chplpatron.utilities.bloom import BloomFilter
+
+from . import trackingdb
+
+log = logging.getLogger(__name__)
+
+DIGEST_RE = re.compile(r'^[0-9a-f]{128}$')
+
+
+class EmailFilter:
+    """
+    Bloom filter of the hashed emails of the tracking database and of an
+    optional export of the Sierra patron emails. New registrations are
+    added incrementally by reading the rows after the last id seen; the
+    filter is rebuilt at twice the size once it is full.
+
+    Patrons registered at the desk are only in Sierra, so a negative answer
+    is only trustworthy when the Sierra export is supplied.
+
+    :param export_path: optional file with one email or sha512 hex digest
+                        of an email per line
+    :param capacity: initial number of emails the filter is sized for
+    :param error_rate: false positive rate at capacity
+    :param refresh_interval: seconds between reads of new registrations
+
+    :example:
+        email_filter = EmailFilter("/opt/chpl/sierra-emails.txt")
+        email_filter.might_be_registered("new.patron@example.org")
+            False
+    """
+
+    def __init__(self,
+                 export_path=None,
+                 capacity=200000,
+                 error_rate=0.01,
+                 refresh_interval=30):
+        self.export_path = export_path
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._last_id = 0
+        self._refreshed = 0.0
+        # emails added by this process, kept across rebuilds as their
+        # tracking records may not have been written yet
+        self._added = set()
+        self.rebuilds = 0
+
+    def might_be_registered(self, email):
+        """
+        :param email: email address
+        :return: False if the email is definitely not registered, True if it
+                 may be
+        """
+        self.refresh()
+        return hash_email(email) in self._bloom
+
+    def add(self, email):
+        """
+        Adds an email registered by this process
+        """
+        self.refresh()
+        digest = hash_email(email)
+        with self._lock:
+            self._added.add(digest)
+            self._bloom.add(digest)
+
+    def refresh(self, force=False):
+        """
+        Adds the registrations made since the last refresh, building the
+        filter on first use. A rebuilt filter is only swapped in once it is
+        complete, so readers never see a partially filled filter.
+        """
+        now = time.monotonic()
+        if not force and self._bloom is not None \
+                and now - self._refreshed < self.refresh_interval:
+            return
+        with self._lock:
+            if not force and self._bloom is not None \
+                    and now - self._refreshed < self.refresh_interval:
+                return
+            if self._bloom is None:
+                bloom, last_id = self._build()
+            else:
+                # adding bits to the live filter is safe for readers
+                bloom = self._bloom
+                last_id = self._add_rows(
+                    bloom, trackingdb.email_hashes(self._last_id),
+                    self._last_id)
+            if len(bloom) > bloom.capacity:
+                self.capacity = len(bloom) * 2
+                bloom, last_id = self._build()
+            self._bloom = bloom
+            self._last_id = last_id
+            self._refreshed = now
+
+    def stats(self):
+        """
+        :return: dict of the bloom filter statistics
+        """
+        self.refresh()
+        rtn = self._bloom.stats()
+        rtn.update({"last_id": self._last_id, "rebuilds": self.rebuilds})
+        return rtn
+
+    def _build(self):
+        """
+        :return: tuple of a new, filled BloomFilter and the last
+                 registration id added to it
+        """
+        start = time.perf_counter()
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        if self.export_path:
+            with open(self.export_path, "r") as export:
+                for line in export:
+                    value = line.strip().lower()
+                    if value:
+                        bloom.add(value if DIGEST_RE.match(value)
+                                  else hash_email(value))
+        last_id = self._add_rows(bloom, trackingdb.email_hashes())
+        for digest in self._added:
+            bloom.add(digest)
+        self.rebuilds += 1
+        log.info("Built email filter of %s emails in %.1f ms",
+                 len(bloom), (time.perf_counter() - start) * 1000)
+        return bloom, last_id
+
+    @staticmethod
+    def _add_rows(bloom, rows, last_id=0):
+        for row_id, digest in rows:
+            bloom.add(digest)
+            last_id = row_id
+        return last_id
@@ -0,0 +1,54 @@
+"""
+Streams the registrations of the tracking database as CSV or NDJSON
+"""
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+import csv
+import io
+import json
+
+from .trackingdb import columns, iter_registrations, EXPORT_BATCH
+
+# export formats and their mimetypes
+FORMATS = {"csv": "text/csv",
+           "ndjson": "application/x-ndjson"}
+
+
+def _csv_lines(rows, header):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _ndjson_lines(rows, header):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(dict(zip(header, row))) + "\n")
+        if len(chunk) == EXPORT_BATCH:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def stream(fmt="csv", **filters):
+    """
+    Exports the registrations a batch at a time
+
+    :param fmt: "csv" or "ndjson"
+    :param filters: start, end, after_id and limit as taken by
+                    trackingdb.iter_registrations
+    :return: generator of str chunks
+    """
+    if fmt not in FORMATS:
+        raise ValueError("format must be one of {}"
+                         .format(", ".join(FORMATS)))
+    lines = _csv_lines if fmt == "csv" else _ndjson_lines
+    return lines(iter_registrations(**filters), columns())
@@ -0,0 +1,141 @@
+"""
+Load test of the tracking database at production scale. Fills a scratch
+database with registrations and times the lookups made while registering
+before and after the indexes of schema version 3, and the monthly
+statistics with and without the rollup table.
+
+usage:
+    python -m chplpatron.trackingdb.loadtest [rows] [lookups]
+"""
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+from chplpatron.utilities.baseutilities import hash_email
+
+from . import trackingdb
+
+START_DATE = datetime.datetime(2015, 1, 1)
+
+
+def fill(rows, batch=50000):
+    """
+    Inserts rows registrations spread over five years
+
+    :param rows: number of registrations
+    :param batch: rows inserted per transaction
+    """
+    qry = ("INSERT INTO {} (date, patron_id, email, location, boundary) "
+           "VALUES (?,?,?,?,?);").format(trackingdb.REG_TBL)
+    for first in range(0, rows, batch):
+        with trackingdb.connection() as con:
+            con.executemany(qry, (
+                ((START_DATE + datetime.timedelta(minutes=i * 2.5))
+                 .strftime("%Y-%m-%d %H:%M:%S"),
+                 str(1000000 + i),
+                 hash_email("patron{}@example.org".format(i)),
+                 random.choice(("internal", "external")),
+                 random.choice((-1, 0, 1)))
+                for i in range(first, min(first + batch, rows))))
+
+
+def time_lookups(rows, lookups):
+    """
+    :return: dict of mean microseconds per email and card number lookup and
+             the query plan of the email lookup
+    """
+    sample = [random.randrange(rows) for _ in range(lookups)]
+    start = time.perf_counter()
+    for i in sample:
+        trackingdb.lookup_email("patron{}@example.org".format(i))
+    email = (time.perf_counter() - start) * 1e6 / lookups
+    start = time.perf_counter()
+    for i in sample:
+        trackingdb.lookup_card_number(str(1000000 + i))
+    card = (time.perf_counter() - start) * 1e6 / lookups
+    with trackingdb.connection() as con:
+        plan = con.execute("EXPLAIN QUERY PLAN SELECT * FROM {} "
+                           "WHERE email=?;".format(trackingdb.REG_TBL),
+                           ("x",)).fetchall()
+    return {"email_us": email, "card_us": card, "plan": plan[0][-1]}
+
+
+def time_statistics():
+    """
+    :return: dict of milliseconds taken by the registrations per month
+             counted from the registrations and from the rollup table
+    """
+    start = time.perf_counter()
+    with trackingdb.connection() as con:
+        scan = con.execute("SELECT strftime('%Y-%m', date), count(*) "
+                           "FROM {} GROUP BY 1;"
+                           .format(trackingdb.REG_TBL)).fetchall()
+    scan_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    rollup = trackingdb.registration_by_month()
+    rollup_ms = (time.perf_counter() - start) * 1000
+    assert scan == rollup
+    return {"scan_ms": scan_ms, "rollup_ms": rollup_ms}
+
+
+def run(rows=1000000, lookups=200, db_path=None):
+    """
+    Builds a version 2 database with rows registrations, times it, applies
+    the remaining migrations and times it again
+
+    :param rows: number of registrations
+    :param lookups: lookups of each kind timed
+    :param db_path: scratch database, defaults to a temporary file
+    :return: dict with the 'before' and 'after' timings and the seconds
+             taken by 'fill' and 'migrate' and the 'statistics' timings
+    """
+    tmp_dir = None
+    if db_path is None:
+        tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(tmp_dir, "tracking-load.sqlite")
+    saved = (trackingdb.DB_PATH, trackingdb.TRACKING_DB_SETUP)
+    try:
+        trackingdb.reset_connections()
+        trackingdb.DB_PATH = db_path
+        trackingdb.TRACKING_DB_SETUP = True
+        trackingdb.migrate(target=2)
+        start = time.perf_counter()
+        fill(rows)
+        results = {"rows": rows, "fill": time.perf_counter() - start}
+        results["before"] = time_lookups(rows, lookups)
+        start = time.perf_counter()
+        trackingdb.migrate()
+        results["migrate"] = time.perf_counter() - start
+        results["after"] = time_lookups(rows, lookups)
+        results["statistics"] = time_statistics()
+    finally:
+        trackingdb.reset_connections()
+        trackingdb.DB_PATH, trackingdb.TRACKING_DB_SETUP = saved
+        if tmp_dir:
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+            os.rmdir(tmp_dir)
+    return results
+
+
+def main(rows=1000000, lookups=200):
+    results = run(rows, lookups)
+    print("rows:    {}  filled in {:.1f}s, indexed in {:.1f}s"
+          .format(rows, results["fill"], results["migrate"]))
+    for label in ("before", "after"):
+        timing = results[label]
+        print("{:7}  email {:10.1f} us  card {:8.1f} us  {}"
+              .format(label + ":", timing["email_us"], timing["card_us"],
+                      timing["plan"]))
+    print("months:  scan {:.1f} ms  rollup {:.1f} ms"
+          .format(results["statistics"]["scan_ms"],
+                  results["statistics"]["rollup_ms"]))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -3,9 +3,13 @@ Simple postal_code lookup implementation
 """
 __author__ = "Jeremy Nelson, Mike Stabile"
 
+import datetime
 import os
 import sqlite3
+import threading
+import weakref
 
+from contextlib import contextmanager
 
 from chplpatron.exceptions import RegisteredEmailError
 from chplpatron.utilities.baseutilities import hash_email
@@ -16,6 +20,260 @@ TRACKING_DB_SETUP = None
 CURRENT_DIR = os.path.dirname(__file__)
 DB_PATH = ""
 REG_TBL = "LibraryCardRequest"
+ROLLUP_TBL = "RegistrationRollup"
+# length of the rollup day prefix for each granularity
+GRANULARITIES = {"day": 10, "month": 7, "year": 4}
+# rows read from the database at a time by iter_registrations
+EXPORT_BATCH = 1000
+IMPORT_TBL = "ImportProgress"
+# legacy rows, by id range, copied per transaction by import_legacy
+IMPORT_CHUNK = 50000
+# milliseconds a connection waits for another process' write lock
+BUSY_TIMEOUT = 30000
+CACHED_STATEMENTS = 256
+
+_LOCAL = threading.local()
+# holders of the open connections, dropped as their threads exit
+_CONNECTIONS = weakref.WeakSet()
+_POOL_LOCK = threading.Lock()
+_GENERATION = 0
+
+
+def _connect():
+    con = sqlite3.connect(DB_PATH,
+                          timeout=BUSY_TIMEOUT / 1000,
+                          cached_statements=CACHED_STATEMENTS,
+                          check_same_thread=False)
+    con.execute("PRAGMA journal_mode=WAL;")
+    con.execute("PRAGMA synchronous=NORMAL;")
+    con.execute("PRAGMA busy_timeout={};".format(BUSY_TIMEOUT))
+    return con
+
+
+def _close(con, pid):
+    # a forked child leaves the connections it inherited to its parent
+    if os.getpid() == pid:
+        con.close()
+
+
+class _Holder:
+    """
+    Owns a thread's connection. The holder lives in the thread-local and is
+    collected when its thread exits, which closes the connection.
+    """
+    def __init__(self, con):
+        self.con = con
+        self.pid = os.getpid()
+        self.close = weakref.finalize(self, _close, con, self.pid)
+
+
+def get_connection():
+    """
+    Returns the connection of the current thread, opening it on first use.
+    Connections are kept open between calls so the statement cache is
+    reused, are closed when their thread exits, and are re-opened after a
+    fork or a call to reset_connections.
+
+    :return: sqlite3.Connection
+    """
+    key = (os.getpid(), _GENERATION, DB_PATH)
+    if getattr(_LOCAL, "key", None) != key:
+        holder = _Holder(_connect())
+        with _POOL_LOCK:
+            _CONNECTIONS.add(holder)
+        _LOCAL.holder = holder
+        _LOCAL.key = key
+    return _LOCAL.holder.con
+
+
+@contextmanager
+def connection():
+    """
+    context manager yielding the thread's connection. The transaction is
+    committed when the block completes and rolled back on an exception.
+
+    :example:
+        with connection() as con:
+            con.execute("SELECT ...")
+    """
+    con = get_connection()
+    try:
+        yield con
+    except BaseException:
+        con.rollback()
+        raise
+    con.commit()
+
+
+def reset_connections():
+    """
+    Closes every connection opened by this process, i.e. before the
+    database file is replaced
+    """
+    global _GENERATION
+    pid = os.getpid()
+    with _POOL_LOCK:
+        _GENERATION += 1
+        for holder in list(_CONNECTIONS):
+            if holder.pid == pid:
+                holder.close()
+        _CONNECTIONS.clear()
+
+
+VERSION_TBL = "SchemaVersion"
+# keeps the rollup counts of a registration's day, location and boundary
+_ROLLUP_ADD = ("INSERT OR IGNORE INTO {rollup} (day, location, boundary) "
+               "VALUES (coalesce(date(NEW.date), 'unknown'), NEW.location, "
+               "NEW.boundary); "
+               "UPDATE {rollup} SET count = count + 1 "
+               "WHERE day = coalesce(date(NEW.date), 'unknown') "
+               "AND location = NEW.location AND boundary = NEW.boundary; "
+               .format(rollup=ROLLUP_TBL))
+_ROLLUP_REMOVE = ("UPDATE {rollup} SET count = count - 1 "
+                  "WHERE day = coalesce(date(OLD.date), 'unknown') "
+                  "AND location = OLD.location AND boundary = OLD.boundary; "
+                  .format(rollup=ROLLUP_TBL))
+# schema migrations applied in order, each is a list of sql statements or
+# the name of a sql file in this directory
+MIGRATIONS = [
+    (1, "create {}".format(REG_TBL),
+     ["CREATE TABLE IF NOT EXISTS {} "
+      "("
+      "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,"
+      "date DATETIME DEFAULT CURRENT_TIMESTAMP,"
+      "date_retrieved DATETIME,"
+      "patron_id VARCHAR NOT NULL UNIQUE,"
+      "email VARCHAR NOT NULL UNIQUE,"
+      "location VARCHAR NOT NULL DEFAULT 'unknown',"
+      "boundary INTEGER NOT NULL DEFAULT -1"
+      ");".format(REG_TBL)]),
+    (2, "remove the unique email constraint",
+     "db-remove-unique-email-constraint.sql"),
+    # patron_id keeps the index of its UNIQUE constraint
+    (3, "index email and date",
+     ["CREATE INDEX IF NOT EXISTS {tbl}_email ON {tbl} (email);"
+      .format(tbl=REG_TBL),
+      "CREATE INDEX IF NOT EXISTS {tbl}_date ON {tbl} (date);"
+      .format(tbl=REG_TBL)]),
+    (4, "registration rollup",
+     ["CREATE TABLE IF NOT EXISTS {} ("
+      "day VARCHAR NOT NULL,"
+      "location VARCHAR NOT NULL,"
+      "boundary INTEGER NOT NULL,"
+      "count INTEGER NOT NULL DEFAULT 0,"
+      "PRIMARY KEY (day, location, boundary)"
+      ") WITHOUT ROWID;".format(ROLLUP_TBL),
+      "INSERT OR REPLACE INTO {rollup} (day, location, boundary, count) "
+      "SELECT coalesce(date(date), 'unknown'), location, boundary, count(*) "
+      "FROM {tbl} GROUP BY 1, 2, 3;".format(rollup=ROLLUP_TBL, tbl=REG_TBL),
+      "CREATE TRIGGER IF NOT EXISTS {tbl}_rollup_insert AFTER INSERT ON {tbl} "
+      "BEGIN {add}END;".format(tbl=REG_TBL, add=_ROLLUP_ADD),
+      "CREATE TRIGGER IF NOT EXISTS {tbl}_rollup_delete AFTER DELETE ON {tbl} "
+      "BEGIN {remove}END;".format(tbl=REG_TBL, remove=_ROLLUP_REMOVE),
+      "CREATE TRIGGER IF NOT EXISTS {tbl}_rollup_update "
+      "AFTER UPDATE OF date, location, boundary ON {tbl} "
+      "BEGIN {remove}{add}END;".format(tbl=REG_TBL,
+                                       add=_ROLLUP_ADD,
+                                       remove=_ROLLUP_REMOVE)]),
+    (5, "legacy import progress",
+     ["CREATE TABLE IF NOT EXISTS {} ("
+      "source VARCHAR PRIMARY KEY NOT NULL,"
+      "last_id INTEGER NOT NULL DEFAULT 0,"
+      "imported INTEGER NOT NULL DEFAULT 0,"
+      "skipped INTEGER NOT NULL DEFAULT 0,"
+      "started DATETIME DEFAULT CURRENT_TIMESTAMP,"
+      "updated DATETIME DEFAULT CURRENT_TIMESTAMP"
+      ");".format(IMPORT_TBL)]),
+]
+
+
+def _statements(script):
+    """
+    splits a sql script into its statements
+    """
+    statements = []
+    current = ""
+    for line in script.splitlines(True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ""
+    if current.strip():
+        statements.append(current.strip())
+    return statements
+
+
+def _table_exists(con, name):
+    return con.execute("SELECT name FROM sqlite_master "
+                       "WHERE type='table' AND name=?;",
+                       (name,)).fetchone() is not None
+
+
+def schema_version(con):
+    """
+    Returns the schema version of the tracking database. Databases created
+    before versions were recorded are recognized by their tables.
+
+    :param con: connection to the tracking database
+    :return: int version, 0 for an empty database
+    """
+    if _table_exists(con, VERSION_TBL):
+        return con.execute("SELECT max(version) FROM {};"
+                           .format(VERSION_TBL)).fetchone()[0] or 0
+    if _table_exists(con, "old_{}".format(REG_TBL)):
+        return 2
+    if _table_exists(con, REG_TBL):
+        return 1
+    return 0
+
+
+def migrate(target=None):
+    """
+    Applies the pending MIGRATIONS, each in its own transaction, and records
+    them in the SchemaVersion table
+
+    :param target: optional version to stop at, defaults to the latest
+    :return: the schema version
+    """
+    con = get_connection()
+    version = 0
+    for number, description, statements in MIGRATIONS:
+        if target is not None and number > target:
+            break
+        con.execute("BEGIN IMMEDIATE;")
+        try:
+            # another process may have migrated while this one waited
+            version = schema_version(con)
+            if number <= version:
+                con.rollback()
+                continue
+            if isinstance(statements, str):
+                with open(os.path.join(CURRENT_DIR, statements)) as script:
+                    statements = _statements(script.read()
+                                             .format(reg_table=REG_TBL))
+            con.execute("CREATE TABLE IF NOT EXISTS {} ("
+                        "version INTEGER PRIMARY KEY NOT NULL,"
+                        "description VARCHAR,"
+                        "applied DATETIME DEFAULT CURRENT_TIMESTAMP"
+                        ");".format(VERSION_TBL))
+            # record the versions of a database that predates the table
+            for previous, previous_desc, _ in MIGRATIONS:
+                if previous <= version:
+                    con.execute("INSERT OR IGNORE INTO {} "
+                                "(version, description) VALUES (?,?);"
+                                .format(VERSION_TBL),
+                                (previous, previous_desc))
+            for stmt in statements:
+                con.execute(stmt)
+            con.execute("INSERT INTO {} (version, description) "
+                        "VALUES (?,?);".format(VERSION_TBL),
+                        (number, description))
+            con.commit()
+            version = number
+        except BaseException:
+            con.rollback()
+            raise
+    return version
 
 
 def setup(func):
@@ -28,35 +286,9 @@ def setup(func):
     global DB_PATH
     if TRACKING_DB_SETUP:
         return func
+    reset_connections()
     DB_PATH = str(os.path.join(CURRENT_DIR, DB_NAME))
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-
-    # Create table
-    cur.execute("CREATE TABLE IF NOT EXISTS  {} "
-                "("
-                "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,"
-                "date DATETIME DEFAULT CURRENT_TIMESTAMP," 
-                "date_retrieved DATETIME,"
-                "patron_id VARCHAR NOT NULL UNIQUE,"
-                "email VARCHAR NOT NULL UNIQUE,"
-                "location VARCHAR NOT NULL DEFAULT 'unknown',"
-                "boundary INTEGER NOT NULL DEFAULT -1"
-                ");".format(REG_TBL))
-    con.commit()
-    cur.close()
-    con.close()
-    
-    # update the database schema if needed to remove the unique email constraint
-    db_updated_query = "SELECT name FROM sqlite_master " \
-                       "WHERE type='table' AND name='old_{reg_table}';".format(reg_table=REG_TBL)
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    updated_1 = len(cur.execute(db_updated_query).fetchall()) > 0
-    cur.close()
-    con.close()
-    if not updated_1:
-        run_sql(os.path.join(CURRENT_DIR, "db-remove-unique-email-constraint.sql"))
+    migrate()
     TRACKING_DB_SETUP = True
     return func
 
@@ -66,13 +298,10 @@ def run_sql(filename):
 
     :param filename: the name of the sql file to run
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
     with open(os.path.join(CURRENT_DIR, filename)) as script_fo:
         script = script_fo.read().format(reg_table=REG_TBL)
-        cur.executescript(script)
-    cur.close()
-    con.close()
+    with connection() as con:
+        con.executescript(script)
 
 
 @setup
@@ -86,27 +315,20 @@ def add_registration(patron_id, email, location="unknown", boundary=-1):
     :param boundary: -1 = unknown, 1 = within, 0 = not within
     :return:
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
     qry = ("INSERT INTO {} "
-           "(email, patron_id, location, boundary) " 
+           "(email, patron_id, location, boundary) "
            "VALUES (?,?,?,?);").format(REG_TBL)
 
+    if boundary is None:
+        boundary = -1
     try:
-        if boundary is None:
-            boundary = -1
-        cur.execute(qry, (hash_email(email),
-                          patron_id,
-                          location,
-                          int(boundary),))
-        con.commit()
+        with connection() as con:
+            con.execute(qry, (hash_email(email),
+                              patron_id,
+                              location,
+                              int(boundary),))
     except sqlite3.IntegrityError:
-        # pass
-        cur.close()
-        con.close()
         raise RegisteredEmailError(email)
-    cur.close()
-    con.close()
     return True
 
 
@@ -117,16 +339,11 @@ def lookup_email(email):
     :param email:
     :return: row of data
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
     qry = ("SELECT * "
            "FROM {tbl} "
            "WHERE email=?;").format(tbl=REG_TBL)
-    cur.execute(qry, (hash_email(email),))
-    data = cur.fetchone()
-    cur.close()
-    con.close()
-    return data
+    with connection() as con:
+        return con.execute(qry, (hash_email(email),)).fetchone()
 
 
 @setup
@@ -149,16 +366,11 @@ def lookup_card_number(card_number):
     :param card_number:
     :return:
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT * "
-                "FROM {tbl} "
-                "WHERE patron_id=?".format(tbl=REG_TBL),
-                (card_number,))
-    data = cur.fetchone()
-    cur.close()
-    con.close()
-    return data
+    with connection() as con:
+        return con.execute("SELECT * "
+                           "FROM {tbl} "
+                           "WHERE patron_id=?".format(tbl=REG_TBL),
+                           (card_number,)).fetchone()
 
 
 @setup
@@ -170,38 +382,109 @@ def print_table(table):
     """
     print("Data for table '{}'".format(table))
     print("----------------------------------------------------")
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT * FROM {}".format(table))
-    print([description[0] for description in cur.description])
-    rows = cur.fetchall()
-    for row in rows:
-        print(row)
-    cur.close()
-    con.close()
+    with connection() as con:
+        cur = con.execute("SELECT * FROM {}".format(table))
+        print([description[0] for description in cur.description])
+        for row in cur.fetchall():
+            print(row)
+
+
+@setup
+def import_legacy(old_db_path, chunk=IMPORT_CHUNK, progress=None):
+    """
+    Merges the registrations of another tracking database. The database is
+    attached and copied with INSERT ... SELECT one id range at a time;
+    registrations whose patron_id is already present are skipped. The last
+    id copied is recorded with each chunk in the ImportProgress table, so an
+    interrupted import, or a later one picking up new registrations,
+    continues where the previous one stopped.
+
+    :param old_db_path: file path to database
+    :param chunk: number of ids copied per transaction
+    :param progress: optional function called after each chunk with the
+                     ImportProgress row as a dict and the last id to import
+    :return: dict of the ImportProgress row of the database
+    """
+    source = os.path.realpath(old_db_path)
+    if not os.path.exists(source):
+        raise FileNotFoundError(source)
+    # ATTACH is not allowed inside a transaction, so the import uses its
+    # own connection
+    con = _connect()
+    try:
+        con.execute("ATTACH DATABASE ? AS legacy;", (source,))
+        old_columns = {row[1] for row in con.execute(
+            "PRAGMA legacy.table_info({});".format(REG_TBL))}
+        cols = ", ".join(col for col in ("date", "date_retrieved",
+                                         "patron_id", "email",
+                                         "location", "boundary")
+                         if col in old_columns)
+        if sqlite3.sqlite_version_info >= (3, 24, 0):
+            # the WHERE clause of the SELECT avoids the parsing ambiguity
+            # between a join constraint and the upsert clause
+            qry = ("INSERT INTO main.{tbl} ({cols}) SELECT {cols} "
+                   "FROM legacy.{tbl} WHERE id > ? AND id <= ? "
+                   "ON CONFLICT(patron_id) DO NOTHING;")
+        else:
+            qry = ("INSERT OR IGNORE INTO main.{tbl} ({cols}) SELECT {cols} "
+                   "FROM legacy.{tbl} WHERE id > ? AND id <= ?;")
+        qry = qry.format(tbl=REG_TBL, cols=cols)
+        max_id = con.execute("SELECT max(id) FROM legacy.{};"
+                             .format(REG_TBL)).fetchone()[0] or 0
+        with con:
+            con.execute("INSERT OR IGNORE INTO {} (source) VALUES (?);"
+                        .format(IMPORT_TBL), (source,))
+        row_qry = ("SELECT source, last_id, imported, skipped, started, "
+                   "updated FROM {} WHERE source=?;".format(IMPORT_TBL))
+        keys = ["source", "last_id", "imported", "skipped", "started",
+                "updated"]
+        state = dict(zip(keys, con.execute(row_qry, (source,)).fetchone()))
+        while state["last_id"] < max_id:
+            upper = min(state["last_id"] + chunk, max_id)
+            with con:
+                rows = con.execute("SELECT count(*) FROM legacy.{} "
+                                   "WHERE id > ? AND id <= ?;"
+                                   .format(REG_TBL),
+                                   (state["last_id"], upper)).fetchone()[0]
+                imported = con.execute(qry, (state["last_id"],
+                                             upper)).rowcount
+                con.execute("UPDATE {} SET last_id=?, "
+                            "imported=imported + ?, skipped=skipped + ?, "
+                            "updated=CURRENT_TIMESTAMP WHERE source=?;"
+                            .format(IMPORT_TBL),
+                            (upper, imported, rows - imported, source))
+            state = dict(zip(keys, con.execute(row_qry,
+                                               (source,)).fetchone()))
+            if progress:
+                progress(state, max_id)
+        return state
+    finally:
+        con.close()
 
 
 def load_old_data(old_db_path):
     """
     loads data from old database into new database
     :param old_db_path: file path to database
-    :return:
+    :return: dict of the import progress
     """
-    old_con = sqlite3.connect(old_db_path)
-    con = sqlite3.connect(DB_PATH)
-    old_cur = old_con.cursor()
-    old_cur.execute("SELECT * FROM LibraryCardRequest;")
-    old_data = old_cur.fetchall()
-    old_data = [tuple(i for i in item[1:]) for item in old_data]
-    # pprint.pprint(old_data[:10])
-    qry = ("INSERT INTO {} "
-           "(date, date_retrieved, patron_id, email) "
-           "VALUES (?,?,?,?);").format(REG_TBL)
-    cur = con.cursor()
-    cur.executemany(qry, old_data)
-    con.commit()
-    cur.close()
-    con.close()
+    return import_legacy(old_db_path)
+
+
+@setup
+def email_hashes(after_id=0):
+    """
+    lists the hashed emails of the registrations added after an id, used to
+    update the email filter incrementally
+
+    :param after_id: last id already read
+    :return: list of (id, hashed email) tuples ordered by id
+    """
+    with connection() as con:
+        return con.execute("SELECT id, email "
+                           "FROM {tbl} "
+                           "WHERE id > ? ORDER BY id".format(tbl=REG_TBL),
+                           (after_id,)).fetchall()
 
 
 def columns():
@@ -209,15 +492,11 @@ def columns():
     list column names
     :return list: of column names
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT * "
-                "FROM {tbl} "
-                "LIMIT 1".format(tbl=REG_TBL))
-    names = [description[0] for description in cur.description]
-    cur.close()
-    con.close()
-    return names
+    with connection() as con:
+        cur = con.execute("SELECT * "
+                          "FROM {tbl} "
+                          "LIMIT 1".format(tbl=REG_TBL))
+        return [description[0] for description in cur.description]
 
 
 def get_data():
@@ -225,29 +504,120 @@ def get_data():
     list column names
     :return list: of column names
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT * "
-                "FROM {tbl} ".format(tbl=REG_TBL))
-    data = cur.fetchall()
-    cur.close()
-    con.close()
-    return data
+    with connection() as con:
+        return con.execute("SELECT * "
+                           "FROM {tbl} ".format(tbl=REG_TBL)).fetchall()
+
+
+@setup
+def last_write():
+    """
+    Identifies the latest registration, registrations are only ever added
+
+    :return: tuple of the id and the UTC datetime of the latest
+             registration, (0, None) for an empty database
+    """
+    with connection() as con:
+        row = con.execute("SELECT id, date FROM {} "
+                          "ORDER BY id DESC LIMIT 1;"
+                          .format(REG_TBL)).fetchone()
+    if row is None:
+        return 0, None
+    try:
+        date = datetime.datetime.strptime(row[1], "%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        return row[0], None
+    return row[0], date.replace(tzinfo=datetime.timezone.utc)
+
+
+@setup
+def registration_counts(granularity="month", start=None, end=None, by=()):
+    """
+    Counts registrations from the rollup table, which holds one row per day,
+    location and boundary, so the cost does not grow with the number of
+    registrations
+
+    :param granularity: "day", "month" or "year"
+    :param start: optional first day, 'YYYY-MM-DD' or a date
+    :param end: optional last day included, 'YYYY-MM-DD' or a date
+    :param by: optional columns to break the counts down by, any of
+               "location" and "boundary"
+    :return: list of tuples (period, [location, boundary,] count) ordered by
+             period
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError("granularity must be one of {}"
+                         .format(", ".join(GRANULARITIES)))
+    by = list(by)
+    if set(by).difference({"location", "boundary"}):
+        raise ValueError("counts can only be broken down by location "
+                         "and boundary")
+    columns = ", ".join(["substr(day, 1, {}) AS period"
+                         .format(GRANULARITIES[granularity])] + by)
+    where = ["day != 'unknown'", "count > 0"]
+    params = []
+    if start is not None:
+        where.append("day >= ?")
+        params.append(str(start))
+    if end is not None:
+        where.append("day <= ?")
+        params.append(str(end))
+    qry = ("SELECT {columns}, sum(count) FROM {rollup} "
+           "WHERE {where} GROUP BY {group} ORDER BY {group};"
+           .format(columns=columns,
+                   rollup=ROLLUP_TBL,
+                   where=" AND ".join(where),
+                   group=", ".join(["period"] + by)))
+    with connection() as con:
+        return con.execute(qry, params).fetchall()
+
+
+@setup
+def iter_registrations(start=None, end=None, after_id=0, limit=None,
+                       batch=EXPORT_BATCH):
+    """
+    Iterates over the registrations in id order reading batch rows at a
+    time, so exporting every registration uses constant memory. An export
+    that stopped is resumed by passing the id of the last row received as
+    after_id.
+
+    :param start: optional first day, 'YYYY-MM-DD'
+    :param end: optional last day included, 'YYYY-MM-DD'
+    :param after_id: only registrations with a greater id
+    :param limit: optional maximum number of rows
+    :param batch: rows fetched at a time
+    :return: generator of registration rows
+    """
+    where = ["id > ?"]
+    params = [int(after_id)]
+    if start is not None:
+        where.append("date >= ?")
+        params.append(str(start))
+    if end is not None:
+        where.append("date < date(?, '+1 day')")
+        params.append(str(end))
+    qry = "SELECT * FROM {tbl} WHERE {where} ORDER BY id".format(
+        tbl=REG_TBL, where=" AND ".join(where))
+    if limit is not None:
+        qry += " LIMIT ?"
+        params.append(int(limit))
+    cur = get_connection().cursor()
+    try:
+        cur.execute(qry + ";", params)
+        rows = cur.fetchmany(batch)
+        while rows:
+            for row in rows:
+                yield row
+            rows = cur.fetchmany(batch)
+    finally:
+        cur.close()
 
 
 def registration_by_month():
     """
     :return: a list of number of registrations for month and year
     """
-    con = sqlite3.connect(DB_PATH)
-    cur = con.cursor()
-    cur.execute("SELECT time, count(time) "
-                "FROM (SELECT strftime('%Y-%m', date) as time "
-                "FROM {tbl}) GROUP BY time;".format(tbl=REG_TBL))
-    data = cur.fetchall()
-    cur.close()
-    con.close()
-    return data
+    return registration_counts("month")
 
 
 if __name__ == '__main__':
@@ -1 +1,2 @@
-from .baseutilities import *
\ No newline at end of file
+from .baseutilities import *
+from .sessions import PooledSession
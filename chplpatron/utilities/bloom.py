@@ -0,0 +1,72 @@
+"""
+bloom.py
+
+Compact set membership filter answering 'definitely not present' without
+storing the members
+
+"""
+import math
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+
+class BloomFilter:
+    """
+    Bloom filter over hex digests, i.e. the output of hash_email. The bit
+    positions are derived from the digest itself by double hashing, so no
+    additional hashing is done.
+
+    :param capacity: number of members the filter is sized for
+    :param error_rate: false positive rate at capacity
+
+    :example:
+        bloom = BloomFilter(capacity=100000, error_rate=0.01)
+        bloom.add(hash_email("patron@example.org"))
+        hash_email("patron@example.org") in bloom
+            True
+    """
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(int(-capacity * math.log(error_rate)
+                                / math.log(2) ** 2), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity
+                                        * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        first = int(digest[:16], 16)
+        second = int(digest[16:32], 16) | 1
+        for i in range(self.num_hashes):
+            yield (first + i * second) % self.num_bits
+
+    def add(self, digest):
+        """
+        :param digest: hex digest of at least 32 characters
+        """
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(digest))
+
+    def __len__(self):
+        return self.count
+
+    def stats(self):
+        """
+        :return: dict of the filter size, members added and the expected
+                 false positive rate at the current count
+        """
+        return {"bytes": len(self.bits),
+                "hashes": self.num_hashes,
+                "count": self.count,
+                "capacity": self.capacity,
+                "error_rate": round((1 - math.exp(-self.num_hashes
+                                                  * self.count
+                                                  / self.num_bits))
+                                    ** self.num_hashes, 5)}
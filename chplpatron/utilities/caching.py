@@ -0,0 +1,297 @@
+"""
+caching.py
+
+In-process LRU caches with expiring entries, optionally backed by a sqlite
+table shared by all worker processes
+
+"""
+import copy
+import functools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+MISSING = object()
+# value stored for a key that is known to have no result
+NEGATIVE = {"__negative__": True}
+
+log = logging.getLogger(__name__)
+
+
+class SqliteCacheStore:
+    """
+    Shared cache store saving json values in a sqlite table so every gunicorn
+    worker can use a value looked up by any other.
+
+    :param db_path: file path of the sqlite database
+    :param namespace: name separating the keys of different caches
+    """
+    tbl = "Cache"
+
+    def __init__(self, db_path, namespace):
+        self.db_path = db_path
+        self.namespace = namespace
+        self._local = threading.local()
+
+    def _connect(self):
+        """
+        :return: the connection of the current thread, opened on first use
+                 and re-opened after a fork as sqlite connections must not
+                 be used across processes
+        """
+        pid = os.getpid()
+        if getattr(self._local, "pid", None) != pid:
+            con = sqlite3.connect(self.db_path,
+                                  timeout=10,
+                                  isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL;")
+            con.execute("CREATE TABLE IF NOT EXISTS {} ("
+                        "namespace VARCHAR NOT NULL, "
+                        "key VARCHAR NOT NULL, "
+                        "value TEXT NOT NULL, "
+                        "expires REAL NOT NULL, "
+                        "PRIMARY KEY (namespace, key)"
+                        ");".format(self.tbl))
+            self._local.con = con
+            self._local.pid = pid
+        return self._local.con
+
+    def get(self, key):
+        """
+        :return: tuple (value, expires) or MISSING if absent or expired
+        """
+        row = self._connect().execute("SELECT value, expires FROM {} "
+                                      "WHERE namespace=? AND key=?;"
+                                      .format(self.tbl),
+                                      (self.namespace, key)).fetchone()
+        if row is None or row[1] < time.time():
+            return MISSING
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, expires):
+        """
+        :param key: cache key
+        :param value: json serializable value
+        :param expires: epoch time the value expires
+        """
+        self._connect().execute("INSERT OR REPLACE INTO {} "
+                                "(namespace, key, value, expires) "
+                                "VALUES (?,?,?,?);".format(self.tbl),
+                                (self.namespace, key, json.dumps(value),
+                                 expires))
+
+    def delete(self, key):
+        self._connect().execute("DELETE FROM {} "
+                                "WHERE namespace=? AND key=?;"
+                                .format(self.tbl),
+                                (self.namespace, key))
+
+    def purge(self):
+        """
+        Removes the expired values of the namespace
+
+        :return: number of values removed
+        """
+        return self._connect().execute("DELETE FROM {} "
+                                       "WHERE namespace=? AND expires<?;"
+                                       .format(self.tbl),
+                                       (self.namespace, time.time())).rowcount
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire after a time to live. A key
+    with no result, i.e. an invalid postal code, can be cached with its own,
+    usually shorter, negative ttl. When a store is supplied values missing
+    from memory are read from and written to it. A failing store, i.e. a
+    locked database or a full disk, is logged and treated as a miss.
+
+    :param maxsize: maximum number of entries kept in memory
+    :param ttl: seconds a value is kept
+    :param negative_ttl: seconds a negative result is kept
+    :param store: optional SqliteCacheStore shared between processes
+
+    :example:
+        cache = TTLCache(maxsize=1024, ttl=3600)
+        cache.set("27514", [...])
+        cache.get("27514")
+        cache.stats()
+            {'hits': 1, 'misses': 0, 'negative_hits': 0, ...}
+    """
+
+    def __init__(self, maxsize=1024, ttl=3600, negative_ttl=600, store=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.store = store
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.store_hits = 0
+        self.store_errors = 0
+
+    def get(self, key, default=MISSING):
+        """
+        :return: the cached value, NEGATIVE for a cached negative result or
+                 default when the key is not cached
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                if entry[1] >= time.time():
+                    self._data.move_to_end(key)
+                    self._count_hit(entry[0])
+                    return entry[0]
+                del self._data[key]
+        if self.store is not None:
+            stored = self._store_call("get", key)
+            if stored not in (None, MISSING):
+                value, expires = stored
+                with self._lock:
+                    self.store_hits += 1
+                    self._count_hit(value)
+                    # the entry expires when the stored value does
+                    self._put(key, value, expires - time.time())
+                return value
+        with self._lock:
+            self.misses += 1
+        return default
+
+    def set(self, key, value, ttl=None):
+        """
+        Caches the value for the key
+
+        :param ttl: optional seconds overriding the cache ttl
+        """
+        ttl = self._ttl_for(value) if ttl is None else ttl
+        with self._lock:
+            self._put(key, value, ttl)
+        if self.store is not None:
+            self._store_call("set", key, value, time.time() + ttl)
+
+    def set_negative(self, key):
+        """
+        Caches that the key has no result
+        """
+        self.set(key, NEGATIVE)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+        if self.store is not None:
+            self._store_call("delete", key)
+
+    def clear(self):
+        """
+        Empties the in memory cache and resets the statistics
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.negative_hits = 0
+            self.store_hits = self.store_errors = 0
+
+    def purge(self):
+        """
+        Removes the expired entries from memory and from the store
+
+        :return: number of entries removed from the store
+        """
+        now = time.time()
+        with self._lock:
+            for key in [key for key, entry in self._data.items()
+                        if entry[1] < now]:
+                del self._data[key]
+        if self.store is not None:
+            return self.store.purge()
+        return 0
+
+    def stats(self):
+        """
+        :return: dict of hit and miss counters and the number of entries
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "negative_hits": self.negative_hits,
+                    "store_hits": self.store_hits,
+                    "store_errors": self.store_errors,
+                    "hit_rate": round(self.hits / lookups, 3)
+                    if lookups else 0.0,
+                    "size": len(self._data),
+                    "maxsize": self.maxsize}
+
+    def _store_call(self, method, *args):
+        """
+        Calls the store method, failing open on a sqlite error
+
+        :return: the result of the call or None when it failed
+        """
+        try:
+            return getattr(self.store, method)(*args)
+        except sqlite3.Error as err:
+            with self._lock:
+                self.store_errors += 1
+            log.warning("Cache store %s failed: %s", method, err)
+            return None
+
+    def _ttl_for(self, value):
+        return self.negative_ttl if value == NEGATIVE else self.ttl
+
+    def _count_hit(self, value):
+        self.hits += 1
+        if value == NEGATIVE:
+            self.negative_hits += 1
+
+    def _put(self, key, value, ttl):
+        self._data[key] = (value, time.time() + ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+
+def cached(cache, negative=None, key=None):
+    """
+    decorator caching the results of a function of hashable arguments. A
+    copy of the cached value is returned so callers may modify it.
+
+    :param cache: the TTLCache to use
+    :param negative: exception class meaning 'no result'. It is cached as a
+                     negative result and raised again, with the call
+                     arguments, on a hit
+    :param key: optional function building the cache key from the call
+                arguments, defaults to the first argument as a string
+    """
+    def make_key(*args, **kwargs):
+        return str(args[0]) if args else json.dumps(kwargs, sort_keys=True)
+
+    key_func = key or make_key
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key_func(*args, **kwargs)
+            value = cache.get(cache_key)
+            if value is MISSING:
+                try:
+                    value = func(*args, **kwargs)
+                except Exception as err:
+                    if negative is not None and isinstance(err, negative):
+                        cache.set_negative(cache_key)
+                    raise
+                cache.set(cache_key, value)
+            elif value == NEGATIVE:
+                raise negative(*args, **kwargs)
+            return copy.deepcopy(value)
+        wrapper.cache = cache
+        return wrapper
+    return decorator
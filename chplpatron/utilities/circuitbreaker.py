@@ -0,0 +1,120 @@
+"""
+circuitbreaker.py
+
+Circuit breaker failing calls to a remote service fast while it is down
+
+"""
+import logging
+import threading
+import time
+
+from chplpatron.exceptions import CircuitOpenError
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of a remote service. After failure_threshold
+    failures the circuit opens and check() raises CircuitOpenError, so
+    callers can use their fallback right away. After reset_timeout seconds
+    one trial call is let through; its success closes the circuit, its
+    failure opens it again.
+
+    :param name: name of the service used in errors and logs
+    :param failure_threshold: consecutive failures opening the circuit
+    :param reset_timeout: seconds the circuit stays open
+
+    :example:
+        breaker = CircuitBreaker("arcgis", failure_threshold=5)
+        breaker.check()
+        try:
+            response = call()
+        except RequestException:
+            breaker.record_failure()
+            raise
+        breaker.record_success()
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial = False
+        self.failures = 0
+        self.trips = 0
+        self.rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == OPEN \
+                and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = HALF_OPEN
+            self._trial = False
+        return self._state
+
+    def check(self):
+        """
+        Raises CircuitOpenError unless a call may be made
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == CLOSED:
+                return
+            # a trial call that never reported back is replaced after
+            # another reset_timeout
+            if state == HALF_OPEN and (not self._trial or
+                                       time.monotonic() - self._opened_at
+                                       >= self.reset_timeout):
+                self._trial = True
+                self._opened_at = time.monotonic()
+                return
+            self.rejected += 1
+            retry_after = max(self.reset_timeout
+                              - (time.monotonic() - self._opened_at), 0)
+        raise CircuitOpenError(self.name, retry_after)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                log.info("Circuit '%s' closed", self.name)
+            self._state = CLOSED
+            self._trial = False
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            state = self._current_state()
+            if state == HALF_OPEN or (state == CLOSED and
+                                      self.failures >= self.failure_threshold):
+                self._state = OPEN
+                self._opened_at = time.monotonic()
+                self._trial = False
+                self.trips += 1
+                log.warning("Circuit '%s' opened after %s failures",
+                            self.name, self.failures)
+
+    def stats(self):
+        """
+        :return: dict with the state, consecutive failures, number of times
+                 the circuit opened and the calls rejected while open
+        """
+        with self._lock:
+            return {"state": self._current_state(),
+                    "failures": self.failures,
+                    "trips": self.trips,
+                    "rejected": self.rejected}
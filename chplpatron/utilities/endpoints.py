@@ -0,0 +1,173 @@
+"""
+endpoints.py
+
+Remote endpoints with their own timeout, circuit breaker, latency metrics
+and optional hedged requests
+
+"""
+import collections
+import threading
+import time
+
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import requests
+
+from .circuitbreaker import CircuitBreaker
+from .executors import shared_executor
+from .sessions import DEFAULT_TIMEOUT
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+
+class LatencyWindow:
+    """
+    Keeps the latencies of the most recent calls
+
+    :param size: number of latencies kept
+    """
+
+    def __init__(self, size=200):
+        self._values = collections.deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._values.append(seconds)
+
+    def __len__(self):
+        return len(self._values)
+
+    def percentile(self, quantile):
+        """
+        :param quantile: between 0 and 1, i.e. 0.95
+        :return: latency in seconds or None without any calls
+        """
+        with self._lock:
+            values = sorted(self._values)
+        if not values:
+            return None
+        return values[min(int(quantile * len(values)), len(values) - 1)]
+
+
+class Endpoint:
+    """
+    GET requests to one remote endpoint made through a PooledSession with a
+    per endpoint timeout. Connection errors, timeouts and 5xx responses are
+    counted by a circuit breaker; while it is open get() raises
+    CircuitOpenError without calling the endpoint. With hedging enabled a
+    second, identical request is sent when the first has not answered
+    within the endpoint's p95 latency and the first response is used.
+
+    :param name: endpoint name used in metrics and errors
+    :param session: the PooledSession
+    :param timeout: (connect, read) timeout in seconds
+    :param failure_threshold: consecutive failures opening the circuit
+    :param reset_timeout: seconds before a call is tried again
+    :param hedge: send hedged requests
+    :param hedge_quantile: latency quantile after which to hedge
+    :param min_samples: calls measured before hedging starts
+
+    :example:
+        endpoint = Endpoint("geocode", PooledSession(), timeout=(3.05, 5))
+        response = endpoint.get(url)
+        endpoint.metrics()
+            {'calls': 1, 'errors': 0, 'p95_ms': 212.4, 'hedges': 0, ...}
+    """
+
+    def __init__(self,
+                 name,
+                 session,
+                 timeout=DEFAULT_TIMEOUT,
+                 failure_threshold=5,
+                 reset_timeout=30,
+                 hedge=False,
+                 hedge_quantile=0.95,
+                 min_samples=20):
+        self.name = name
+        self.session = session
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_timeout)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.min_samples = min_samples
+        self.latency = LatencyWindow()
+        self.calls = 0
+        self.errors = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def get(self, url, **kwargs):
+        """
+        :param url: the full url
+        :param kwargs: keyword arguments passed on to requests
+        :return: requests.Response
+        """
+        self.breaker.check()
+        self.calls += 1
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        try:
+            delay = self.hedge_delay()
+            if delay is None:
+                response = self.session.get(url, **kwargs)
+            else:
+                response = self._hedged(url, delay, kwargs)
+        except requests.RequestException:
+            self.errors += 1
+            self.breaker.record_failure()
+            raise
+        self.latency.add(time.perf_counter() - start)
+        if response.status_code >= 500:
+            self.errors += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def hedge_delay(self):
+        """
+        :return: seconds to wait before hedging or None when not hedging
+        """
+        if not self.hedge or len(self.latency) < self.min_samples:
+            return None
+        return self.latency.percentile(self.hedge_quantile)
+
+    def _hedged(self, url, delay, kwargs):
+        executor = shared_executor("endpoints")
+        first = executor.submit(self.session.get, url, **kwargs)
+        if wait([first], timeout=delay).done:
+            return first.result()
+        self.hedges += 1
+        second = executor.submit(self.session.get, url, **kwargs)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is second:
+                        self.hedge_wins += 1
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    def metrics(self):
+        """
+        :return: dict of call counters, latency percentiles in milliseconds
+                 and the circuit breaker state
+        """
+        def millis(quantile):
+            value = self.latency.percentile(quantile)
+            return None if value is None else round(value * 1000, 1)
+
+        rtn = {"calls": self.calls,
+               "errors": self.errors,
+               "p50_ms": millis(0.5),
+               "p95_ms": millis(0.95),
+               "hedges": self.hedges,
+               "hedge_wins": self.hedge_wins,
+               "timeout": self.timeout}
+        rtn.update({"circuit_" + key: value
+                    for key, value in self.breaker.stats().items()})
+        return rtn
@@ -0,0 +1,48 @@
+"""
+executors.py
+
+Shared thread pools used to run blocking remote calls concurrently
+
+"""
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+_EXECUTORS = {}
+_LOCK = threading.Lock()
+
+
+def shared_executor(name="default", max_workers=8):
+    """
+    Returns the named ThreadPoolExecutor for the current process, creating
+    it on first use. Pools are keyed by process id so a gunicorn worker never
+    uses threads that belonged to the master process.
+
+    :param name: name of the pool, i.e. 'sierra', 'geosearch'
+    :param max_workers: maximum number of threads used on creation
+    :return: ThreadPoolExecutor
+    """
+    key = (name, os.getpid())
+    executor = _EXECUTORS.get(key)
+    if executor is None:
+        with _LOCK:
+            executor = _EXECUTORS.get(key)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                        max_workers=max_workers,
+                        thread_name_prefix="chpl-{}".format(name))
+                _EXECUTORS[key] = executor
+    return executor
+
+
+def shutdown_executors(wait=True):
+    """
+    Shuts down all of the pools created by the current process
+    """
+    pid = os.getpid()
+    with _LOCK:
+        for key in [key for key in _EXECUTORS if key[1] == pid]:
+            _EXECUTORS.pop(key).shutdown(wait=wait)
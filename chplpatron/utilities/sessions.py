@@ -0,0 +1,156 @@
+"""
+sessions.py
+
+Pooled, keep-alive http sessions shared by the remote api clients
+
+"""
+import os
+import threading
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+# (connect, read) timeout in seconds applied when a call does not supply one
+DEFAULT_TIMEOUT = (3.05, 30)
+# methods that are safe to retry after the request has been sent
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+RETRY_STATUSES = (502, 503, 504)
+
+
+def make_retry(retries, backoff_factor=0.3):
+    """
+    Creates the urllib3 retry policy for a pooled session. Connection errors
+    are retried for every method, read errors and retry statuses only for
+    idempotent methods so that a POST is never sent twice.
+
+    :param retries: number of retries
+    :param backoff_factor: urllib3 backoff factor between retries
+    :return: Retry instance
+    """
+    kwargs = {"total": retries,
+              "connect": retries,
+              "read": retries,
+              "status": retries,
+              "backoff_factor": backoff_factor,
+              "status_forcelist": RETRY_STATUSES,
+              "raise_on_status": False}
+    try:
+        return Retry(allowed_methods=IDEMPOTENT_METHODS, **kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=IDEMPOTENT_METHODS, **kwargs)
+
+
+class PooledSession:
+    """
+    Holds a requests.Session with a sized keep-alive connection pool so that
+    every call to the same host reuses an open TCP/TLS connection.
+
+    The session is created lazily and re-created after a fork so gunicorn
+    workers never share sockets with the master process. The underlying
+    urllib3 pools are thread-safe, so one instance can be shared by all
+    threads of a worker.
+
+    :param pool_size: maximum number of connections kept open per host
+    :param retries: number of retries for failed connections
+    :param timeout: default (connect, read) timeout for each request
+    :param backoff_factor: urllib3 backoff factor between retries
+
+    :example:
+        session = PooledSession(pool_size=4)
+        response = session.request("get", "https://example.org")
+        session.stats()
+            {'requests': 1, 'connections': 1, 'reused': 0, 'pool_size': 4}
+    """
+
+    def __init__(self,
+                 pool_size=10,
+                 retries=2,
+                 timeout=DEFAULT_TIMEOUT,
+                 backoff_factor=0.3):
+        self.pool_size = pool_size
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff_factor = backoff_factor
+        self._lock = threading.Lock()
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self):
+        """
+        :return: the requests.Session for the current process
+        """
+        pid = os.getpid()
+        if self._session is None or self._pid != pid:
+            with self._lock:
+                if self._session is None or self._pid != pid:
+                    self._session = self._make_session()
+                    self._pid = pid
+        return self._session
+
+    def _make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4,
+                              pool_maxsize=self.pool_size,
+                              max_retries=make_retry(self.retries,
+                                                     self.backoff_factor))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request over the pooled session applying the default timeout
+        when one is not supplied
+
+        :param method: http method name, i.e. 'get', 'post'
+        :param url: the full url
+        :param kwargs: keyword arguments passed on to requests
+        :return: requests.Response
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.request(method.upper(), url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request("get", url, **kwargs)
+
+    def close(self):
+        """
+        Closes all pooled connections
+        """
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._pid = None
+
+    def stats(self):
+        """
+        Connection reuse counters for the current process. 'requests' counts
+        every request sent through the pools (retries included) and
+        'connections' every TCP connection opened; the difference is the
+        number of requests that rode on an already open connection.
+
+        :return: dict
+        """
+        num_requests = 0
+        num_connections = 0
+        session = self._session
+        if session is not None and self._pid == os.getpid():
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in pools.keys():
+                    pool = pools.get(key)
+                    if pool is None:
+                        continue
+                    num_requests += pool.num_requests
+                    num_connections += pool.num_connections
+        return {"requests": num_requests,
+                "connections": num_connections,
+                "reused": max(num_requests - num_connections, 0),
+                "pool_size": self.pool_size}
@@ -0,0 +1,102 @@
+"""
+singleflight.py
+
+Coalesces concurrent identical calls so only one of them does the work and
+every caller receives its result
+
+"""
+import functools
+import threading
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Runs at most one call per key at a time. Threads asking for a key that
+    is already in flight wait for that call and share its result or
+    exception instead of making their own.
+
+    :example:
+        flight = SingleFlight()
+        flight.do("27514", get_postal_code, "27514")
+        flight.stats()
+            {'calls': 1, 'shared': 0, 'in_flight': 0}
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs) unless a call for the key is in flight,
+        in which case its outcome is returned
+
+        :param key: hashable key identifying identical calls
+        :return: the result of the call
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self.calls += 1
+            else:
+                call.waiters += 1
+                leader = False
+                self.shared += 1
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = func(*args, **kwargs)
+            except BaseException as err:
+                call.error = err
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        """
+        :return: dict with the number of calls made, the number of callers
+                 that shared another caller's call and the calls in flight
+        """
+        with self._lock:
+            return {"calls": self.calls,
+                    "shared": self.shared,
+                    "in_flight": len(self._calls)}
+
+
+def coalesce(flight, key=None):
+    """
+    decorator coalescing concurrent calls of the function with the same
+    arguments through a SingleFlight
+
+    :param flight: the SingleFlight to use
+    :param key: optional function building the key from the call arguments,
+                defaults to the arguments themselves
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs) if key \
+                else (args, tuple(sorted(kwargs.items())))
+            return flight.do(call_key, func, *args, **kwargs)
+        wrapper.flight = flight
+        return wrapper
+    return decorator
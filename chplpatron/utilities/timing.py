@@ -0,0 +1,69 @@
+"""
+timing.py
+
+Helpers for recording how long each stage of a request takes
+
+"""
+import contextlib
+import logging
+import time
+
+__author__ = "Mike Stabile, Jeremy Nelson"
+
+
+class StageTimer:
+    """
+    Records the elapsed time of named stages and logs the breakdown
+
+    :param name: name used in the log message
+    :param logger: logger to write to, defaults to this module's logger
+
+    :example:
+        timer = StageTimer("register_patron")
+        with timer.stage("create"):
+            ...
+        timer.log()
+            register_patron timings: create=210.3ms total=210.3ms
+    """
+
+    def __init__(self, name, logger=None):
+        self.name = name
+        self.logger = logger or logging.getLogger(__name__)
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name, seconds):
+        """
+        Adds a stage timing measured elsewhere
+
+        :param name: stage name
+        :param seconds: elapsed seconds
+        """
+        self.stages.append((name, seconds))
+
+    def total(self):
+        return sum(seconds for name, seconds in self.stages)
+
+    def breakdown(self):
+        """
+        :return: dict of stage name to elapsed milliseconds
+        """
+        rtn = {}
+        for name, seconds in self.stages:
+            rtn[name] = rtn.get(name, 0) + round(seconds * 1000, 1)
+        return rtn
+
+    def log(self, level=logging.INFO):
+        self.logger.log(level,
+                        "%s timings: %s total=%.1fms",
+                        self.name,
+                        " ".join("{}={:.1f}ms".format(name, seconds * 1000)
+                                 for name, seconds in self.stages),
+                        self.total() * 1000)
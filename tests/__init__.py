@@ -8,6 +8,15 @@ from .test_esutilities import *
 from .test_patron import *
 from .test_states import *
 from .test_postal_db import *
+from .test_jobqueue import *
+from .test_notifications import *
+from .test_caching import *
+from .test_boundary import *
+from .test_singleflight import *
+from .test_endpoints import *
+from .test_conditional import *
+from .test_export_api import *
+from .test_actions import *
 
 if __name__ == '__main__':
     unittest.main()
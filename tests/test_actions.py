@@ -0,0 +1,66 @@
+import unittest
+import os
+
+from chplpatron import jobqueue
+from chplpatron import trackingdb
+from chplpatron.registration import actions, validation
+
+
+class TestRegisterPatron(unittest.TestCase):
+    form = {"g587-firstname": "new",
+            "g587-lastname": "patron",
+            "g587-birthday": "01/29/01",
+            "g587-telephone": "919-932-2777",
+            "g587-email": "New.Patron@example.org",
+            "g587-address": "100 library dr",
+            "g587-city": "Chapel Hill",
+            "g587-state": "NC",
+            "g587-zipcode": "27514",
+            "g587-password": "1234qwer"}
+    boundary = {"valid": True, "message": "in boundary"}
+
+    def setUp(self):
+        # creates test tracking and job queue databases
+        trackingdb.trackingdb.DB_NAME = "test_tracking_db.sqlite"
+        trackingdb.trackingdb.TRACKING_DB_SETUP = False
+        trackingdb.trackingdb.setup(None)
+        jobqueue.jobqueue.DB_NAME = "test_job_queue.sqlite"
+        jobqueue.jobqueue.JOB_QUEUE_SETUP = False
+        jobqueue.jobqueue.setup(None)
+        self.saved = (validation.EMAIL_FILTER,
+                      actions.USE_JOB_QUEUE,
+                      actions.sierra.create_patron)
+        validation.EMAIL_FILTER = trackingdb.EmailFilter(
+            refresh_interval=3600)
+        actions.sierra.create_patron = lambda patron, **kwargs: "1234567"
+
+    def test_queued_registration_in_email_filter(self):
+        email = self.form["g587-email"]
+        self.assertFalse(validation.EMAIL_FILTER.might_be_registered(email))
+        actions.USE_JOB_QUEUE = True
+        self.assertEqual(actions.register_patron(self.form,
+                                                 "external",
+                                                 self.boundary),
+                         "1234567")
+        # the tracking record is still queued, the filter already knows
+        self.assertIsNone(trackingdb.lookup_email(email))
+        self.assertTrue(validation.EMAIL_FILTER.might_be_registered(email))
+        # and keeps the email when it is rebuilt
+        validation.EMAIL_FILTER._bloom = None
+        self.assertTrue(validation.EMAIL_FILTER.might_be_registered(email))
+
+    def tearDown(self):
+        (validation.EMAIL_FILTER,
+         actions.USE_JOB_QUEUE,
+         actions.sierra.create_patron) = self.saved
+        # deletes the test databases
+        trackingdb.trackingdb.reset_connections()
+        for db_path in (trackingdb.trackingdb.DB_PATH,
+                        jobqueue.jobqueue.DB_PATH):
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(db_path + suffix):
+                    os.remove(db_path + suffix)
+
+
+if __name__ == '__main__':
+    unittest.main()
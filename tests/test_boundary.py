@@ -0,0 +1,87 @@
+import unittest
+import json
+import math
+import os
+import random
+import tempfile
+
+from chplpatron import boundary
+
+
+def square(x1, y1, x2, y2):
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]]
+
+
+class TestBoundary(unittest.TestCase):
+
+    def setUp(self):
+        # a square service area with a square hole and a separate island
+        self.geojson = {
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature",
+                 "geometry": {"type": "Polygon",
+                              "coordinates": [square(-79.1, 35.9,
+                                                     -79.0, 36.0),
+                                              square(-79.06, 35.94,
+                                                     -79.04, 35.96)]}},
+                {"type": "Feature",
+                 "geometry": {"type": "MultiPolygon",
+                              "coordinates": [[square(-78.9, 35.9,
+                                                      -78.85, 35.95)]]}}]}
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+        boundary.POLYGON_PATH = None
+        boundary._INDEX = None
+        boundary._MTIME = None
+
+    def test_contains(self):
+        index = boundary.BoundaryIndex(boundary.parse_shapes(self.geojson))
+        self.assertTrue(index.contains(-79.09, 35.91))
+        self.assertFalse(index.contains(-79.05, 35.95))
+        self.assertTrue(index.contains(-78.875, 35.925))
+        self.assertFalse(index.contains(-78.95, 35.95))
+        self.assertFalse(index.contains(-77.0, 38.9))
+
+    def test_grid_matches_ray_casting(self):
+        index = boundary.BoundaryIndex(boundary.parse_shapes(self.geojson),
+                                       grid_size=16)
+        random.seed(7)
+        for _ in range(2000):
+            x = random.uniform(-79.12, -78.83)
+            y = random.uniform(35.88, 36.02)
+            expected = bool(index.min_y <= y <= index.max_y
+                            and index.min_x <= x <= index.max_x
+                            and index._ray_cast(x, y, index._row(y)))
+            self.assertEqual(index.contains(x, y), expected)
+
+    def test_esri_mercator(self):
+        def mercator(lon, lat):
+            return [math.radians(lon) * boundary.EARTH_RADIUS,
+                    math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+                    * boundary.EARTH_RADIUS]
+
+        esri = {"spatialReference": {"wkid": 102100},
+                "features": [{"geometry": {"rings": [
+                    [mercator(*point) for point in square(-79.1, 35.9,
+                                                          -79.0, 36.0)]]}}]}
+        index = boundary.BoundaryIndex(boundary.parse_shapes(esri))
+        self.assertTrue(index.contains(-79.05, 35.95))
+        self.assertFalse(index.contains(-78.95, 35.95))
+
+    def test_load_from_path(self):
+        path = os.path.join(self.tmp_dir, "boundary.json")
+        self.assertIsNone(boundary.contains(-79.09, 35.91))
+        with open(path, "w") as out:
+            json.dump(self.geojson, out)
+        boundary.POLYGON_PATH = path
+        self.assertTrue(boundary.contains("-79.09", "35.91"))
+        self.assertFalse(boundary.contains(-79.05, 35.95))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import unittest
+import os
+import tempfile
+import time
+
+from chplpatron.utilities.caching import (TTLCache,
+                                          SqliteCacheStore,
+                                          cached,
+                                          MISSING,
+                                          NEGATIVE)
+from chplpatron.exceptions import InvalidPostalCode
+
+
+class TestTTLCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.tmp_dir, "test-cache.sqlite")
+        self.calls = []
+
+    def tearDown(self):
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+
+    def lookup(self, postal_code):
+        self.calls.append(postal_code)
+        if postal_code == "00000":
+            raise InvalidPostalCode(postal_code)
+        return [{"postal_code": postal_code, "city": "Chapel Hill"}]
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIs(cache.get("b"), MISSING)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_expiry(self):
+        cache = TTLCache(ttl=0.05)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.1)
+        self.assertIs(cache.get("a"), MISSING)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_cached_function(self):
+        lookup = cached(TTLCache(), negative=InvalidPostalCode)(self.lookup)
+        first = lookup("27514")
+        first[0]['city'] = "changed"
+        self.assertEqual(lookup("27514")[0]['city'], "Chapel Hill")
+        self.assertEqual(self.calls, ["27514"])
+        stats = lookup.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_negative_caching(self):
+        lookup = cached(TTLCache(), negative=InvalidPostalCode)(self.lookup)
+        for _ in range(3):
+            with self.assertRaises(InvalidPostalCode):
+                lookup("00000")
+        self.assertEqual(self.calls, ["00000"])
+        self.assertEqual(lookup.cache.stats()['negative_hits'], 2)
+
+    def test_shared_store(self):
+        first = TTLCache(store=SqliteCacheStore(self.db_path, "postal_code"))
+        second = TTLCache(store=SqliteCacheStore(self.db_path, "postal_code"))
+        first.set("27514", [{"city": "Chapel Hill"}])
+        first.set_negative("00000")
+        self.assertEqual(second.get("27514"), [{"city": "Chapel Hill"}])
+        self.assertEqual(second.get("00000"), NEGATIVE)
+        self.assertEqual(second.stats()['store_hits'], 2)
+        other = TTLCache(store=SqliteCacheStore(self.db_path, "other"))
+        self.assertIs(other.get("27514"), MISSING)
+
+    def test_store_expiry_kept(self):
+        store = SqliteCacheStore(self.db_path, "postal_code")
+        store.set("27514", ["stored"], time.time() + 0.05)
+        cache = TTLCache(ttl=3600, store=store)
+        self.assertEqual(cache.get("27514"), ["stored"])
+        time.sleep(0.1)
+        # the copy in memory expires with the stored value
+        self.assertIs(cache.get("27514"), MISSING)
+
+    def test_store_errors_fail_open(self):
+        # a directory cannot be opened as a database
+        cache = TTLCache(store=SqliteCacheStore(self.tmp_dir, "postal_code"))
+        lookup = cached(cache, negative=InvalidPostalCode)(self.lookup)
+        self.assertEqual(lookup("27514")[0]['city'], "Chapel Hill")
+        self.assertEqual(lookup("27514")[0]['city'], "Chapel Hill")
+        cache.delete("27514")
+        self.assertEqual(self.calls, ["27514"])
+        self.assertEqual(cache.stats()['store_errors'], 3)
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_store_after_fork(self):
+        store = SqliteCacheStore(self.db_path, "postal_code")
+        # nothing is opened before the first use
+        self.assertFalse(os.path.exists(self.db_path))
+        store.set("27514", ["parent"], time.time() + 60)
+        parent_con = store._connect()
+        pid = os.fork()
+        if pid == 0:
+            ok = store._connect() is not parent_con \
+                and store.get("27514")[0] == ["parent"]
+            os._exit(0 if ok else 1)
+        self.assertEqual(os.waitpid(pid, 0)[1], 0)
+        self.assertIs(store._connect(), parent_con)
+
+
+if __name__ == '__main__':
+    unittest.main()
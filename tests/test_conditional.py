@@ -0,0 +1,58 @@
+import datetime
+import unittest
+
+from flask import Flask
+
+from chplpatron.registration.utilities import conditional
+
+
+class TestConditional(unittest.TestCase):
+
+    def setUp(self):
+        self.version = [1]
+        self.renders = []
+        app = Flask(__name__)
+
+        def validator():
+            return (self.version[0],
+                    datetime.datetime(2019, 3, self.version[0],
+                                      tzinfo=datetime.timezone.utc))
+
+        @app.route("/stats")
+        @conditional(validator)
+        def stats():
+            self.renders.append(1)
+            return "rendered {}".format(self.version[0])
+
+        self.client = app.test_client()
+
+    def test_etag(self):
+        first = self.client.get("/stats")
+        etag = first.headers["ETag"]
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers["Last-Modified"],
+                         "Fri, 01 Mar 2019 00:00:00 GMT")
+        unchanged = self.client.get("/stats",
+                                    headers={"If-None-Match": etag})
+        self.assertEqual(unchanged.status_code, 304)
+        self.assertEqual(len(self.renders), 1)
+        self.version[0] = 2
+        changed = self.client.get("/stats", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.get_data(as_text=True), "rendered 2")
+        self.assertEqual(len(self.renders), 2)
+
+    def test_if_modified_since(self):
+        self.client.get("/stats")
+        response = self.client.get(
+            "/stats",
+            headers={"If-Modified-Since": "Sat, 02 Mar 2019 00:00:00 GMT"})
+        self.assertEqual(response.status_code, 304)
+        # the body is served from memory for other clients
+        response = self.client.get("/stats")
+        self.assertEqual(response.get_data(as_text=True), "rendered 1")
+        self.assertEqual(len(self.renders), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import threading
+import time
+
+import requests
+
+from chplpatron.utilities.endpoints import Endpoint, LatencyWindow
+from chplpatron.utilities.circuitbreaker import CircuitBreaker
+from chplpatron.exceptions import CircuitOpenError
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, value=None):
+        self.status_code = status_code
+        self.value = value
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get(self, url, **kwargs):
+        with self.lock:
+            self.calls += 1
+            outcome = self.responses.pop(0) if self.responses \
+                else FakeResponse()
+        if isinstance(outcome, tuple):
+            delay, outcome = outcome
+            time.sleep(delay)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_open_half_open_close(self):
+        breaker = CircuitBreaker("test", failure_threshold=2,
+                                 reset_timeout=0.05)
+        breaker.record_failure()
+        breaker.check()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertRaises(CircuitOpenError, breaker.check)
+        time.sleep(0.06)
+        breaker.check()
+        # only one trial call is let through
+        self.assertRaises(CircuitOpenError, breaker.check)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        time.sleep(0.06)
+        breaker.check()
+        breaker.record_success()
+        self.assertEqual(breaker.stats(), {"state": "closed",
+                                           "failures": 0,
+                                           "trips": 2,
+                                           "rejected": 2})
+
+
+class TestEndpoint(unittest.TestCase):
+
+    def test_breaker_trips_on_errors(self):
+        session = FakeSession([requests.ConnectionError("down"),
+                               FakeResponse(503)])
+        endpoint = Endpoint("test", session, failure_threshold=2)
+        self.assertRaises(requests.ConnectionError, endpoint.get, "url")
+        self.assertEqual(endpoint.get("url").status_code, 503)
+        self.assertRaises(CircuitOpenError, endpoint.get, "url")
+        self.assertEqual(session.calls, 2)
+        metrics = endpoint.metrics()
+        self.assertEqual(metrics['errors'], 2)
+        self.assertEqual(metrics['circuit_state'], "open")
+
+    def test_hedged_request(self):
+        session = FakeSession([FakeResponse(value="fast")] * 20 +
+                              [(0.5, FakeResponse(value="slow")),
+                               FakeResponse(value="hedge")])
+        endpoint = Endpoint("test", session, hedge=True, min_samples=20)
+        for _ in range(20):
+            endpoint.get("url")
+        start = time.perf_counter()
+        self.assertEqual(endpoint.get("url").value, "hedge")
+        self.assertLess(time.perf_counter() - start, 0.4)
+        self.assertEqual((endpoint.hedges, endpoint.hedge_wins), (1, 1))
+
+    def test_latency_window(self):
+        window = LatencyWindow(size=100)
+        self.assertIsNone(window.percentile(0.95))
+        for value in range(200):
+            window.add(value)
+        self.assertEqual(len(window), 100)
+        self.assertEqual(window.percentile(0.95), 195)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import os
+import unittest
+
+from chplpatron import trackingdb
+from chplpatron.registration import api
+
+
+class TestExportApi(unittest.TestCase):
+
+    def setUp(self):
+        trackingdb.trackingdb.reset_connections()
+        trackingdb.trackingdb.DB_NAME = "test_export_db.sqlite"
+        trackingdb.trackingdb.TRACKING_DB_SETUP = False
+        trackingdb.trackingdb.setup(None)
+        self.client = api.app.test_client()
+        self.internal = api.config.INTERNAL_IP + "1"
+
+    def test_internal_address(self):
+        response = self.client.get("/register/export",
+                                   environ_base={"REMOTE_ADDR": self.internal})
+        self.assertEqual(response.status_code, 200)
+
+    def test_spoofed_forwarded_for(self):
+        response = self.client.get("/register/export",
+                                   headers={"X-Forwarded-For": self.internal},
+                                   environ_base={"REMOTE_ADDR": "203.0.113.9"})
+        self.assertEqual(response.status_code, 403)
+        # behind a trusted proxy only the address it appended is used
+        api.TRUSTED_PROXIES = ("127.0.0.1",)
+        try:
+            response = self.client.get(
+                "/register/export",
+                headers={"X-Forwarded-For":
+                         "{}, 203.0.113.9".format(self.internal)},
+                environ_base={"REMOTE_ADDR": "127.0.0.1"})
+            self.assertEqual(response.status_code, 403)
+        finally:
+            api.TRUSTED_PROXIES = ()
+
+    def test_invalid_dates(self):
+        for query in ("start=2019-13-01", "end=last+week",
+                      "start=2019-01-01'"):
+            response = self.client.get(
+                "/register/export?" + query,
+                environ_base={"REMOTE_ADDR": self.internal})
+            self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            "/register/export?start=2019-01-01&end=2019-12-31",
+            environ_base={"REMOTE_ADDR": self.internal})
+        self.assertEqual(response.status_code, 200)
+
+    def test_registration_location_address(self):
+        # the internal/external location of a registration is not spoofable
+        with api.app.test_request_context(
+                headers={"X-Forwarded-For": self.internal},
+                environ_base={"REMOTE_ADDR": "203.0.113.9"}):
+            self.assertEqual(api.get_calling_address(api.request),
+                             "203.0.113.9")
+        api.TRUSTED_PROXIES = ("127.0.0.1",)
+        try:
+            with api.app.test_request_context(
+                    headers={"X-Forwarded-For": self.internal},
+                    environ_base={"REMOTE_ADDR": "127.0.0.1"}):
+                self.assertEqual(api.get_calling_address(api.request),
+                                 self.internal)
+        finally:
+            api.TRUSTED_PROXIES = ()
+
+    def test_export_token(self):
+        api.EXPORT_TOKEN = "secret"
+        try:
+            response = self.client.get(
+                "/register/export",
+                environ_base={"REMOTE_ADDR": self.internal})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(
+                "/register/export",
+                headers={"X-Export-Token": "secret"},
+                environ_base={"REMOTE_ADDR": self.internal})
+            self.assertEqual(response.status_code, 200)
+        finally:
+            api.EXPORT_TOKEN = None
+
+    def tearDown(self):
+        trackingdb.trackingdb.reset_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(trackingdb.trackingdb.DB_PATH + suffix):
+                os.remove(trackingdb.trackingdb.DB_PATH + suffix)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,42 @@
+import os
+import tempfile
 import unittest
 from chplpatron import geosearch
+from chplpatron.utilities.caching import SqliteCacheStore
+from chplpatron.utilities.endpoints import Endpoint
 
 from chplpatron.exceptions import *
 
 
-class TestGeoSearch(unittest.TestCase):
+class TempGeoCache(unittest.TestCase):
+    """
+    Points the geo caches at a temporary store instead of the shared
+    geo-cache.sqlite
+    """
 
     def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(self.tmp_dir, "test-geo-cache.sqlite")
+        self.stores = (geosearch.POSTAL_CACHE.store,
+                       geosearch.GEOCODE_CACHE.store)
+        geosearch.POSTAL_CACHE.store = SqliteCacheStore(db_path,
+                                                        "postal_code")
+        geosearch.GEOCODE_CACHE.store = SqliteCacheStore(db_path, "geocode")
+
+    def tearDown(self):
+        geosearch.POSTAL_CACHE.clear()
+        geosearch.GEOCODE_CACHE.clear()
+        geosearch.POSTAL_CACHE.store, geosearch.GEOCODE_CACHE.store = \
+            self.stores
+        for name in os.listdir(self.tmp_dir):
+            os.remove(os.path.join(self.tmp_dir, name))
+        os.rmdir(self.tmp_dir)
+
+
+class TestGeoSearch(TempGeoCache):
+
+    def setUp(self):
+        super().setUp()
         self.valid_address = {'street': '100 Library Drive',
                               'city': 'Chapel Hill',
                               'state': 'NC',
@@ -66,8 +96,77 @@ class TestGeoSearch(unittest.TestCase):
         self.assertTrue(geosearch.check_address(**self.test_address))
         self.assertTrue(geosearch.check_address(**self.test_address2))
 
-    def tearDown(self):
-        pass
+
+
+class TestGeocodeCache(TempGeoCache):
+
+    def setUp(self):
+        super().setUp()
+        self.address = {'street': '100 Library Drive #3',
+                        'city': 'chapel hill ',
+                        'state': 'North Carolina',
+                        'postal_code': '27514'}
+        geosearch.POSTAL_CACHE.set('27514', [{'postal_code': '27514',
+                                              'city': 'Chapel Hill',
+                                              'state': 'North Carolina'}])
+
+    def test_normalize_address(self):
+        self.assertEqual(geosearch.normalize_address(self.address),
+                         geosearch.normalize_address(
+                             {'street': '100 LIBRARY DR. Apt 3',
+                              'city': 'Chapel Hill',
+                              'state': 'nc',
+                              'postal_code': '27514-1234'}))
+        self.assertNotEqual(geosearch.normalize_address(self.address),
+                            geosearch.normalize_address(
+                                dict(self.address, street='101 Library Dr')))
+
+    def test_normalize_unit(self):
+        self.assertEqual(geosearch.normalize_address(self.address),
+                         geosearch.normalize_address(
+                             dict(self.address,
+                                  street='100 Library Dr Apt 3B Bldg C')))
+        # a unit word that is part of the street name is kept
+        lot_road = geosearch.normalize_address(dict(self.address,
+                                                    street='100 Lot Rd'))
+        self.assertIn('LOT', lot_road)
+        self.assertNotEqual(lot_road,
+                            geosearch.normalize_address(
+                                dict(self.address, street='100 Suite Rd')))
+        # nor is a street name starting with one
+        for street, key in (('12 Stem', '12+STEM'), ('7 Rms', '7+RMS')):
+            self.assertEqual(geosearch.normalize_address(
+                dict(self.address, street=street)).split('|')[0], key)
+
+    def test_update_city_fallback(self):
+        endpoints = dict(geosearch.ENDPOINTS)
+        self.addCleanup(geosearch.ENDPOINTS.update, endpoints)
+        endpoint = Endpoint("postal_code", geosearch.GEO_SESSION,
+                            failure_threshold=1, reset_timeout=60)
+        endpoint.breaker.record_failure()
+        geosearch.ENDPOINTS['postal_code'] = endpoint
+        # the open circuit is answered from the local postal database
+        self.assertEqual(geosearch.update_city('27516',
+                                               'chapel hill')['city'],
+                         'Chapel Hill')
+        self.assertRaises(InvalidCity, geosearch.update_city, '27516',
+                          'Cary')
+        self.assertEqual(endpoint.calls, 0)
+
+    def test_cached_verdict(self):
+        key = geosearch.normalize_address(dict(self.address,
+                                               city='Chapel Hill'))
+        geosearch.GEOCODE_CACHE.set(key, {'x': -79.03, 'y': 35.93,
+                                          'within': True})
+        self.assertTrue(geosearch.check_address(**self.address))
+        coords = geosearch.get_geo_coords(dict(self.address,
+                                               street='100 library dr'))
+        self.assertEqual((coords['x'], coords['y']), (-79.03, 35.93))
+
+    def test_purge_cache(self):
+        geosearch.GEOCODE_CACHE.set('expired', {'within': True}, ttl=-1)
+        self.assertEqual(geosearch.purge_cache(), 1)
+        self.assertIsNotNone(geosearch.POSTAL_CACHE.get('27514', None))
 
 
 if __name__ == '__main__':
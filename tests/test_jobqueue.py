@@ -0,0 +1,92 @@
+import unittest
+import os
+
+from chplpatron import jobqueue
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        # creates a test database
+        jobqueue.jobqueue.DB_NAME = "test_job_queue.sqlite"
+        jobqueue.jobqueue.JOB_QUEUE_SETUP = False
+        jobqueue.jobqueue.setup(None)
+        self.calls = []
+
+    def record(self, **kwargs):
+        self.calls.append(kwargs)
+
+    def broken(self, **kwargs):
+        self.calls.append(kwargs)
+        raise ValueError("failed")
+
+    def test_enqueue_claim_complete(self):
+        job_id = jobqueue.enqueue("test", {"patron_id": "10"})
+        self.assertEqual(jobqueue.counts()['pending'], 1)
+        job = jobqueue.claim()
+        self.assertEqual(job['id'], job_id)
+        self.assertEqual(job['payload'], {"patron_id": "10"})
+        self.assertEqual(job['attempts'], 1)
+        self.assertIsNone(jobqueue.claim())
+        jobqueue.complete(job_id)
+        self.assertEqual(jobqueue.counts(),
+                         {"pending": 0, "running": 0, "dead": 0})
+
+    def test_expired_lease_is_reclaimed(self):
+        job_id = jobqueue.enqueue("test")
+        self.assertEqual(jobqueue.claim(lease=-1)['id'], job_id)
+        self.assertEqual(jobqueue.claim()['attempts'], 2)
+
+    def test_enqueue_once(self):
+        first = jobqueue.enqueue_once("geo_cache_purge", delay=60)
+        self.assertIsNotNone(first)
+        self.assertIsNone(jobqueue.enqueue_once("geo_cache_purge"))
+        self.assertEqual(jobqueue.counts()["pending"], 1)
+
+    def test_boundary_refresh_reschedules(self):
+        from chplpatron import boundary
+        from chplpatron.jobqueue import handlers
+        refreshed = []
+        self.addCleanup(setattr, boundary, "refresh", boundary.refresh)
+        boundary.refresh = lambda url=None: refreshed.append(url)
+        handlers.boundary_refresh(interval=60)
+        self.assertEqual(refreshed, [None])
+        self.assertEqual(jobqueue.counts()["pending"], 1)
+        # the next refresh is not due yet
+        self.assertIsNone(jobqueue.claim())
+
+    def test_worker(self):
+        jobqueue.enqueue_many([("record", {"value": 1}),
+                               ("record", {"value": 2})])
+        worker = jobqueue.Worker(handlers={"record": self.record})
+        self.assertTrue(worker.run_once())
+        self.assertTrue(worker.run_once())
+        self.assertFalse(worker.run_once())
+        self.assertEqual(self.calls, [{"value": 1}, {"value": 2}])
+
+    def test_retry_then_dead_letter(self):
+        job_id = jobqueue.enqueue("broken", {"value": 1}, max_attempts=2)
+        worker = jobqueue.Worker(handlers={"broken": self.broken}, backoff=0)
+        self.assertTrue(worker.run_once())
+        self.assertEqual(jobqueue.counts()['pending'], 1)
+        self.assertTrue(worker.run_once())
+        self.assertFalse(worker.run_once())
+        self.assertEqual(len(self.calls), 2)
+        dead = jobqueue.dead_jobs()
+        self.assertEqual(dead[0]['id'], job_id)
+        self.assertIn("failed", dead[0]['last_error'])
+        self.assertIsNotNone(jobqueue.requeue_dead(job_id))
+        self.assertEqual(jobqueue.counts(),
+                         {"pending": 1, "running": 0, "dead": 0})
+
+    def tearDown(self):
+        # deletes the test database
+        for suffix in ["", "-wal", "-shm"]:
+            try:
+                os.remove(jobqueue.jobqueue.DB_PATH + suffix)
+            except FileNotFoundError:
+                pass
+
+
+if __name__ == '__main__':
+    unittest.main()
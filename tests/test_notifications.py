@@ -0,0 +1,70 @@
+import unittest
+
+from email.mime.text import MIMEText
+
+from chplpatron.registration.notifications import NotificationSender
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    Controller = None
+
+
+class CollectingHandler:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+def make_msg(number):
+    msg = MIMEText("test message {}".format(number))
+    msg['Subject'] = "New Card Request"
+    msg['From'] = "sender@localhost"
+    msg['To'] = "staff@localhost"
+    return msg
+
+
+@unittest.skipIf(Controller is None, "aiosmtpd is not installed")
+class TestNotificationSender(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = CollectingHandler()
+        self.start_server()
+        self.sender = NotificationSender("127.0.0.1", 8025)
+
+    def start_server(self):
+        self.controller = Controller(self.handler,
+                                     hostname="127.0.0.1",
+                                     port=8025)
+        self.controller.start()
+
+    def test_send_batch(self):
+        futures = [self.sender.send(make_msg(i)) for i in range(5)]
+        for future in futures:
+            self.assertTrue(future.result(10))
+        self.assertEqual(len(self.handler.messages), 5)
+        metrics = self.sender.metrics()
+        self.assertEqual(metrics['sent'], 5)
+        self.assertEqual(metrics['failed'], 0)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertLessEqual(metrics['batches'], 5)
+
+    def test_reconnect(self):
+        self.assertTrue(self.sender.send(make_msg(1)).result(10))
+        # drop the server side of the persistent connection
+        self.controller.stop()
+        self.start_server()
+        self.assertTrue(self.sender.send(make_msg(2)).result(10))
+        self.assertEqual(len(self.handler.messages), 2)
+        self.assertEqual(self.sender.metrics()['reconnects'], 1)
+
+    def tearDown(self):
+        self.sender.close()
+        self.controller.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,8 @@
 import unittest
+import os
+import sqlite3
+import tempfile
+
 from chplpatron import postaldb
 
 from chplpatron.exceptions import *
@@ -47,6 +51,136 @@ class TestPostalCodeDb(unittest.TestCase):
                           postaldb.get_postal_code,
                           '1fsgf2')
 
+    def test_postal_index(self):
+        index = postaldb.PostalIndex.from_rows([
+            ('27514', 'Chapel Hill', 'North Carolina'),
+            ('27516', 'Chapel Hill', 'North Carolina'),
+            ('27516', 'Carrboro', 'North Carolina'),
+            ('27601', 'Raleigh', 'North Carolina')])
+        self.assertEqual(len(index.strings), 4)
+        self.assertEqual([loc['city'] for loc in index.get('27516-1234')],
+                         ['Chapel Hill', 'Carrboro'])
+        self.assertEqual(index.prefix('275'), ['27514', '27516'])
+        self.assertEqual(index.prefix('275', limit=1), ['27514'])
+        self.assertEqual(index.prefix('9'), [])
+        self.assertRaises(InvalidPostalCode, index.get, '27515')
+
+    def test_build(self):
+        tmp_dir = tempfile.mkdtemp()
+        csv_path = os.path.join(tmp_dir, "US.txt")
+        db_path = os.path.join(tmp_dir, "postal-db.sqlite")
+        with open(csv_path, "w") as out:
+            out.write("US\t27514\tChapel Hill\tNorth Carolina\tNC\t"
+                      "Orange\t135\t\t\t35.9203\t-79.0372\t4\n"
+                      "US\t27516\tChapel Hill\tNorth Carolina\tNC\t"
+                      "Orange\t135\t\t\t35.9164\t-79.0999\t4\n")
+        try:
+            self.assertEqual(postaldb.postaldb.build(db_path, csv_path), 2)
+            con = sqlite3.connect(db_path)
+            indexes = [row[1] for row in
+                       con.execute("PRAGMA index_list(resources);")]
+            plan = con.execute("EXPLAIN QUERY PLAN SELECT city "
+                               "FROM resources WHERE postal_code = ?;",
+                               ("27514",)).fetchall()
+            con.close()
+            self.assertIn("resources_postal_city", indexes)
+            self.assertIn("USING COVERING INDEX", plan[0][-1])
+            # the temporary database was renamed into place
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ["US.txt", "postal-db.sqlite"])
+            index = postaldb.PostalIndex.from_sqlite(db_path)
+            self.assertEqual(index.prefix("275"), ["27514", "27516"])
+            # a rebuild keeps the reconciliation results
+            con = sqlite3.connect(db_path)
+            con.execute(postaldb.postaldb.DISCREPANCY_SCHEMA)
+            con.execute("INSERT INTO discrepancies (postal_code, local, "
+                        "remote) VALUES ('27514', 'a', 'b');")
+            con.commit()
+            con.close()
+            postaldb.postaldb.build(db_path, csv_path)
+            con = sqlite3.connect(db_path)
+            self.assertEqual(con.execute("SELECT postal_code, local, remote "
+                                         "FROM discrepancies;").fetchall(),
+                             [("27514", "a", "b")])
+            con.close()
+        finally:
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+            os.rmdir(tmp_dir)
+
+    def test_migrate(self):
+        tmp_dir = tempfile.mkdtemp()
+        db_path = os.path.join(tmp_dir, "postal-db.sqlite")
+        con = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            con.execute("CREATE TABLE resources ("
+                        "id integer PRIMARY KEY AUTOINCREMENT NOT NULL, "
+                        "postal_code text NOT NULL, "
+                        "city text NOT NULL, "
+                        "state_long text NOT NULL, "
+                        "state_short text, "
+                        "lat text, "
+                        "long text) ;")
+            con.execute("INSERT INTO resources (postal_code, city, "
+                        "state_long, state_short, lat, long) "
+                        "VALUES ('00601', 'Adjuntas', 'Puerto Rico', 'PR', "
+                        "'18.1788', '');")
+            self.assertEqual(postaldb.postaldb.schema_version(con), 1)
+            self.assertEqual(postaldb.postaldb.migrate(con), 1)
+            self.assertEqual(postaldb.postaldb.schema_version(con),
+                             postaldb.postaldb.SCHEMA_VERSION)
+            row = con.execute("SELECT city_upper, lat, long "
+                              "FROM resources;").fetchone()
+            self.assertEqual(row, ('ADJUNTAS', 18.1788, None))
+            self.assertEqual(postaldb.postaldb.query_postal_code(
+                con, '00601')[0]['city'], 'Adjuntas')
+        finally:
+            con.close()
+            os.remove(db_path)
+            os.rmdir(tmp_dir)
+
+    def test_find_city(self):
+        self.assertEqual(postaldb.find_city('27514', ' chapel hill')['city'],
+                         'Chapel Hill')
+        self.assertRaises(InvalidCity, postaldb.find_city, '27514', 'Cary')
+
+    def use_temp_db(self):
+        """
+        points the postal database at a temporary file so the shipped
+        postal-db.sqlite is left untouched
+        """
+        tmp_dir = tempfile.mkdtemp()
+        module = postaldb.postaldb
+        saved = (module.DB_PATH, module.POSTAL_DB_SETUP)
+        module.DB_PATH = os.path.join(tmp_dir, "postal-db.sqlite")
+        module.POSTAL_DB_SETUP = None
+
+        def restore():
+            module.DB_PATH, module.POSTAL_DB_SETUP = saved
+            for name in os.listdir(tmp_dir):
+                os.remove(os.path.join(tmp_dir, name))
+            os.rmdir(tmp_dir)
+        self.addCleanup(restore)
+
+    def test_reconcile(self):
+        self.use_temp_db()
+        postal_codes = ['22308', '22309']
+
+        def remote(postal_code):
+            if postal_code == '22308':
+                return [{'postal_code': postal_code,
+                         'city': 'Alexandria',
+                         'state': 'Virginia'}]
+            return [{'postal_code': postal_code,
+                     'city': 'Elsewhere',
+                     'state': 'Virginia'}]
+
+        self.assertEqual(postaldb.reconcile(postal_codes, remote), 1)
+        found = [row['postal_code'] for row in postaldb.discrepancies()]
+        self.assertIn('22309', found)
+        self.assertNotIn('22308', found)
+        self.assertIn('22308', postaldb.postal_codes('2230'))
+
     def tearDown(self):
         pass
 
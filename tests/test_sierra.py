@@ -1,6 +1,13 @@
+import asyncio
+import os
+import tempfile
+import threading
+import time
 import unittest
 import chplpatron.sierra as sierra
 
+from chplpatron import jobqueue
+
 from chplpatron.exceptions import *
 
 
@@ -17,6 +24,273 @@ class TestGetToken(unittest.TestCase):
         pass
 
 
+class FakeResponse:
+    url = "http://localhost/token"
+
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+class FakeTokenApis:
+    """
+    Stands in for the Sierra token endpoints
+    """
+
+    def __init__(self, roles=('Patrons_Read', 'Patrons_Write'), delay=0):
+        self.roles = roles
+        self.delay = delay
+        self.token_calls = 0
+        self.info_calls = 0
+
+    def token(self, **kwargs):
+        self.token_calls += 1
+        time.sleep(self.delay)
+        return FakeResponse({"token_type": "Bearer",
+                             "access_token": "abc{}".format(self.token_calls),
+                             "expires_in": 3600})
+
+    def token_info(self, **kwargs):
+        self.info_calls += 1
+        return FakeResponse({"roles": [{"name": role}
+                                       for role in self.roles]})
+
+
+class TestTokenManager(unittest.TestCase):
+
+    def setUp(self):
+        self.apis = FakeTokenApis(delay=0.05)
+        self.managers = []
+
+    def make_manager(self, **kwargs):
+        manager = sierra.TokenManager(self.apis, "key", "secret", **kwargs)
+        self.managers.append(manager)
+        return manager
+
+    def test_single_flight(self):
+        manager = self.make_manager()
+        tokens = []
+        threads = [threading.Thread(
+                    target=lambda: tokens.append(manager.get_token()))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.apis.token_calls, 1)
+        self.assertEqual(self.apis.info_calls, 1)
+        self.assertEqual(set(tokens), {"Bearer abc1"})
+
+    def test_force_refresh(self):
+        manager = self.make_manager()
+        self.assertEqual(manager.get_token(), "Bearer abc1")
+        self.assertEqual(manager.get_token(), "Bearer abc1")
+        self.assertEqual(manager.get_token(force=True), "Bearer abc2")
+        self.assertEqual(self.apis.token_calls, 2)
+
+    def test_missing_roles(self):
+        self.apis.roles = ('Patrons_Read',)
+        manager = self.make_manager()
+        self.assertRaises(TokenError, manager.get_token)
+
+    def test_shared_store(self):
+        db_path = os.path.join(tempfile.mkdtemp(), "token.sqlite")
+        store = sierra.TokenStore(db_path)
+        first = self.make_manager(store=store)
+        second = self.make_manager(store=store)
+        self.assertEqual(first.get_token(), second.get_token())
+        self.assertEqual(self.apis.token_calls, 1)
+        self.assertEqual(self.apis.info_calls, 1)
+        os.remove(db_path)
+
+    def test_store_lock_timeout(self):
+        db_path = os.path.join(tempfile.mkdtemp(), "token.sqlite")
+        self.apis.delay = 0.5
+        first = self.make_manager(store=sierra.TokenStore(db_path))
+        second = sierra.TokenManager(FakeTokenApis(), "key", "secret",
+                                     store=sierra.TokenStore(db_path,
+                                                             timeout=0.1))
+        self.managers.append(second)
+        thread = threading.Thread(target=first.get_token)
+        thread.start()
+        time.sleep(0.1)
+        self.assertRaises(TokenError, second.get_token)
+        thread.join()
+        self.assertEqual(second.get_token(), first.get_token())
+        os.remove(db_path)
+
+    def tearDown(self):
+        for manager in self.managers:
+            manager.cancel()
+
+
+class FakeLookupApis:
+    """
+    Stands in for the Sierra patrons/query endpoint and patron links
+    """
+
+    def __init__(self, patrons, delay=0.05):
+        self.patrons = patrons
+        self.delay = delay
+        self.fetched = []
+
+    def query(self, **kwargs):
+        return FakeResponse({"entries": [{"link": "http://sierra/{}".format(i)}
+                                         for i in range(len(self.patrons))]})
+
+    def get_link(self, url, **kwargs):
+        index = int(url.split("?")[0].split("/")[-1])
+        time.sleep(self.delay * (index + 1))
+        self.fetched.append(index)
+        return FakeResponse(self.patrons[index])
+
+
+class TestLookupByEmail(unittest.TestCase):
+    email = "reg@email.com"
+
+    def setUp(self):
+        self.apis = sierra.functions.APIS
+        self.tokens = sierra.functions.TOKENS
+        sierra.functions.TOKENS = sierra.TokenManager(FakeTokenApis(),
+                                                      "key",
+                                                      "secret",
+                                                      background_refresh=False)
+        self.patrons = [{"id": 1, "emails": [self.email.upper()]},
+                        {"id": 2, "emails": ["other@email.com"]},
+                        {"id": 3, "emails": []}]
+
+    def test_fan_out(self):
+        sierra.functions.APIS = FakeLookupApis(self.patrons)
+        result = sierra.lookup_by_email(self.email)
+        self.assertEqual([patron['id'] for patron in result], [1, 2, 3])
+
+    def test_first_hit(self):
+        fake = FakeLookupApis(self.patrons)
+        sierra.functions.APIS = fake
+        result = sierra.lookup_by_email(self.email, first_hit=True)
+        self.assertEqual([patron['id'] for patron in result], [1])
+        self.assertRaises(RegisteredEmailError,
+                          sierra.check_email,
+                          self.email)
+
+    def test_no_match(self):
+        sierra.functions.APIS = FakeLookupApis(self.patrons[1:])
+        self.assertTrue(sierra.check_email(self.email))
+
+    def tearDown(self):
+        sierra.functions.APIS = self.apis
+        sierra.functions.TOKENS = self.tokens
+
+
+class FakeCreateApis:
+    """
+    Stands in for the Sierra create and update patron endpoints
+    """
+
+    def __init__(self, update_failures=0):
+        self.calls = []
+        self.update_failures = update_failures
+
+    def create_patron(self, **kwargs):
+        self.calls.append(("create", kwargs['json']))
+        return FakeResponse({"link": "http://sierra/patrons/1234"})
+
+    def patron_update(self, patron_id, **kwargs):
+        self.calls.append(("update", kwargs['json']))
+        if self.update_failures:
+            self.update_failures -= 1
+            return FakeResponse({}, 500)
+        return FakeResponse({}, 204)
+
+
+class TestCreatePatron(unittest.TestCase):
+
+    def setUp(self):
+        self.apis = sierra.functions.APIS
+        self.tokens = sierra.functions.TOKENS
+        sierra.functions.TOKENS = sierra.TokenManager(FakeTokenApis(),
+                                                      "key",
+                                                      "secret",
+                                                      background_refresh=False)
+        jobqueue.jobqueue.DB_NAME = "test_sierra_job_queue.sqlite"
+        jobqueue.jobqueue.JOB_QUEUE_SETUP = False
+        jobqueue.jobqueue.setup(None)
+
+    def test_barcode_supplied(self):
+        fake = FakeCreateApis()
+        sierra.functions.APIS = fake
+        self.assertEqual(sierra.create_patron(sierra.Patron(), "5678"),
+                         "1234")
+        self.assertEqual(len(fake.calls), 1)
+        self.assertEqual(fake.calls[0][1]['barcodes'], ["5678"])
+
+    def test_inline(self):
+        fake = FakeCreateApis()
+        sierra.functions.APIS = fake
+        sierra.create_patron(sierra.Patron(), barcode_mode="inline")
+        self.assertEqual([call[0] for call in fake.calls],
+                         ["create", "update"])
+        self.assertEqual(fake.calls[1][1]['barcodes'], ["1234"])
+
+    def test_deferred_with_retry(self):
+        fake = FakeCreateApis(update_failures=2)
+        sierra.functions.APIS = fake
+        sierra.create_patron(sierra.Patron(), barcode_mode="deferred")
+        self.assertEqual([call[0] for call in fake.calls], ["create"])
+        # the barcode is set by the job queue worker
+        worker = jobqueue.Worker(backoff=0)
+        while worker.run_once():
+            pass
+        self.assertEqual([call[0] for call in fake.calls],
+                         ["create", "update", "update", "update"])
+        self.assertEqual(jobqueue.counts(),
+                         {"pending": 0, "running": 0, "dead": 0})
+
+    def test_none(self):
+        fake = FakeCreateApis()
+        sierra.functions.APIS = fake
+        sierra.create_patron(sierra.Patron(), barcode_mode="none")
+        self.assertEqual([call[0] for call in fake.calls], ["create"])
+        self.assertEqual(jobqueue.counts()["pending"], 0)
+
+    def test_async_none(self):
+        from chplpatron.sierra import aiofunctions
+        fake = FakeCreateApis()
+
+        class FakeAsyncApis:
+            async def create_patron(self, **kwargs):
+                return fake.create_patron(**kwargs)
+
+        apis, tokens = aiofunctions.AIO_APIS, aiofunctions.TOKENS
+        aiofunctions.AIO_APIS = FakeAsyncApis()
+        aiofunctions.TOKENS = sierra.functions.TOKENS
+        try:
+            loop = asyncio.new_event_loop()
+            try:
+                self.assertEqual(loop.run_until_complete(
+                    aiofunctions.create_patron(sierra.Patron(),
+                                               barcode_mode="none")),
+                    "1234")
+            finally:
+                loop.close()
+        finally:
+            aiofunctions.AIO_APIS, aiofunctions.TOKENS = apis, tokens
+        self.assertEqual([call[0] for call in fake.calls], ["create"])
+        self.assertEqual(jobqueue.counts()["pending"], 0)
+
+    def tearDown(self):
+        sierra.functions.APIS = self.apis
+        sierra.functions.TOKENS = self.tokens
+        if os.path.exists(jobqueue.jobqueue.DB_PATH):
+            os.remove(jobqueue.jobqueue.DB_PATH)
+        jobqueue.jobqueue.DB_NAME = "job-queue.sqlite"
+        jobqueue.jobqueue.JOB_QUEUE_SETUP = False
+
+
 @unittest.skip
 class TestRegister(unittest.TestCase):
 
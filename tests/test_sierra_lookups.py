@@ -1,8 +1,10 @@
+import asyncio
 import unittest
 import pprint
 import simplejson
 
 from chplpatron.sierra import lookups
+from chplpatron.sierra import aiolookups
 
 
 class TestUrls(unittest.TestCase):
@@ -32,5 +34,114 @@ class TestUrls(unittest.TestCase):
         pass
 
 
+class TestAsyncUrls(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def test_urls_match_sync(self):
+        urls = lookups.Apis()
+        aio_urls = aiolookups.AsyncApis()
+        run = self.loop.run_until_complete
+        self.assertEqual(run(aio_urls.find(["n", "DOE, JOHN"], test=True)),
+                         urls.find(["n", "DOE, JOHN"], test=True))
+        self.assertEqual(run(aio_urls.patron_update({"key": "1234"},
+                                                    test=True)),
+                         urls.patron_update({"key": "1234"}, test=True))
+        self.assertRaises(lookups.UrlMissingKeyId,
+                          run,
+                          aio_urls.patron_update())
+
+    def test_request(self):
+        sent = []
+
+        def handler(request):
+            sent.append(request)
+            return aiolookups.httpx.Response(204)
+
+        async def call():
+            apis = aiolookups.AsyncApis()
+            transport = aiolookups.httpx.MockTransport(handler)
+            apis._new_client = lambda: aiolookups.httpx.AsyncClient(
+                transport=transport)
+            response = await apis.patron_update("1234", json={"a": 1})
+            await apis.aclose()
+            return response
+
+        response = self.loop.run_until_complete(call())
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(sent[0].method, "PUT")
+        self.assertTrue(str(sent[0].url).endswith("patrons/1234"))
+
+    def test_client_per_loop(self):
+        clients = []
+
+        def new_client():
+            transport = aiolookups.httpx.MockTransport(
+                lambda request: aiolookups.httpx.Response(204))
+            clients.append(aiolookups.httpx.AsyncClient(transport=transport))
+            return clients[-1]
+
+        apis = aiolookups.AsyncApis()
+        apis._new_client = new_client
+
+        async def call():
+            await apis.get_link("https://example.org/a")
+            await apis.get_link("https://example.org/b")
+
+        self.loop.run_until_complete(call())
+        self.assertEqual(len(clients), 1)
+        self.assertFalse(clients[0].is_closed)
+        # the loop's client is closed as the loop shuts down
+        self.loop.run_until_complete(self.loop.shutdown_asyncgens())
+        self.assertTrue(clients[0].is_closed)
+
+        asyncio.run(call())
+        self.assertEqual(len(clients), 2)
+        self.assertTrue(clients[1].is_closed)
+
+    def test_aclose(self):
+        apis = aiolookups.AsyncApis()
+
+        async def call():
+            client = await apis.client()
+            await apis.aclose()
+            return client
+
+        client = self.loop.run_until_complete(call())
+        self.assertTrue(client.is_closed)
+        self.assertEqual(len(apis._clients), 0)
+
+    def tearDown(self):
+        self.loop.close()
+
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        self.apis = lookups.Apis(pool_size=2)
+
+    def test_shared_session(self):
+        self.assertIs(self.apis.find.session, self.apis.patron_get.session)
+        self.assertIs(self.apis.find.session, self.apis.session)
+        self.assertEqual(self.apis.session.pool_size, 2)
+
+    def test_stats(self):
+        stats = self.apis.stats()
+        self.assertEqual(stats['requests'], 0)
+        self.assertEqual(stats['reused'], 0)
+        self.assertEqual(stats['pool_size'], 2)
+
+    def test_session_recreated_after_fork(self):
+        session = self.apis.session.session
+        self.assertIs(session, self.apis.session.session)
+        # simulate running in a forked worker
+        self.apis.session._pid = -1
+        self.assertIsNot(session, self.apis.session.session)
+
+    def tearDown(self):
+        self.apis.session.close()
+
+
 if __name__ == '__main__':
     unittest.main()
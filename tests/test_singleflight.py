@@ -0,0 +1,62 @@
+import unittest
+import threading
+import time
+
+from chplpatron.utilities.singleflight import SingleFlight, coalesce
+from chplpatron.exceptions import InvalidPostalCode
+
+
+class TestSingleFlight(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = SingleFlight()
+        self.calls = []
+        self.release = threading.Event()
+
+    def lookup(self, postal_code):
+        self.calls.append(postal_code)
+        self.release.wait(5)
+        if postal_code == "00000":
+            raise InvalidPostalCode(postal_code)
+        return [{"postal_code": postal_code}]
+
+    def run_threads(self, func, *args, count=5):
+        results = []
+
+        def target():
+            try:
+                results.append(func(*args))
+            except Exception as err:
+                results.append(err)
+
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        while self.flight.stats()['shared'] < count - 1:
+            time.sleep(0.01)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_coalesce(self):
+        lookup = coalesce(self.flight)(self.lookup)
+        results = self.run_threads(lookup, "27514")
+        self.assertEqual(self.calls, ["27514"])
+        self.assertEqual(results, [[{"postal_code": "27514"}]] * 5)
+        self.assertEqual(self.flight.stats(),
+                         {"calls": 1, "shared": 4, "in_flight": 0})
+        # a later call is not coalesced with a finished one
+        lookup("27514")
+        self.assertEqual(len(self.calls), 2)
+
+    def test_shared_exception(self):
+        results = self.run_threads(self.flight.do, "00000", self.lookup,
+                                   "00000")
+        self.assertEqual(self.calls, ["00000"])
+        self.assertTrue(all(isinstance(result, InvalidPostalCode)
+                            for result in results))
+
+
+if __name__ == '__main__':
+    unittest.main()
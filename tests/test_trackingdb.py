@@ -1,5 +1,9 @@
+import gc
+import json
+import threading
 import unittest
 import os
+import sqlite3
 
 from chplpatron import trackingdb
 from chplpatron.exceptions import RegisteredEmailError
@@ -35,13 +39,215 @@ class TestTrackingDb(unittest.TestCase):
         self.assertIsNotNone(trackingdb.lookup_card_number(10))
         self.assertIsNone(trackingdb.lookup_card_number(12))
 
-    # def test_load_old_data(self):
-    #     trackingdb.trackingdb.load_old_data("/home/stabiledev/git/"
-    #                                         "chpl-patron/card-requests.sqlite")
+    def test_email_filter(self):
+        email_filter = trackingdb.EmailFilter(capacity=2, refresh_interval=0)
+        self.assertTrue(email_filter.might_be_registered(self.test_email))
+        self.assertFalse(email_filter.might_be_registered("new@email.com"))
+        trackingdb.add_registration(11, "new@email.com")
+        trackingdb.add_registration(12, "other@email.com")
+        self.assertTrue(email_filter.might_be_registered("NEW@email.com"))
+        # the filter is rebuilt larger once it holds more than its capacity
+        self.assertEqual(email_filter.stats()['count'], 3)
+        self.assertEqual(email_filter.rebuilds, 2)
+
+    def test_email_filter_rebuild(self):
+        from chplpatron.trackingdb import emailfilter
+        email_filter = trackingdb.EmailFilter(capacity=1, refresh_interval=0)
+        self.assertTrue(email_filter.might_be_registered(self.test_email))
+        trackingdb.add_registration(11, "new@email.com")
+        answers = []
+        email_hashes = emailfilter.trackingdb.email_hashes
+
+        def probed_email_hashes(after_id=0):
+            # what other threads see while the filter is refreshed
+            answers.append(trackingdb.hash_email(self.test_email)
+                           in email_filter._bloom)
+            return email_hashes(after_id)
+
+        emailfilter.trackingdb.email_hashes = probed_email_hashes
+        try:
+            self.assertTrue(email_filter.might_be_registered("new@email.com"))
+        finally:
+            emailfilter.trackingdb.email_hashes = email_hashes
+        # one incremental read and one rebuild at twice the capacity
+        self.assertEqual(answers, [True, True])
+
+    def test_email_filter_export(self):
+        export_path = os.path.join(os.path.dirname(
+            trackingdb.trackingdb.DB_PATH), "test-email-export.txt")
+        with open(export_path, "w") as export:
+            export.write("desk@email.com\n{}\n".format(
+                trackingdb.hash_email("digest@email.com")))
+        try:
+            email_filter = trackingdb.EmailFilter(export_path)
+            self.assertTrue(email_filter.might_be_registered("desk@email.com"))
+            self.assertTrue(
+                email_filter.might_be_registered("digest@email.com"))
+            self.assertFalse(email_filter.might_be_registered("no@email.com"))
+        finally:
+            os.remove(export_path)
+
+    def test_import_legacy(self):
+        old_db_path = os.path.join(os.path.dirname(
+            trackingdb.trackingdb.DB_PATH), "test-legacy.sqlite")
+        old_con = sqlite3.connect(old_db_path)
+        old_con.execute("CREATE TABLE LibraryCardRequest ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,"
+                        "date DATETIME DEFAULT CURRENT_TIMESTAMP,"
+                        "date_retrieved DATETIME,"
+                        "patron_id VARCHAR NOT NULL UNIQUE,"
+                        "email VARCHAR NOT NULL UNIQUE);")
+        # patron 10 is already in the test database
+        old_con.executemany("INSERT INTO LibraryCardRequest "
+                            "(patron_id, email) VALUES (?, ?);",
+                            [(str(i), "old{}".format(i))
+                             for i in range(8, 13)])
+        old_con.commit()
+        old_con.close()
+        calls = []
+
+        def interrupt(state, max_id):
+            calls.append(state["last_id"])
+            if len(calls) == 1:
+                raise KeyboardInterrupt
+
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                trackingdb.trackingdb.import_legacy(old_db_path, chunk=2,
+                                                    progress=interrupt)
+            state = trackingdb.trackingdb.import_legacy(old_db_path, chunk=2,
+                                                        progress=interrupt)
+            self.assertEqual(calls, [2, 4, 5])
+            self.assertEqual((state["imported"], state["skipped"]), (4, 1))
+            self.assertEqual(trackingdb.lookup_card_number(10)[4],
+                             trackingdb.hash_email(self.test_email))
+            self.assertEqual(trackingdb.lookup_card_number(12)[4], "old12")
+            # nothing new to import
+            self.assertEqual(trackingdb.trackingdb.load_old_data(old_db_path),
+                             state)
+        finally:
+            os.remove(old_db_path)
+
+    def test_connection_reuse(self):
+        con = trackingdb.trackingdb.get_connection()
+        trackingdb.lookup_email(self.test_email)
+        self.assertIs(trackingdb.trackingdb.get_connection(), con)
+        self.assertEqual(con.execute("PRAGMA journal_mode;").fetchone()[0],
+                         "wal")
+        with self.assertRaises(ValueError):
+            with trackingdb.trackingdb.connection() as con:
+                con.execute("INSERT INTO LibraryCardRequest "
+                            "(email, patron_id) VALUES ('x', '99');")
+                raise ValueError("rolled back")
+        self.assertIsNone(trackingdb.lookup_card_number(99))
+
+    def test_migrations(self):
+        con = trackingdb.trackingdb.get_connection()
+        self.assertEqual(trackingdb.trackingdb.schema_version(con),
+                         trackingdb.trackingdb.MIGRATIONS[-1][0])
+        indexes = [row[0] for row in con.execute(
+            "SELECT name FROM sqlite_master WHERE type='index';")]
+        self.assertIn("LibraryCardRequest_email", indexes)
+        self.assertIn("LibraryCardRequest_date", indexes)
+        # databases from before the SchemaVersion table are detected
+        con.execute("DROP TABLE SchemaVersion;")
+        con.commit()
+        self.assertEqual(trackingdb.trackingdb.schema_version(con), 2)
+        trackingdb.trackingdb.migrate()
+        self.assertEqual(con.execute("SELECT count(*) FROM SchemaVersion;")
+                         .fetchone()[0], len(trackingdb.trackingdb.MIGRATIONS))
+        self.assertIsNotNone(trackingdb.lookup_email(self.test_email))
+
+    def test_registration_counts(self):
+        trackingdb.add_registration(11, "a@email.com", "internal", 1)
+        trackingdb.add_registration(12, "b@email.com", "external", 0)
+        with trackingdb.trackingdb.connection() as con:
+            con.execute("UPDATE LibraryCardRequest SET date='2019-03-02' "
+                        "WHERE patron_id='11';")
+            con.execute("DELETE FROM LibraryCardRequest "
+                        "WHERE patron_id='12';")
+        self.assertEqual(trackingdb.registration_counts(
+            "month", start="2019-03-01", end="2019-03-31"),
+            [("2019-03", 1)])
+        self.assertEqual(trackingdb.registration_counts(
+            "year", end="2019-12-31", by=["location", "boundary"]),
+            [("2019", "internal", 1, 1)])
+        # the rollup matches counting the registrations themselves
+        with trackingdb.trackingdb.connection() as con:
+            expected = con.execute(
+                "SELECT strftime('%Y-%m', date), count(*) "
+                "FROM LibraryCardRequest GROUP BY 1 ORDER BY 1;").fetchall()
+        self.assertEqual(trackingdb.registration_by_month(), expected)
+        self.assertRaises(ValueError, trackingdb.registration_counts, "week")
+
+    def test_last_write(self):
+        last_id, last_date = trackingdb.last_write()
+        self.assertIsNotNone(last_date)
+        trackingdb.add_registration(11, "a@email.com")
+        self.assertEqual(trackingdb.last_write()[0], last_id + 1)
+
+    def test_iter_registrations(self):
+        for patron_id in range(11, 15):
+            trackingdb.add_registration(patron_id,
+                                        "{}@email.com".format(patron_id))
+        with trackingdb.trackingdb.connection() as con:
+            con.execute("UPDATE LibraryCardRequest SET date='2019-03-02' "
+                        "WHERE patron_id='12';")
+        rows = list(trackingdb.iter_registrations(batch=2))
+        self.assertEqual([row[3] for row in rows],
+                         ["10", "11", "12", "13", "14"])
+        resumed = trackingdb.iter_registrations(after_id=rows[1][0], limit=2)
+        self.assertEqual([row[3] for row in resumed], ["12", "13"])
+        march = trackingdb.iter_registrations(start="2019-03-01",
+                                              end="2019-03-02")
+        self.assertEqual([row[3] for row in march], ["12"])
+
+    def test_export(self):
+        from chplpatron.trackingdb import export
+        csv_lines = "".join(export.stream("csv")).splitlines()
+        self.assertEqual(csv_lines[0].split(","),
+                         trackingdb.columns())
+        self.assertEqual(len(csv_lines), 2)
+        ndjson = "".join(export.stream("ndjson", after_id=0))
+        self.assertEqual(json.loads(ndjson)["email"],
+                         trackingdb.hash_email(self.test_email))
+        self.assertRaises(ValueError, export.stream, "xml")
+
+    def test_thread_connection_closed(self):
+        opened = []
+
+        def request():
+            opened.append(trackingdb.trackingdb.get_connection())
+
+        for _ in range(5):
+            thread = threading.Thread(target=request)
+            thread.start()
+            thread.join()
+        gc.collect()
+        self.assertEqual(len(opened), 5)
+        for con in opened:
+            self.assertRaises(sqlite3.ProgrammingError, con.execute,
+                              "SELECT 1")
+        # only this thread's connection is left open
+        self.assertEqual(len(trackingdb.trackingdb._CONNECTIONS), 1)
+
+    @unittest.skipUnless(os.environ.get("TRACKINGDB_LOAD_TEST"),
+                         "set TRACKINGDB_LOAD_TEST to run the 1M row test")
+    def test_load(self):
+        from chplpatron.trackingdb import loadtest
+        results = loadtest.run(rows=1000000)
+        self.assertIn("USING INDEX", results["after"]["plan"])
+        self.assertLess(results["after"]["email_us"], 1000)
+        self.assertLess(results["after"]["card_us"], 1000)
+        self.assertLess(results["statistics"]["rollup_ms"],
+                        results["statistics"]["scan_ms"])
 
     def tearDown(self):
         # deletes the test database
-        os.remove(trackingdb.trackingdb.DB_PATH)
+        trackingdb.trackingdb.reset_connections()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(trackingdb.trackingdb.DB_PATH + suffix):
+                os.remove(trackingdb.trackingdb.DB_PATH + suffix)
 
 
 if __name__ == '__main__':
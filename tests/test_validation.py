@@ -1,6 +1,7 @@
 import unittest
 
 from chplpatron.registration import validation
+from chplpatron.exceptions import InvalidPostalCode
 
 
 class TestValidation(unittest.TestCase):
@@ -54,6 +55,72 @@ class TestValidation(unittest.TestCase):
         test_form["g587-email"] = "maadsf"
         self.assertFalse(validation.validate_form(test_form)['valid'])
 
+    def test_local_first_postal_code(self):
+        remote_calls = []
+
+        def remote(postal_code):
+            remote_calls.append(postal_code)
+            raise InvalidPostalCode(postal_code)
+
+        get_postal_code = validation.geosearch.get_postal_code
+        validation.geosearch.get_postal_code = remote
+        try:
+            result = validation.postal_code("27514", mode="local_first")
+            self.assertTrue(result['valid'])
+            self.assertIn("Chapel Hill", result['data']['city'])
+            self.assertEqual(remote_calls, [])
+            result = validation.postal_code("00000", mode="local_first")
+            self.assertFalse(result['valid'])
+            self.assertEqual(remote_calls, ["00000"])
+        finally:
+            validation.geosearch.get_postal_code = get_postal_code
+
+    def test_error_order(self):
+        form = {
+            "g587-birthday": "not a date",
+            "g587-email": "maadsf",
+            "g587-zipcode": "00000",
+            "g587-password": "adf%$#%3"
+        }
+        errors = validation.validate_form(form)['errors']
+        self.assertEqual([error['field'] for error in errors],
+                         ["g587-zipcode", "g587-birthday", "g587-password",
+                          "g587-email"])
+
+    def test_start_boundary_check(self):
+        form = {"g587-address": "100 library dr",
+                "g587-zipcode": "27514",
+                "g587-state": "NC"}
+        self.assertEqual(validation.start_boundary_check(form), (None, None))
+        checked = []
+
+        def check_address(**address):
+            checked.append(address)
+            return True
+
+        form["g587-city"] = "Chapel Hill"
+        original = validation.geosearch.check_address
+        validation.geosearch.check_address = check_address
+        try:
+            address, future = validation.start_boundary_check(form)
+            self.assertTrue(future.result()['valid'])
+        finally:
+            validation.geosearch.check_address = original
+        self.assertEqual(address, validation.form_address(form))
+        self.assertEqual(checked, [address])
+
+    def test_postal_code_open_circuit(self):
+        endpoint = validation.geosearch.ENDPOINTS['postal_code']
+        for _ in range(endpoint.breaker.failure_threshold):
+            endpoint.breaker.record_failure()
+        validation.geosearch.POSTAL_CACHE.delete("27516")
+        try:
+            result = validation.postal_code("27516", mode="remote_first")
+            self.assertTrue(result['valid'])
+            self.assertIn("Chapel Hill", result['data']['city'])
+        finally:
+            endpoint.breaker.record_success()
+
     def tearDown(self):
         pass
 